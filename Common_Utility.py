@@ -1,12 +1,11 @@
 from __future__ import annotations
-import itertools, re, pickle, subprocess, sys
+import heapq, itertools, json, re, time, weakref
 from pathlib import Path
-import networkx as nx
-import graphviz
 import igraph as ig
-from itertools import combinations
-from concurrent.futures import ThreadPoolExecutor
-from threading import Lock
+import numpy as np
+from typing import Iterator, NamedTuple
+from db_parser import ParsedDB, parse_dbs
+from instrument import count, phase
 
 
 # ---------- 定数 ------------------------------------------------------
@@ -17,6 +16,74 @@ W_BLUE  = 0.5   # 同一 L2 dotted weight (青)
 PEN_L1 = "3.0"   # L1 最短経路線幅
 PEN_L2 = "2.0"   # L2 追加エッジ線幅
 
+# ---------- 重みプロファイル ------------------------------------------
+#
+# 探索は各エッジの weight 属性ではなくエッジ種別 (color) を見て、問い合わせ
+# 毎に渡された Weights を適用する。W_* は既定プロファイルと、キャッシュに
+# 記録する構築時の weight 列にだけ使う。黒の重みは全エッジ共通なので、
+# L1 最短経路の集合は黒の重み (> 0) に依らず、コストだけが比例する。
+
+class Weights(NamedTuple):
+    """エッジ種別毎の重み"""
+    black: float = W_BLACK
+    red: float = W_RED
+    blue: float = W_BLUE
+
+    def of(self, color: str | None) -> float:
+        return getattr(self, color) if color in self._fields else float("inf")
+
+
+DEFAULT_WEIGHTS = Weights()
+WEIGHT_PROFILES: dict[str, Weights] = {
+    "default": DEFAULT_WEIGHTS,
+    "uniform": Weights(1.0, 1.0, 1.0),     # 種別を区別しない (ホップ数)
+    "free_blue": Weights(1.0, 1.0, 0.0),   # 同一 L2 内の移動を無料とみなす
+}
+
+
+def _checked(w: Weights) -> Weights:
+    if not w.black > 0 or w.red < 0 or w.blue < 0:
+        raise ValueError(f"invalid weights {w._asdict()}: black must be > 0, red/blue >= 0")
+    return w
+
+
+def parse_weights(spec: str | dict | None, profiles: dict[str, Weights] | None = None) -> Weights:
+    """重み指定を Weights にする
+
+    spec はプロファイル名 ("uniform")、上書き ("red=2,blue=0.25")、その組合せ
+    ("uniform,blue=0")、または {"red": 2, ...} の dict。None は既定プロファイル。
+    """
+    profiles = WEIGHT_PROFILES if profiles is None else profiles
+    if spec is None:
+        return DEFAULT_WEIGHTS
+    if isinstance(spec, dict):
+        items = list(spec.items())
+        base = DEFAULT_WEIGHTS
+    else:
+        items, base = [], DEFAULT_WEIGHTS
+        for part in filter(None, (x.strip() for x in spec.split(","))):
+            if "=" in part:
+                key, val = part.split("=", 1)
+                items.append((key.strip(), val))
+            elif part in profiles:
+                base = profiles[part]
+            else:
+                raise ValueError(f"unknown weight profile {part!r} (known: {', '.join(profiles)})")
+    unknown = [key for key, _ in items if key not in Weights._fields]
+    if unknown:
+        raise ValueError(f"unknown edge type(s) {', '.join(unknown)} (expected black/red/blue)")
+    try:
+        w = base._replace(**{key: float(val) for key, val in items})
+    except (TypeError, ValueError) as exc:
+        raise ValueError(f"invalid weights {spec!r}: {exc}") from None
+    return _checked(w)
+
+
+def load_weight_profiles(path: Path) -> dict[str, Weights]:
+    """{"名前": {"black": .., "red": .., "blue": ..}, ...} の JSON を既定プロファイルに追加して返す"""
+    data = json.loads(Path(path).read_text(encoding="utf-8"))
+    return {**WEIGHT_PROFILES, **{name: parse_weights(spec) for name, spec in data.items()}}
+
 # ---------- グラフ構築ロジック ----------------------------------------
 
 def auto_prefix(l1l2_path: Path) -> str:
@@ -25,248 +92,776 @@ def auto_prefix(l1l2_path: Path) -> str:
     return m.group(1) if m else "graph"
 
 
-def build_graph(l1l2_path: Path, l2_path: Path) -> tuple[ig.Graph, dict[int, str], dict[int, str]]:
-    lines = l1l2_path.read_text(encoding="utf-8").splitlines()
-    n_nodes = int(lines[0].split()[0])
+def _pair_keys(u: np.ndarray, v: np.ndarray, n: int) -> np.ndarray:
+    """無向エッジ (u, v) を (min, max) 正規化した int64 キーに変換"""
+    lo = np.minimum(u, v).astype(np.int64)
+    hi = np.maximum(u, v).astype(np.int64)
+    return lo * n + hi
+
+
+def _unique_index(u: np.ndarray, v: np.ndarray, n: int, seen: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """重複と seen 済みキーを除いて残すエッジの位置 (初出順) と全エッジのキー"""
+    with phase("build.dedup"):
+        keys = _pair_keys(u, v, n)
+        _, first = np.unique(keys, return_index=True)
+        first.sort()
+        keep = first[~np.isin(keys[first], seen)]
+    count("dedup.rejected", len(u) - len(keep))
+    return keep, keys
+
+
+def _unique_edges(u: np.ndarray, v: np.ndarray, n: int, seen: np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """初出順を保ったまま重複と seen 済みキーを除いたエッジを返す"""
+    keep, keys = _unique_index(u, v, n, seen)
+    return u[keep], v[keep], keys[keep]
+
+
+def _red_edge_arrays(l2_pairs: list[tuple[str, str]], L2code_to_L1num: dict[str, np.ndarray], *,
+                     pair_index: bool = False) -> tuple[np.ndarray, ...]:
+    """L2 エッジ (a, b) ごとに |a|×|b| の直積を配列で展開
+
+    pair_index=True では各エッジの元になった l2_pairs の位置も返す。
+    """
+    us, vs, ps = [], [], []
+    for i, (la, lb) in enumerate(l2_pairs):
+        A = L2code_to_L1num.get(la)
+        B = L2code_to_L1num.get(lb)
+        if A is None or B is None:
+            continue
+        us.append(np.repeat(A, len(B)))
+        vs.append(np.tile(B, len(A)))
+        ps.append(np.full(len(A) * len(B), i, dtype=np.int64))
+    if not us:
+        return (np.empty(0, np.int64),) * (3 if pair_index else 2)
+    u, v = np.concatenate(us), np.concatenate(vs)
+    loop = u != v
+    if pair_index:
+        return u[loop], v[loop], np.concatenate(ps)[loop]
+    return u[loop], v[loop]
+
+
+def _blue_edge_arrays(L2code_to_L1num: dict[str, np.ndarray], max_class: int | None = 100) -> tuple[np.ndarray, np.ndarray]:
+    """同一 L2 コード内の全組合せ (combinations 順) を配列で展開"""
+    us, vs = [], []
+    for nodes in L2code_to_L1num.values():
+        if max_class is not None and len(nodes) > max_class:  # 組合せ爆発対策
+            count("blue.classes_skipped")
+            continue
+        i, j = np.triu_indices(len(nodes), 1)
+        us.append(nodes[i])
+        vs.append(nodes[j])
+    if not us:
+        return np.empty(0, np.int64), np.empty(0, np.int64)
+    return np.concatenate(us), np.concatenate(vs)
+
+
+def _directed_actions(keys: np.ndarray, fwd: np.ndarray, action: np.ndarray,
+                      keep: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """keep の各エッジについて min → max / max → min 向きの初出行の操作番号 (無ければ -1)
+
+    keys は全行のペアキー、fwd は各行が min → max 向き (u <= v) に書かれているか。
+    """
+    if not len(keys):
+        return np.empty(0, np.int32), np.empty(0, np.int32)
+    uk, first = np.unique(keys * 2 + ~fwd, return_index=True)
+    out = []
+    for d in (0, 1):
+        want = keys[keep] * 2 + d
+        pos = np.minimum(np.searchsorted(uk, want), len(uk) - 1)
+        out.append(np.where(uk[pos] == want, action[first[pos]], -1).astype(np.int32))
+    return out[0], out[1]
+
+
+def _add_edge_layer(ig_g: ig.Graph, u: np.ndarray, v: np.ndarray, color: str, weight: float, *,
+                    action: tuple[np.ndarray, np.ndarray] | None = None, **attrs: str) -> None:
+    """1 レイヤ分のエッジを add_edges 1 回で列単位の属性付きで追加
+
+    action は (min → max, max → min) 向きの操作ラベル番号 (G["actions"] の添字、-1 = 無し) で、
+    エッジ属性 action / action_back になる (igraph はエッジを (min, max) で持つ)。
+    """
+    m = len(u)
+    fwd, back = action if action is not None else ([-1] * m, [-1] * m)
+    attributes = {"color": [color] * m, "weight": [weight] * m,
+                  "action": np.asarray(fwd).tolist(), "action_back": np.asarray(back).tolist()}
+    attributes.update({key: [val] * m for key, val in attrs.items()})
+    ig_g.add_edges(np.column_stack((u, v)).tolist(), attributes=attributes)
+
+
+def l2_adjacency(l2_pairs: list[tuple[str, str]], codes) -> dict[str, set[str]]:
+    """L2 エッジ (コード対) を無向隣接辞書に変換"""
+    L2_adj = {code: set() for code in codes}
+    for la, lb in l2_pairs:
+        L2_adj.setdefault(la, set()).add(lb)
+        L2_adj.setdefault(lb, set()).add(la)
+    return L2_adj
+
+
+def build_graph(l1l2_path: Path, l2_path: Path, *, implicit_l2: bool = False,
+                parse_workers: int | None = None) -> tuple[ig.Graph, dict[int, str], dict[int, str]]:
+    """L1-L2 / L2 DB からグラフを構築する。
+
+    implicit_l2=True の場合は赤・青エッジを実体化せず、L2 クラス所属と
+    L2 隣接関係をグラフ属性として保持する (探索時にオンザフライ生成)。
+    parse_workers は DB 解析のワーカープロセス数 (None = 自動)。
+    """
+    db = parse_dbs(l1l2_path, l2_path, workers=parse_workers)
+    n_nodes, node_labels, L1num_to_L2code = db.n_nodes, db.node_labels, db.L1num_to_L2code
 
     ig_g = ig.Graph(directed=False)
     ig_g.add_vertices(n_nodes)
-    for i in range(n_nodes):
-        ig_g.vs[i]["name"] = i
-
-    node_labels = {}
-    L2code_to_L1num = {}
-    L1num_to_L2code = {}
-
-    for ln in lines[1:1 + n_nodes]:
-        nid = int(ln.split()[0])
-        L1s = ln.find("L1 |") + len("L1 |")
-        L1e = ln.find("L2")
-        l1_label = ln[L1s:L1e].strip().replace("|", "\n")
-        L2s = ln.find("L2 |") + len("L2 |")
-        L2e = ln.find("#", L2s)
-        l2_label = ln[L2s:L2e].strip()
-        label = f"# {nid}\n{l1_label}\n{l2_label}"
-        ig_g.vs[nid]["label"] = label
-        node_labels[nid] = label
-        L2code_to_L1num.setdefault(l2_label, []).append(nid)
-        L1num_to_L2code[nid] = l2_label
-
-    # 黒エッジ追加
-    idx_edges = next(i + 1 for i, ln in enumerate(lines) if "# number of l1 edges" in ln.lower())
-    for ln in lines[idx_edges:]:
-        sp = ln.split()
-        if len(sp) < 2 or not sp[0].isdigit():
-            continue
-        u, v = map(int, sp[:2])
-        ig_g.add_edge(u, v)
-        ig_g.es[-1]["color"] = "black"
-        ig_g.es[-1]["weight"] = W_BLACK
-    print("black")
-
-    # 既存エッジキャッシュとロック
-    existing_edges = set(map(tuple, map(sorted, ig_g.get_edgelist())))
-    edge_lock = Lock()
-
-    # L2コード辞書作成
-    lines = l2_path.read_text(encoding="utf-8").splitlines()
-    n_l2_nodes = int(lines[0].split()[0])
-    L2num_to_code = {
-        int(ln.split()[0]): ln[ln.find("L2 |") + len("L2 |"): ln.find("Connected")].strip()
-        for ln in lines[1:1 + n_l2_nodes]
-    }
-
-    # 赤エッジ追加（マルチスレッド）
-    def add_red_edge(u: int, v: int):
-        if u == v:
-            return
-        edge = tuple(sorted((u, v)))
-        with edge_lock:
-            if edge in existing_edges:
-                return
-            ig_g.add_edge(u, v)
-            ig_g.es[-1]["color"] = "red"
-            ig_g.es[-1]["weight"] = W_RED
-            existing_edges.add(edge)
-
-    idx_edges = next(i + 1 for i, ln in enumerate(lines) if "# number of l2 edges" in ln.lower())
-    with ThreadPoolExecutor(max_workers=8) as executor:
-        for ln in lines[idx_edges:]:
-            sp = ln.split()
-            if len(sp) < 3 or not sp[0].isdigit():
-                continue
-            a, b = map(int, sp[1:3])
-            la, lb = L2num_to_code.get(a), L2num_to_code.get(b)
-            if la is None or lb is None:
-                continue
-            for u in L2code_to_L1num.get(la, []):
-                for v in L2code_to_L1num.get(lb, []):
-                    executor.submit(add_red_edge, u, v)
-    print("red")
-
-    # 青エッジ追加（マルチスレッド）
-    def add_blue_edge(u: int, v: int):
-        edge = tuple(sorted((u, v)))
-        with edge_lock:
-            if edge in existing_edges:
-                return
-            ig_g.add_edge(u, v)
-            ig_g.es[-1]["color"] = "blue"
-            ig_g.es[-1]["weight"] = W_BLUE
-            ig_g.es[-1]["style"] = "dotted"
-            existing_edges.add(edge)
-
-    with ThreadPoolExecutor(max_workers=8) as executor:
-        for nodes in L2code_to_L1num.values():
-            if len(nodes) > 100:  # 組合せ爆発対策
-                continue
-            for u, v in combinations(nodes, 2):
-                executor.submit(add_blue_edge, u, v)
-    print("blue")
+    ig_g.vs["name"] = list(range(n_nodes))
+    ig_g.vs.select(list(node_labels))["label"] = list(node_labels.values())
+    ig_g["L2_adj"] = l2_adjacency(db.l2_pairs, db.L2code_to_L1num)
+    ig_g["actions"] = db.actions
+    ig_g["l2_pairs"], ig_g["l2_actions"] = db.l2_pairs, db.l2_actions   # L2 エッジ (向き付き) の操作ラベル
+    members = {code: np.asarray(nids, dtype=np.int64) for code, nids in db.L2code_to_L1num.items()}
+
+    # 黒エッジ
+    with phase("build.black"):
+        keep, keys = _unique_index(db.l1_edges[:, 0], db.l1_edges[:, 1], n_nodes, np.empty(0, np.int64))
+        E = db.l1_edges
+        bu, bv, seen = E[keep, 0], E[keep, 1], keys[keep]
+        _add_edge_layer(ig_g, bu, bv, "black", W_BLACK,
+                        action=_directed_actions(keys, E[:, 0] <= E[:, 1], db.l1_actions, keep))
+    count("edges.black", len(bu))
+
+    if implicit_l2:
+        ig_g["implicit_l2"] = True
+        ig_g["L1num_to_L2code"] = L1num_to_L2code
+        ig_g["L2code_to_L1num"] = db.L2code_to_L1num
+        return ig_g, node_labels, L1num_to_L2code
+
+    # 赤エッジ (L2 エッジ → L1 直積)
+    with phase("build.red"):
+        ru, rv, rp = _red_edge_arrays(db.l2_pairs, members, pair_index=True)
+        keep, keys = _unique_index(ru, rv, n_nodes, seen)
+        action = _directed_actions(keys, ru <= rv, np.asarray(db.l2_actions, dtype=np.int32)[rp], keep)
+        ru, rv, rkeys = ru[keep], rv[keep], keys[keep]
+        _add_edge_layer(ig_g, ru, rv, "red", W_RED, action=action)
+        seen = np.concatenate((seen, rkeys))
+    count("edges.red", len(ru))
+
+    # 青エッジ (同一 L2 コード)
+    with phase("build.blue"):
+        lu, lv, _ = _unique_edges(*_blue_edge_arrays(members), n_nodes, seen)
+        _add_edge_layer(ig_g, lu, lv, "blue", W_BLUE, style="dotted")
+    count("edges.blue", len(lu))
 
     return ig_g, node_labels, L1num_to_L2code
 
 
+# ---------- グラフへのアクセス (igraph / CSRGraph 共通) -----------------
+#
+# 探索・書式化は igraph.Graph と graph_csr.CSRGraph (mmap / 共有メモリ上の配列) の
+# どちらでも受け付ける。CSRGraph では隣接を行単位で配列から引き、igraph への変換や
+# 全エッジ分の Python オブジェクトを作らない。隣接の順序 (近傍番号順) は CSR から
+# 復元した igraph と同じなので、列挙される経路の順序も変わらない。
+
+def is_implicit(G) -> bool:
+    """赤・青エッジを暗黙表現で持つグラフか"""
+    if not isinstance(G, ig.Graph):
+        return G.implicit
+    return "implicit_l2" in G.attributes() and bool(G["implicit_l2"])
+
+
+def graph_actions(G) -> list[str]:
+    """操作ラベルの文字列プール"""
+    if not isinstance(G, ig.Graph):
+        return G.actions
+    return G["actions"] if "actions" in G.attributes() else []
+
+
+def _implicit_color(G, u: int, v: int) -> str | None:
+    """暗黙 L2 層での (u, v) の色 (赤 > 青)。該当なしは None"""
+    if not isinstance(G, ig.Graph):
+        return G.implicit_color(u, v)
+    if u == v:
+        return None
+    code_of = G["L1num_to_L2code"]
+    cu, cv = code_of.get(u), code_of.get(v)
+    if cu is None or cv is None:
+        return None
+    if cv in G["L2_adj"].get(cu, ()):
+        return "red"
+    if cu == cv:
+        return "blue"
+    return None
+
+
+def edge_color(G, u: int, v: int) -> str | None:
+    """(u, v) 間エッジの色。暗黙 L2 層も含めて解決し、無ければ None"""
+    if not isinstance(G, ig.Graph):
+        e = G.edge_at(u, v)
+        return e[0] if e is not None else G.implicit_color(u, v) if G.implicit else None
+    eid = G.get_eid(u, v, error=False)
+    if eid != -1:
+        return G.es[eid]["color"]
+    if is_implicit(G):
+        return _implicit_color(G, u, v)
+    return None
+
+
+def l2_edges_among(G, nodes: set[int]) -> list[tuple[int, int, str]]:
+    """nodes 内に両端を持つ赤・青エッジを (u, v, color) で返す"""
+    if not is_implicit(G):
+        adj = colored_adjacency(G)
+        return [(u, v, col) for u in sorted(nodes) if 0 <= u < len(adj)
+                for v, _, col in adj[u] if col != "black" and u < v and v in nodes]
+    if not isinstance(G, ig.Graph):
+        return G.implicit_edges_among(nodes)
+
+    code_of = G["L1num_to_L2code"]
+    by_code: dict[str, list[int]] = {}
+    for n in sorted(nodes):
+        by_code.setdefault(code_of[n], []).append(n)
+
+    out = []
+    for ca, A in by_code.items():
+        for cb in G["L2_adj"].get(ca, ()):
+            if cb not in by_code or cb < ca:
+                continue
+            B = by_code[cb]
+            pairs = itertools.combinations(A, 2) if ca == cb else itertools.product(A, B)
+            out += [(u, v, "red") for u, v in pairs if G.get_eid(u, v, error=False) == -1]
+        if ca not in G["L2_adj"].get(ca, ()):
+            out += [(u, v, "blue") for u, v in itertools.combinations(A, 2) if G.get_eid(u, v, error=False) == -1]
+    return out
+
+
+def edge_arrays(G, layer: str = "full", weights: Weights | None = None) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """layer ("black" / "full") のエッジを (u, v, weight) 配列で返す (weight は weights を種別毎に適用)。
+
+    暗黙 L2 層のグラフでは full 指定時に赤・青エッジを配列上で展開する。
+    """
+    weights = weights or DEFAULT_WEIGHTS
+    if not isinstance(G, ig.Graph):
+        u, v, etype, _ = G.edges()
+        mask = etype == 0 if layer == "black" else slice(None)   # 0 = graph_csr.ETYPE["black"]
+        wt = np.asarray([weights.of(c) for c in Weights._fields], dtype=np.float64)
+        u, v, w = u[mask], v[mask], wt[etype[mask]]
+    else:
+        colors = ("black",) if layer == "black" else ("black", "red", "blue")
+        col = np.asarray(G.es["color"] if G.ecount() else [], dtype=str)
+        mask = np.isin(col, colors)
+        E = np.asarray(G.get_edgelist(), dtype=np.int64).reshape(-1, 2)[mask]
+        u, v = E[:, 0], E[:, 1]
+        w = np.zeros(len(col), dtype=np.float64)
+        for c in colors:
+            w[col == c] = weights.of(c)
+        w = w[mask]
+    if layer == "black" or not is_implicit(G):
+        return u, v, w
+
+    n = G.vcount()
+    if not isinstance(G, ig.Graph):
+        members, l2_pairs = G.l2_members(), G.l2_code_pairs()
+    else:
+        members = {c: np.asarray(m, dtype=np.int64) for c, m in G["L2code_to_L1num"].items()}
+        l2_pairs = [(a, b) for a, adj in G["L2_adj"].items() for b in adj if a <= b]
+    seen = _pair_keys(u, v, n)
+    ru, rv, rkeys = _unique_edges(*_red_edge_arrays(l2_pairs, members), n, seen)
+    lu, lv, _ = _unique_edges(*_blue_edge_arrays(members, None), n, np.concatenate((seen, rkeys)))
+    return (np.concatenate((u, ru, lu)), np.concatenate((v, rv, lv)),
+            np.concatenate((w, np.full(len(ru), weights.red), np.full(len(lu), weights.blue))))
+
+
 def write_edge_lists(G: ig.Graph, out_path: str = "all_edges.txt") -> None:
-    """igraphグラフ G から色別エッジ一覧を out_path に保存"""
-
-    black_edges, red_edges, blue_edges = [], [], []
-    for e in G.es:
-        u, v = e.source, e.target
-        col = e["color"] if "color" in e.attributes() else ""
-        if col == "black":
-            black_edges.append((u, v))
-        elif col == "red":
-            red_edges.append((u, v))
-        elif col == "blue":
-            blue_edges.append((u, v))
-
-    def format_edges(edge_list: list[tuple[int, int]]) -> str:
-        lines, buf = [], []
-        for i, (u, v) in enumerate(edge_list, 1):
-            buf.append(f"{u}-{v}")
-            if i % 20 == 0:
-                lines.append(" | ".join(buf))
-                buf = []
-        if buf:
-            lines.append(" | ".join(buf))
-        return "\n".join(lines)
-
-    with open(out_path, "w", encoding="utf-8") as f:
-        f.write(f"### Black Edges (L1 edges) - {len(black_edges)} edges\n")
-        f.write(format_edges(black_edges) + "\n\n\n")
-        f.write(f"### Red Edges (L2 relationship edges) - {len(red_edges)} edges\n")
-        f.write(format_edges(red_edges) + "\n\n\n")
-        f.write(f"### Blue Edges (Same L2 code, dotted) - {len(blue_edges)} edges\n")
-        f.write(format_edges(blue_edges) + "\n\n\n")
+    """igraphグラフ G から色別エッジ一覧を out_path に保存 (edge_export の text 形式)"""
+    from edge_export import export_edges
 
+    export_edges(G, Path(out_path), "text")
     print(f"[+] edge list written → {out_path}")
 
 # ---------- 経路探索 --------------------------------------------------
+#
+# 経路は生成器で 1 本ずつ返し、k 本・予算 (壁時計 / 展開回数) のどちらかで
+# 止める。stats を渡すと exhaustive (全列挙できたか) と stopped
+# (None / "k" / "time" / "expansions") を書き込む。
+
+class Budget:
+    """列挙の打ち切り条件。None は無制限"""
+
+    def __init__(self, time_limit: float | None = None, max_expansions: int | None = None):
+        self.time_limit = time_limit
+        self.max_expansions = max_expansions
+        self.deadline: float | None = None
+        self.expanded = 0
+
+    def start(self) -> Budget:
+        self.deadline = time.perf_counter() + self.time_limit if self.time_limit is not None else None
+        self.expanded = 0
+        return self
+
+    def charge(self, n: int = 1) -> str | None:
+        """n 回分の展開を計上し、超過していれば理由を返す"""
+        self.expanded += n
+        if self.max_expansions is not None and self.expanded > self.max_expansions:
+            return "expansions"
+        if self.deadline is not None and time.perf_counter() > self.deadline:
+            return "time"
+        return None
+
+
+_adj_cache: dict[tuple[int, str], list] = {}   # (id(G), 種類) → 隣接リスト (G 解放時に削除)
+
+
+def _cached_adjacency(G, kind: str, build) -> list:
+    key = (id(G), kind)
+    adj = _adj_cache.get(key)
+    if adj is None:
+        adj = _adj_cache[key] = build(G)
+        weakref.finalize(G, _adj_cache.pop, key, None)
+    return adj
+
+
+def _build_black_adjacency(G) -> list[list[int]]:
+    if not isinstance(G, ig.Graph):
+        return G.black_rows()
+    u, v, _ = edge_arrays(G, "black")
+    adj = [[] for _ in range(G.vcount())]
+    for a, b in zip(u.tolist(), v.tolist()):
+        adj[a].append(b)
+        if a != b:
+            adj[b].append(a)
+    return adj
+
+
+def _build_colored_adjacency(G) -> list[list[tuple[int, float, str]]]:
+    if not isinstance(G, ig.Graph):
+        return G.rows()
+    adj = [[] for _ in range(G.vcount())]
+    for (a, b), col, x in zip(G.get_edgelist(), G.es["color"], G.es["weight"]):
+        adj[a].append((b, x, col))
+        if a != b:
+            adj[b].append((a, x, col))
+    return adj
+
+
+def black_adjacency(G) -> list[list[int]]:
+    """黒エッジの隣接ノードリスト (グラフ毎に 1 度だけ作る。重みは探索時に適用)
+
+    CSRGraph では配列上の行ビュー (graph_csr.CSRRows) で、全体をリストに展開しない。
+    """
+    return _cached_adjacency(G, "black", _build_black_adjacency)
+
+
+def colored_adjacency(G) -> list[list[tuple[int, float, str]]]:
+    """G が実際に持つ全エッジの隣接リスト (v, weight, color)。暗黙 L2 層は含まない (CSRGraph では行ビュー)"""
+    return _cached_adjacency(G, "colored", _build_colored_adjacency)
+
+
+def iter_dag_paths(preds: dict[int, list[int]], s: int, t: int, k: int | None = None, *,
+                   budget: Budget | None = None, stats: dict | None = None) -> Iterator[list[int]]:
+    """先行ノード DAG を t から逆向きに深さ優先で辿り、s→t 経路を 1 本ずつ返す
+
+    DAG 上のどのノードからも s に到達できるので、スタックが空でなければ
+    未列挙の経路が必ず残っている (= exhaustive 判定に使える)。
+    """
+    stack = [(t, [t])] if t in preds else []
+    n_paths = 0
+    stopped = None
+    while stack:
+        if k and n_paths >= k:
+            stopped = "k"
+            break
+        if budget is not None and (stopped := budget.charge()):
+            break
+        v, rev = stack.pop()
+        if v == s:
+            n_paths += 1
+            yield rev[::-1]
+            continue
+        for u in reversed(preds[v]):
+            stack.append((u, rev + [u]))
+    if stats is not None:
+        stats.update(exhaustive=not stack, stopped=stopped if stack else None, paths=n_paths)
+
+
+def _black_dijkstra(G: ig.Graph, s: int, goals: set[int], w: float, budget: Budget | None, *,
+                    every: bool = False) -> tuple[dict[int, float], dict[int, list[int]], set[int], float, str | None]:
+    """黒エッジ上で s から Dijkstra を行い、等コストの先行ノードを preds に記録する
+
+    goals の最初の 1 点 (every=True では全点) が確定した距離を超えたところで止める。
+    確定した goal からは (every=True で他の goal が残っている場合を除き) 先へ伸ばさない。
+    返り値 (dist, preds, done, best, stopped)。
+    """
+    adj = black_adjacency(G)
+    dist = {s: 0.0}
+    preds: dict[int, list[int]] = {s: []}
+    done = set()
+    heap = [(0.0, s)]
+    best = float("inf")
+    left = len(goals)
+    stopped = None
+    while heap:
+        d, u = heapq.heappop(heap)
+        if d > best + 1e-9:
+            break
+        if u in done:
+            continue
+        if budget is not None and (stopped := budget.charge()):
+            break
+        done.add(u)
+        if u in goals:
+            left -= 1
+            if not every or not left:
+                best = min(best, d)
+                continue
+        for v in adj[u]:
+            nd = d + w
+            dv = dist.get(v)
+            if dv is None or nd < dv - 1e-9:
+                dist[v] = nd
+                preds[v] = [u]
+                heapq.heappush(heap, (nd, v))
+            elif abs(nd - dv) <= 1e-9 and u not in preds[v]:
+                preds[v].append(u)
+    count("l1.settled", len(done))
+    return dist, preds, done, best, stopped
+
+
+def _check_nodes(G: ig.Graph, nodes) -> None:
+    n = G.vcount()
+    for v in nodes:
+        if not 0 <= v < n:
+            raise ValueError(f"unknown node id: {v}")
+
+
+def iter_l1_paths(G: ig.Graph, s: int, t: int, k: int | None = None, *, weights: Weights | None = None,
+                  budget: Budget | None = None, stats: dict | None = None) -> Iterator[list[int]]:
+    """黒エッジ上の s→t 等コスト最短経路を 1 本ずつ返す
+
+    Dijkstra は t の距離を超えた時点で止め、等コストの先行ノードだけを記録する。
+    経路そのものは iter_dag_paths で必要な分だけ組み立てる。
+    """
+    _check_nodes(G, (s, t))
+    budget = budget.start() if budget is not None else None
+    _, preds, done, best, stopped = _black_dijkstra(G, s, {t}, (weights or DEFAULT_WEIGHTS).black, budget)
+    if stopped or t not in done:
+        if stats is not None:
+            stats.update(exhaustive=not stopped, stopped=stopped, paths=0, cost=None,
+                         expanded=budget.expanded if budget else len(done))
+        return
+    yield from iter_dag_paths(preds, s, t, k, budget=budget, stats=stats)
+    if stats is not None:
+        stats.update(cost=best, expanded=budget.expanded if budget else len(done))
+
+
+def search_backend(name: str | None = None):
+    """名前 (None = 既定) から探索バックエンド (search_backends.SearchBackend) を返す"""
+    from search_backends import get_backend   # search_backends が本モジュールを使うため遅延 import
+
+    return get_backend(name)
+
+
+def l1_shortest_paths(G: ig.Graph, s: int, t: int, k: int | None, *, weights: Weights | None = None,
+                      budget: Budget | None = None, stats: dict | None = None,
+                      backend: str | None = None) -> list[list[int]]:
+    with phase("search.l1", start=s, goal=t, backend=backend or "native"):
+        paths = list(search_backend(backend).iter_l1_paths(G, s, t, k, weights=weights, budget=budget, stats=stats))
+    count("paths.l1", len(paths))
+    return paths
+
+
+def subgraph_adjacency(G: ig.Graph, allowed: set[int]) -> dict[int, list[tuple[int, str]]]:
+    """allowed 内に閉じた隣接リスト (v, color)。暗黙 L2 層の赤・青はここで展開する
+
+    重みを含まないので、同じ allowed で重みだけ変える探索 (スイープ) で使い回せる。
+    """
+    full = colored_adjacency(G)
+    sub = {u: [(v, col) for v, _, col in full[u] if v in allowed]
+           for u in sorted(allowed) if 0 <= u < len(full)}
+    if is_implicit(G):
+        for u, v, col in l2_edges_among(G, set(sub)):
+            sub[u].append((v, col))
+            sub[v].append((u, col))
+    return sub
+
+
+def _weighted_adjacency(sub: dict[int, list[tuple[int, str]]], weights: Weights) -> dict[int, list[tuple[int, float, bool]]]:
+    wt = {c: weights.of(c) for c in Weights._fields}
+    return {u: [(v, wt[col], col != "black") for v, col in nbrs] for u, nbrs in sub.items()}
+
+
+def _l2_lower_bounds(adj: dict[int, list[tuple[int, float, bool]]], t: int) -> tuple[dict[int, float], dict[int, float]]:
+    """状態 (ノード, L2 使用済みか) から t までの最短距離 (単純経路制約なしの下界)
+
+    返り値 (h0, h1): h1[v] は任意の経路、h0[v] は赤/青を 1 本以上含む経路の距離。
+    """
+    h = ({}, {t: 0.0})
+    heap = [(0.0, t, 1)]
+    while heap:
+        d, v, f = heapq.heappop(heap)
+        if d > h[f].get(v, float("inf")):
+            continue
+        for u, w, l2 in adj[v]:
+            # (u, f') --e--> (v, f) が成り立つ前状態 f' を緩和する
+            for fu in ((0, 1) if f and l2 else (f,)):
+                if d + w < h[fu].get(u, float("inf")):
+                    h[fu][u] = d + w
+                    heapq.heappush(heap, (d + w, u, fu))
+    return h
+
+
+def iter_l1l2_paths(G: ig.Graph, allowed: set[int], s: int, t: int, k: int | None = 5, *,
+                    weights: Weights | None = None, sub: dict[int, list[tuple[int, str]]] | None = None,
+                    budget: Budget | None = None, stats: dict | None = None,
+                    bounds=_l2_lower_bounds) -> Iterator[list[int]]:
+    """allowed 内で赤/青エッジを 1 本以上含む単純経路を短い順に返す
+
+    状態 (ノード, L2 使用済みか) 上の t までの距離を下界とした最良優先探索で
+    部分経路を伸ばすため、完成した経路はコスト順に取り出され、赤/青を
+    含まない経路を列挙して捨てることもない。部分経路の取り出しを展開 1 回と数える。
+    sub に subgraph_adjacency(G, allowed) を渡すと部分グラフの抽出を省く。
+    bounds は下界 (h0, h1) の計算関数 (探索バックエンドが差し替える)。
+    """
+    budget = budget.start() if budget is not None else None
+    if sub is None:
+        with phase("search.subgraph", nodes=len(allowed)):
+            sub = subgraph_adjacency(G, allowed)
+    adj = _weighted_adjacency(sub, weights or DEFAULT_WEIGHTS)
+    n_paths = 0
+    stopped = None
+    heap: list[tuple[float, float, int]] = []
+    if s in adj and t in adj and s != t:
+        h = bounds(adj, t)
+        if s in h[0]:
+            heap.append((h[0][s], 0.0, 0))
+    # 部分経路は親ポインタの木で持つ: (ノード, 親の番号, L2 使用済みか)
+    tree: list[tuple[int, int, int]] = [(s, -1, 0)]
+    pruned = 0
+
+    while heap:
+        if k and n_paths >= k:
+            stopped = "k"
+            break
+        if budget is not None and (stopped := budget.charge()):
+            break
+        _, g, i = heapq.heappop(heap)
+        u, _, f = tree[i]
+        if u == t:
+            path, j = [], i
+            while j >= 0:
+                path.append(tree[j][0])
+                j = tree[j][1]
+            n_paths += 1
+            yield path[::-1]
+            continue
 
-def l1_shortest_paths(G: ig.Graph, s: int, t: int, k: int | None) -> list[list[int]]:
-    black_eids = [e.index for e in G.es if e["color"] == "black"]
-    G_black = G.subgraph_edges(black_eids, delete_vertices=False)
-
-    try:
-        all_paths = G_black.get_all_shortest_paths(s, to=t, weights="weight")
-        unique_paths = []
-        seen = set()
-        for path in all_paths:
-            tup = tuple(path)
-            if tup not in seen:
-                unique_paths.append(path)
-                seen.add(tup)
-            if k and len(unique_paths) >= k:
-                break
-        return unique_paths
-    except:
-        return []
-
-def l1l2_paths_nx(G_ig: ig.Graph, allowed: set[int], s: int, t: int, k: int = 5) -> list[list[int]]:
-    # igraph → networkx に変換
-    G_nx = nx.Graph()
-    for v in G_ig.vs:
-        if v.index in allowed:
-            G_nx.add_node(v.index)
-
-    for e in G_ig.es:
-        u, v = e.source, e.target
-        if u in allowed and v in allowed:
-            G_nx.add_edge(u, v, color=e["color"], weight=e["weight"])
-
-    try:
-        gen = nx.shortest_simple_paths(G_nx, s, t, weight="weight")
-        paths = []
-        for path in gen:
-            if any(G_nx[u][v]["color"] in ("red", "blue") for u, v in zip(path, path[1:])):
-                paths.append(path)
-                if len(paths) >= k:
-                    break
-        return paths
-    except (nx.NetworkXNoPath, nx.NodeNotFound):
-        return []
-
-# ---------- Graphviz 可視化 -----------------------------------------
-
-
-def render_graph(G: ig.Graph, labels: dict[int, str], s: int, t: int, l1_paths: list[list[int]], out_prefix: str, *, k: int | None = 10) -> None:
-    l1_nodes = set(itertools.chain.from_iterable(l1_paths))
-
-    l1e = {tuple(sorted((u, v))) for p in l1_paths for u, v in zip(p, p[1:])}
-    l2e = {
-        tuple(sorted((e.source, e.target)))
-        for e in G.es
-        if e["color"] in ("red", "blue")
-        and e.source in l1_nodes
-        and e.target in l1_nodes
-    }
-
-    l1l2 = l1l2_paths_nx(G, l1_nodes, s, t, k)
-
-    gv = graphviz.Graph("L1_vs_L2", engine="dot")
-    for n in l1_nodes:
-        fill = "green" if n == s else "red" if n == t else "white"
-        gv.node(str(n), label=labels.get(n, str(n)), style="filled", fillcolor=fill)
-
-    def add_edges(gv, G: ig.Graph, edge_list: set[tuple[int, int]], *, color: str | None = None, width: str = "2.0") -> None:
-        for u, v in edge_list:
-            eid = G.get_eid(u, v, error=False)
-            if eid == -1:
+        on_path, j = set(), i
+        while j >= 0:
+            on_path.add(tree[j][0])
+            j = tree[j][1]
+        for v, w, l2 in adj[u]:
+            fv = f | l2
+            hv = h[fv].get(v)
+            if hv is None or v in on_path or (v == t and not fv):   # t には L2 使用済みでのみ到達
+                pruned += 1
                 continue
-            e = G.es[eid]
-            col = color if color is not None else (e["color"] if "color" in e.attributes() else "black")
-            style = e["style"] if "style" in e.attributes() else ("dotted" if col == "blue" else "solid")
-            gv.edge(str(u), str(v), color=col, style=style, penwidth=width)
-
-    def _arrow(col: str) -> str:
-        return {"red": "=>", "blue": "--"}.get(col, "->")
-
-    def _path_str(G: ig.Graph, p: list[int]) -> str:
-        parts = []
-        for u, v in zip(p, p[1:]):
-            eid = G.get_eid(u, v, error=False)
-            if eid == -1:
-                arrow = "??"
-            else:
-                color = G.es[eid]["color"]
-                arrow = {"red": "=>", "blue": "--"}.get(color, "->")
-            parts.append(f"{u}{arrow}")
-        return "".join(parts) + str(p[-1])
-    
-    add_edges(gv, G, l1e, color="black", width=PEN_L1)
-    add_edges(gv, G, l2e, width=PEN_L2)
-
-    info = [f"L1       {i}: {_path_str(G, p)}" for i, p in enumerate(l1_paths, 1)]
-    info += [f"L1+L2    {i}: {_path_str(G, p)}" for i, p in enumerate(l1l2, 1)]
-    gv.node("info", label="\n".join(info), shape="plaintext", fontname="Courier")
-    gv.edge(str(s), "info", style="invis")
-
-    gv.attr(dpi="300", rankdir="TB", margin="0.3", nodesep="0.3", ranksep="0.3")
-    out = f"{out_prefix}/s{s}_g{t}_k{len(l1_paths)}"
-    print(f"[+] rendering → {out}.pdf")
-    gv.render(out, format="pdf", cleanup=True, quiet=True)
-    try:
-        gv.view()
-    except:
-        pass
\ No newline at end of file
+            tree.append((v, i, fv))
+            heapq.heappush(heap, (g + w + hv, g + w, len(tree) - 1))
+
+    count("l1l2.partial_paths", len(tree))
+    count("l1l2.pruned", pruned)
+    if stats is not None:
+        stats.update(exhaustive=not heap, stopped=stopped if heap else None, paths=n_paths,
+                     expanded=budget.expanded if budget else None)
+
+
+def l1l2_paths(G: ig.Graph, allowed: set[int], s: int, t: int, k: int | None = 5, *,
+               weights: Weights | None = None, sub: dict[int, list[tuple[int, str]]] | None = None,
+               budget: Budget | None = None, stats: dict | None = None,
+               backend: str | None = None) -> list[list[int]]:
+    with phase("search.l1l2", start=s, goal=t, backend=backend or "native"):
+        paths = list(search_backend(backend).iter_l1l2_paths(G, allowed, s, t, k, weights=weights, sub=sub,
+                                                             budget=budget, stats=stats))
+    count("paths.l1l2", len(paths))
+    return paths
+
+# ---------- 終点集合への探索 ------------------------------------------
+#
+# 終点を集合 (明示した番号列や L2 クラスの全ノード) で与え、s からの 1 回の
+# Dijkstra で答える。探索はこのモジュールの実装で行う (探索バックエンドは単一終点用)。
+# nearest: 最寄りの goal への経路 k 本 / all: 全 goal への距離と経路 1 本。
+
+GOAL_MODES = ("nearest", "all")
+
+def iter_goal_set_paths(G: ig.Graph, s: int, goals, k: int | None = None, *, weights: Weights | None = None,
+                        budget: Budget | None = None, stats: dict | None = None) -> Iterator[list[int]]:
+    """s から goals のうち最も近いノード (同距離なら全て) への黒エッジ等コスト最短経路を 1 本ずつ返す
+
+    経路は最寄り goal の昇順にまとめて返す。stats には iter_l1_paths と同じ項目に加え
+    nearest (最寄り goal の昇順リスト) を書き込む。
+    """
+    goals = set(goals)
+    _check_nodes(G, [s, *goals])
+    budget = budget.start() if budget is not None else None
+    _, preds, done, best, stopped = _black_dijkstra(G, s, goals, (weights or DEFAULT_WEIGHTS).black, budget)
+    # 最初に確定した goal の距離を超えた時点で止まるので、確定済みの goal は全て最寄り
+    nearest = [] if stopped else sorted(goals & done)
+    n_paths, exhaustive = 0, not stopped
+    for g in nearest:
+        if k and n_paths >= k:
+            exhaustive, stopped = False, "k"
+            break
+        st = {}
+        for p in iter_dag_paths(preds, s, g, k and k - n_paths, budget=budget, stats=st):
+            n_paths += 1
+            yield p
+        if not st["exhaustive"]:
+            exhaustive, stopped = False, st["stopped"]
+            break
+    if stats is not None:
+        stats.update(exhaustive=exhaustive, stopped=stopped, paths=n_paths, cost=best if nearest else None,
+                     nearest=nearest, expanded=budget.expanded if budget else len(done))
+
+
+def goal_set_paths(G: ig.Graph, s: int, goals, k: int | None, *, weights: Weights | None = None,
+                   budget: Budget | None = None, stats: dict | None = None) -> list[list[int]]:
+    with phase("search.goal_set", start=s, goals=len(goals)):
+        paths = list(iter_goal_set_paths(G, s, goals, k, weights=weights, budget=budget, stats=stats))
+    count("paths.l1", len(paths))
+    return paths
+
+
+def goal_distances(G: ig.Graph, s: int, goals, *, weights: Weights | None = None, budget: Budget | None = None,
+                   stats: dict | None = None) -> dict[int, tuple[float, list[int]] | None]:
+    """s からの 1 つの最短経路木で goals の各点への (距離, 最短経路 1 本) を求める
+
+    到達できない (または予算切れで確定しなかった) goal は None。
+    """
+    goals = sorted(set(goals))
+    _check_nodes(G, [s, *goals])
+    budget = budget.start() if budget is not None else None
+    with phase("search.goal_distances", start=s, goals=len(goals)):
+        dist, preds, done, _, stopped = _black_dijkstra(G, s, set(goals), (weights or DEFAULT_WEIGHTS).black,
+                                                        budget, every=True)
+        out: dict[int, tuple[float, list[int]] | None] = {}
+        for g in goals:
+            if g not in done:
+                out[g] = None
+                continue
+            path = [g]
+            while path[-1] != s:
+                path.append(preds[path[-1]][0])
+            out[g] = (dist[g], path[::-1])
+    if stats is not None:
+        stats.update(exhaustive=not stopped, stopped=stopped, reached=sum(v is not None for v in out.values()),
+                     expanded=budget.expanded if budget else len(done))
+    return out
+
+
+# ---------- 経路の書式化 ----------------------------------------------
+
+EDGE_WEIGHTS = DEFAULT_WEIGHTS._asdict()
+_ARROWS = {"black": "->", "red": "=>", "blue": "--"}
+
+
+def path_colors(G: ig.Graph, p: list[int]) -> list[str | None]:
+    return [edge_color(G, u, v) for u, v in zip(p, p[1:])]
+
+
+def path_cost(G: ig.Graph, p: list[int], weights: Weights | None = None) -> float:
+    weights = weights or DEFAULT_WEIGHTS
+    return sum(weights.of(c) for c in path_colors(G, p))
+
+
+def path_str(G: ig.Graph, p: list[int]) -> str:
+    """0->5=>7--9 形式 (-> 黒, => 赤, -- 青, ?? エッジ無し)"""
+    return "".join(f"{u}{_ARROWS.get(c, '??')}" for u, c in zip(p, path_colors(G, p))) + str(p[-1])
+
+
+def path_record(G: ig.Graph, p: list[int], weights: Weights | None = None, *, plan: bool = False) -> dict:
+    """JSON 出力用の経路情報 (ノード列・コスト・エッジ色、plan=True で操作プランも)"""
+    weights = weights or DEFAULT_WEIGHTS
+    colors = path_colors(G, p)
+    rec = {"nodes": p, "cost": sum(weights.of(c) for c in colors), "colors": colors}
+    if plan:
+        rec["plan"] = path_plan(G, p)
+    return rec
+
+
+# ---------- 操作プラン ------------------------------------------------
+#
+# 経路の各手 u → v を DB の操作ラベルに対応付ける。ラベルはビルド時に
+# G["actions"] へ intern 済みで、エッジ属性 action / action_back (暗黙 L2 層では
+# G["l2_pairs"] / G["l2_actions"]) から引くのでファイル I/O は無い。
+# direction: "forward" = DB に u → v の行がある / "reverse" = v → u の行しか無く、
+# その操作を戻す手になる。青エッジ (同一 L2 コード) には操作が無い。
+
+_PORT_RE = re.compile(r"Port\((\d+),\s*(\d+)\)")
+
+
+def parse_action(label: str) -> dict:
+    """"Disassemble Port(2, 1) : Port(1, 0)" → {"operation": "Disassemble", "ports": [[2, 1], [1, 0]]}"""
+    op, _, rest = label.partition(" ")
+    return {"operation": op, "ports": [[int(a), int(b)] for a, b in _PORT_RE.findall(rest)]}
+
+
+def _build_action_table(G) -> list[dict]:
+    return [parse_action(a) for a in graph_actions(G)]
+
+
+def _build_l2_action_index(G: ig.Graph) -> dict[tuple[str, str], int]:
+    """(L2 コード, L2 コード) → 初出行の操作番号 (暗黙 L2 層用)"""
+    out: dict[tuple[str, str], int] = {}
+    if "l2_pairs" in G.attributes():
+        for (a, b), act in zip(G["l2_pairs"], G["l2_actions"]):
+            if act >= 0:
+                out.setdefault((a, b), act)
+    return out
+
+
+def _edge_step(G, u: int, v: int) -> tuple[str | None, int | None, int | None]:
+    """u → v の (色, u → v の操作番号, v → u の操作番号)。操作を持ち得ないエッジは番号 None"""
+    if not isinstance(G, ig.Graph):
+        e = G.edge_at(u, v)
+        if e is not None:
+            return e
+        if G.implicit and (color := G.implicit_color(u, v)) == "red":
+            return (color, *G.implicit_actions(u, v))
+        return edge_color(G, u, v), None, None
+    eid = G.get_eid(u, v, error=False)
+    if eid != -1:
+        attrs = G.es[eid].attributes()
+        fwd, back = attrs.get("action", -1), attrs.get("action_back", -1)
+        return (attrs["color"], back, fwd) if u > v else (attrs["color"], fwd, back)
+    if is_implicit(G) and (color := _implicit_color(G, u, v)) == "red":
+        index = _cached_adjacency(G, "l2_actions", _build_l2_action_index)
+        code_of = G["L1num_to_L2code"]
+        return color, index.get((code_of[u], code_of[v]), -1), index.get((code_of[v], code_of[u]), -1)
+    return edge_color(G, u, v), None, None
+
+
+def step_action(G, u: int, v: int) -> tuple[str | None, int, bool]:
+    """u → v の 1 手の (色, 操作番号, 逆向きか)。操作番号 -1 = 操作ラベル無し"""
+    color, fwd, back = _edge_step(G, u, v)
+    if fwd is not None and fwd >= 0:
+        return color, fwd, False
+    if back is not None and back >= 0:
+        return color, back, True
+    return color, -1, False
+
+
+def path_plan(G, p: list[int]) -> list[dict]:
+    """経路 p を操作プラン (1 手ごとの operation / ports / direction) に変換する。O(len(p))"""
+    table = _cached_adjacency(G, "action_table", _build_action_table)
+    plan = []
+    for u, v in zip(p, p[1:]):
+        color, act, rev = step_action(G, u, v)
+        step = {"from": u, "to": v, "edge": color, "action": None, "operation": None, "ports": [], "direction": None}
+        if act >= 0:
+            step.update(table[act], action=graph_actions(G)[act], direction="reverse" if rev else "forward")
+        plan.append(step)
+    count("plan.steps", len(plan))
+    return plan
+
+
+def plan_str(plan: list[dict]) -> str:
+    """人間向けの複数行表記 (1 手 1 行)"""
+    lines = []
+    for i, st in enumerate(plan, 1):
+        what = st["action"] or f"({st['edge'] or 'no edge'})"
+        rev = "  [reverse]" if st["direction"] == "reverse" else ""
+        lines.append(f"{i:3d}. {st['from']} -> {st['to']}: {what}{rev}")
+    return "\n".join(lines)
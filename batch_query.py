@@ -0,0 +1,278 @@
+from __future__ import annotations
+import itertools, json, os, shlex, sys
+from multiprocessing import Pool, shared_memory
+from typing import Callable, Iterable, Iterator, TextIO
+import numpy as np
+from Common_Utility import (DEFAULT_WEIGHTS, GOAL_MODES, Budget, Weights, goal_distances, goal_set_paths,
+                            l1l2_paths, path_cost, path_plan, path_record, subgraph_adjacency)
+from graph_csr import CSRGraph
+from hier_search import L2Hierarchy
+from node_index import resolve_plain
+from result_cache import ResultCache, cached, cached_l1_paths, cached_l1l2_paths, node_set_digest
+
+# ---------- バッチ問い合わせ ------------------------------------------
+#
+# 親プロセスが CSR 配列を 1 つの共有メモリブロックへ書き出し、ワーカは
+# 起動時に 1 度だけそこへアタッチし、その配列をコピーせずに直接探索する (ワーカ毎の igraph は
+# 作らないので、--workers を増やしてもグラフ分の RSS は共有メモリ 1 つ分のまま)。以降の各クエリは
+# (start, goal, k) だけを受け取り、結果を JSON Lines で返す。
+# cache (result_cache.ResultCache) を渡すと L1 / L1+L2 経路と終点集合の結果を再利用する。
+# ワーカはそれぞれ同じ SQLite を開き、行毎の hit/miss の増分を親へ返す。
+
+_ALIGN = 64
+
+
+class SharedGraph:
+    """CSRGraph の配列群を 1 つの SharedMemory に配置したもの"""
+
+    def __init__(self, csr: CSRGraph):
+        arrays = csr.arrays()
+        layout, offset = {}, 0
+        for name, a in arrays.items():
+            layout[name] = (offset, a.dtype.str, a.shape)
+            offset += -(-a.nbytes // _ALIGN) * _ALIGN
+        self.shm = shared_memory.SharedMemory(create=True, size=max(offset, 1))
+        for name, a in arrays.items():
+            off, dtype, shape = layout[name]
+            np.ndarray(shape, dtype=dtype, buffer=self.shm.buf, offset=off)[...] = a
+        self.spec = (self.shm.name, layout, csr.n, csr.codes, csr.implicit, csr.actions)
+
+    def close(self) -> None:
+        self.shm.close()
+        self.shm.unlink()
+
+
+def attach(spec: tuple) -> tuple[shared_memory.SharedMemory, CSRGraph]:
+    """共有メモリ上の配列をコピーせずに参照する CSRGraph を返す"""
+    name, layout, n, codes, implicit, actions = spec
+    shm = shared_memory.SharedMemory(name=name)
+    arrays = {key: np.ndarray(shape, dtype=dtype, buffer=shm.buf, offset=off)
+              for key, (off, dtype, shape) in layout.items()}
+    for a in arrays.values():
+        a.flags.writeable = False
+    return shm, CSRGraph(n, codes, implicit, actions, **arrays)
+
+
+# ---------- ワーカ ------------------------------------------------------
+
+_worker: dict = {}
+
+
+def _init_worker(spec: tuple, weights: Weights | None, plan: bool, backend: str | None,
+                 cache_spec: tuple | None = None, time_limit: float | None = None,
+                 max_expansions: int | None = None, hier: bool = False, corridor: float | None = None) -> None:
+    shm, csr = attach(spec)
+    H = L2Hierarchy(csr, csr.L1num_to_L2code()) if hier or corridor is not None else None
+    _worker.update(shm=shm, G=csr, weights=weights, plan=plan, backend=backend,
+                   cache=ResultCache(*cache_spec) if cache_spec else None, time_limit=time_limit,
+                   max_expansions=max_expansions, hier=H, corridor=corridor)
+
+
+def _l1(G, s: int, t: int, k: int | None, hier, corridor, weights, budget: Budget, stats: dict,
+        backend: str | None = None, cache: ResultCache | None = None) -> list[list[int]]:
+    return cached_l1_paths(cache, G, s, t, k, hier=hier, corridor=corridor, weights=weights, budget=budget,
+                           stats=stats, backend=backend)
+
+
+def solve(G, s: int, t: int, k: int | None, *, hier=None, corridor: float | None = None,
+          weights: Weights | None = None, time_limit: float | None = None,
+          max_expansions: int | None = None, plan: bool = False, backend: str | None = None,
+          cache: ResultCache | None = None) -> dict:
+    """1 組分の L1 / L1+L2 経路を求めて JSON 化できる dict で返す
+
+    hier (hier_search.L2Hierarchy) を渡すと L1 経路は階層探索で求める。
+    weights は探索時に適用する重みプロファイル (None = 既定)。
+    time_limit / max_expansions は L1・L1+L2 の各列挙にそれぞれ適用する。
+    plan=True では各経路の操作プラン (l1_plans / l1l2_plans) も付ける。
+    backend は探索バックエンド名 (search_backends.BACKENDS、None = 既定)。
+    cache があれば L1 / L1+L2 経路をそこから引き、無ければ求めて保存する。
+    """
+    st1, st2 = {}, {}
+    l1 = _l1(G, s, t, k, hier, corridor, weights, Budget(time_limit, max_expansions), st1, backend, cache)
+    allowed = set(itertools.chain.from_iterable(l1))
+    l1l2 = cached_l1l2_paths(cache, G, allowed, s, t, k or 5, weights=weights,
+                             budget=Budget(time_limit, max_expansions), stats=st2, backend=backend) if l1 else []
+    res = {"start": s, "goal": t, "k": k, "l1_paths": l1, "l1l2_paths": l1l2,
+           "l1_exhaustive": st1.get("exhaustive", True), "l1_stopped": st1.get("stopped"),
+           "l1l2_stopped": st2.get("stopped")}
+    if plan:
+        res["l1_plans"] = [path_plan(G, p) for p in l1]
+        res["l1l2_plans"] = [path_plan(G, p) for p in l1l2]
+    return res
+
+
+def solve_goal_set(G, s: int, goals: list[int], k: int | None, *, mode: str = "nearest",
+                   weights: Weights | None = None, time_limit: float | None = None,
+                   max_expansions: int | None = None, plan: bool = False, backend: str | None = None,
+                   cache: ResultCache | None = None) -> dict:
+    """終点集合 goals への問い合わせを s からの 1 回の探索で解く
+
+    mode="nearest": 最寄りの goal (nearest) への L1 経路 k 本と、その goal 毎の L1+L2 経路を
+    コスト順にまとめた上位 k 本。mode="all": 全 goal への距離と最短経路 1 本 (distances)。
+    backend は L1+L2 探索にだけ使う (L1 側は Common_Utility の終点集合探索)。
+    cache があれば結果全体をそこから引く。
+    """
+    if mode not in GOAL_MODES:
+        raise ValueError(f"unknown goal mode {mode!r} (choose from {', '.join(GOAL_MODES)})")
+    return cached(cache, "goal_set", lambda: _solve_goal_set(G, s, goals, k, mode, weights, time_limit, max_expansions,
+                                                              plan, backend),
+                  s=s, goals=node_set_digest(goals), k=k, mode=mode, weights=weights or DEFAULT_WEIGHTS,
+                  max_expansions=max_expansions, plan=plan, backend=backend)
+
+
+def _solve_goal_set(G, s: int, goals: list[int], k: int | None, mode: str, weights: Weights | None,
+                    time_limit: float | None, max_expansions: int | None, plan: bool, backend: str | None) -> dict:
+    if mode == "all":
+        st = {}
+        dist = goal_distances(G, s, goals, weights=weights, budget=Budget(time_limit, max_expansions), stats=st)
+        rows = [{"goal": g, "cost": None, "path": None} if r is None else {"goal": g, "cost": r[0], "path": r[1]}
+                for g, r in dist.items()]
+        if plan:
+            for row in rows:
+                row["plan"] = path_plan(G, row["path"]) if row["path"] else None
+        return {"start": s, "goal_count": len(dist), "mode": mode, "distances": rows, "reached": st["reached"],
+                "stopped": st["stopped"]}
+
+    st1 = {}
+    l1 = goal_set_paths(G, s, goals, k, weights=weights, budget=Budget(time_limit, max_expansions), stats=st1)
+    l1l2, stopped2 = [], None
+    for g in st1["nearest"]:
+        allowed = set(itertools.chain.from_iterable(p for p in l1 if p[-1] == g))
+        st2 = {}
+        l1l2 += l1l2_paths(G, allowed, s, g, k or 5, weights=weights, budget=Budget(time_limit, max_expansions),
+                           stats=st2, backend=backend) if allowed else []
+        stopped2 = stopped2 or st2.get("stopped")
+    l1l2 = sorted(l1l2, key=lambda p: path_cost(G, p, weights))[:k or 5]
+    res = {"start": s, "goal_count": len(set(goals)), "mode": mode, "k": k, "nearest": st1["nearest"],
+           "cost": st1["cost"], "l1_paths": l1, "l1l2_paths": l1l2, "l1_exhaustive": st1["exhaustive"],
+           "l1_stopped": st1["stopped"], "l1l2_stopped": stopped2}
+    if plan:
+        res["l1_plans"] = [path_plan(G, p) for p in l1]
+        res["l1l2_plans"] = [path_plan(G, p) for p in l1l2]
+    return res
+
+
+def sweep(G, s: int, t: int, k: int | None, profiles: dict[str, Weights], *, hier=None,
+          corridor: float | None = None, time_limit: float | None = None,
+          max_expansions: int | None = None, backend: str | None = None,
+          cache: ResultCache | None = None) -> Iterator[dict]:
+    """同じ (s, t) を profiles の各重みで解き、コスト付きの結果をプロファイル順に返す
+
+    L1 経路の集合は黒の重みに依らないので 1 度だけ求め、L1+L2 探索の
+    部分グラフ隣接も共有する (全プロファイルが cache に当たれば作らない)。
+    プロファイル毎に行うのは重み付けと探索だけ。
+    """
+    st1 = {}
+    l1 = _l1(G, s, t, k, hier, corridor, None, Budget(time_limit, max_expansions), st1, backend, cache)
+    allowed = set(itertools.chain.from_iterable(l1))
+    sub = {}
+
+    def adjacency() -> dict:
+        if not sub:
+            sub.update(subgraph_adjacency(G, allowed))
+        return sub
+
+    for name, w in profiles.items():
+        st2 = {}
+        l1l2 = cached_l1l2_paths(cache, G, allowed, s, t, k or 5, weights=w, sub=adjacency,
+                                 budget=Budget(time_limit, max_expansions), stats=st2, backend=backend) if l1 else []
+        yield {"profile": name, "weights": w._asdict(), "start": s, "goal": t, "k": k,
+               "l1_paths": [path_record(G, p, w) for p in l1], "l1l2_paths": [path_record(G, p, w) for p in l1l2],
+               "l1_exhaustive": st1.get("exhaustive", True), "l1_stopped": st1.get("stopped"),
+               "l1l2_stopped": st2.get("stopped")}
+
+
+def _solve_row(row: tuple[int, int, int, int | None] | dict) -> tuple[int, dict, dict]:
+    if isinstance(row, dict):  # read_rows で読めなかった行はそのまま返す
+        return row["index"], {key: v for key, v in row.items() if key != "index"}, {}
+    i, s, t, k = row
+    cache = _worker["cache"]
+    before = dict(cache.stats) if cache is not None else {}
+    try:
+        res = solve(_worker["G"], s, t, k, hier=_worker["hier"], corridor=_worker["corridor"],
+                    weights=_worker["weights"], time_limit=_worker["time_limit"],
+                    max_expansions=_worker["max_expansions"], plan=_worker["plan"], backend=_worker["backend"],
+                    cache=cache)
+    except Exception as exc:  # 1 行の失敗でバッチ全体を止めない
+        res = {"start": s, "goal": t, "k": k, "error": f"{type(exc).__name__}: {exc}"}
+    delta = {key: n - before[key] for key, n in cache.stats.items()} if cache is not None else {}
+    return i, res, delta
+
+
+# ---------- 入出力 ------------------------------------------------------
+
+def _split_row(ln: str) -> list[str]:
+    """1 行を語に分ける (空白/カンマ区切り、# 以降はコメント、空白を含むコードは引用符で囲む)"""
+    lex = shlex.shlex(ln, posix=True)
+    lex.whitespace += ","
+    lex.whitespace_split = True
+    return list(lex)
+
+
+def _one_node(ident: str, resolve: Callable[[str], list[int]] | None, n: int | None) -> int:
+    """行の start / goal を 1 ノードに解決する (resolve 無しはノード番号のみ)"""
+    nodes = resolve(ident) if resolve is not None else resolve_plain(ident)
+    if not nodes:
+        raise ValueError(f"no node matches {ident!r}")
+    if len(nodes) > 1:
+        raise ValueError(f"{ident!r} resolves to {len(nodes)} nodes; batch rows take a single start and goal")
+    if n is not None and not 0 <= nodes[0] < n:
+        raise ValueError(f"unknown node id: {nodes[0]}")
+    return nodes[0]
+
+
+def read_rows(lines: Iterable[str], default_k: int | None, resolve: Callable[[str], list[int]] | None = None,
+              n: int | None = None) -> Iterator[tuple[int, int, int, int | None] | dict]:
+    """'start goal [k]' 行 (空白/カンマ区切り、# 以降はコメント) を読む
+
+    start / goal は resolve (単発問い合わせと同じノード指定、shortest_path_.node_resolver) で
+    1 ノードに解決し、n があれば番号の範囲も確かめる。解決できない・読めない行は止めずに
+    {"index": i, "error": ...} を返す (1 行の失敗でバッチ全体を止めない)。
+    """
+    i = 0
+    for ln in lines:
+        sp = []
+        try:
+            sp = _split_row(ln)
+            if len(sp) < 2:
+                continue
+            s, t = (_one_node(x, resolve, n) for x in sp[:2])
+            k = int(sp[2]) if len(sp) > 2 else default_k
+        except (OSError, ValueError) as exc:
+            yield {"index": i, **dict(zip(("start", "goal"), sp)), "error": f"{type(exc).__name__}: {exc}"}
+        else:
+            yield i, s, t, (k if k and k > 0 else None)
+        i += 1
+
+
+def run_batch(csr: CSRGraph, rows: Iterable[tuple[int, int, int, int | None] | dict], out: TextIO = sys.stdout,
+              *, workers: int | None = None, ordered: bool = True, chunksize: int = 16,
+              weights: Weights | None = None, plan: bool = False, backend: str | None = None,
+              time_limit: float | None = None, max_expansions: int | None = None, hier: bool = False,
+              corridor: float | None = None, cache: ResultCache | None = None, cache_stats: dict | None = None,
+              on_result: Callable[[dict], None] | None = None) -> int:
+    """rows をプロセスプールで解き、JSON Lines を out へ逐次書き出す
+
+    time_limit / max_expansions / hier / corridor は solve と同じ意味で各行に適用する
+    (hier か corridor があれば L2Hierarchy はワーカ毎に 1 度だけ作る)。
+    cache を渡すと各ワーカが同じ結果キャッシュを開き、その hit/miss の合計を cache_stats に足す。
+    on_result には各行の結果 dict が書き出し直後に渡される (描画ジョブの投入など)。
+    """
+    shared = SharedGraph(csr)
+    n_done = 0
+    initargs = (shared.spec, weights, plan, backend, cache.spec if cache is not None else None, time_limit,
+                max_expansions, hier, corridor)
+    try:
+        with Pool(workers or os.cpu_count(), initializer=_init_worker, initargs=initargs) as pool:
+            results = (pool.imap if ordered else pool.imap_unordered)(_solve_row, rows, chunksize)
+            for i, res, delta in results:
+                out.write(json.dumps({"index": i, **res}) + "\n")
+                if cache_stats is not None:
+                    for key, n in delta.items():
+                        cache_stats[key] = cache_stats.get(key, 0) + n
+                n_done += 1
+                if on_result is not None:
+                    on_result(res)
+    finally:
+        shared.close()
+    return n_done
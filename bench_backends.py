@@ -0,0 +1,185 @@
+from __future__ import annotations
+import argparse, contextlib, json, random, statistics, sys, time
+from pathlib import Path
+import Common_Utility as CU
+from bench_scaling import ensure_db, git_commit
+from search_backends import BACKENDS, DEFAULT_BACKEND
+
+# ---------- 探索バックエンドの一致確認とベンチマーク --------------------
+#
+# 同梱 DB (と --synthetic 指定時は合成 DB) 上のランダムな (start, goal) 組を
+# 全バックエンドで解き、基準バックエンド (先頭) と経路コスト・経路集合を突き合わせて
+# クエリ毎の所要時間を集計する。L1+L2 探索の許可ノードは基準の L1 経路から作り、
+# 全バックエンドに同じものを渡す。k 本で打ち切られた場合、同コストの経路の
+# どれが選ばれるかは実装毎に違ってよいので、集合の比較は打ち切りコスト未満に限る。
+# setup はグラフ毎の前処理 (初回のみ) で、先に測ったバックエンドと共有する分は含まない。
+
+EPS = 1e-9
+
+
+def _ms(seconds: float) -> float:
+    return round(seconds * 1e3, 3)
+
+
+def _percentiles(xs: list[float]) -> dict:
+    if not xs:
+        return {}
+    xs = sorted(xs)
+    return {"mean_ms": _ms(statistics.fmean(xs)), "p50_ms": _ms(xs[len(xs) // 2]),
+            "p95_ms": _ms(xs[min(len(xs) - 1, int(len(xs) * 0.95))]), "max_ms": _ms(xs[-1])}
+
+
+def run_query(G, backend: str, s: int, t: int, k: int | None, allowed: set[int] | None, weights: CU.Weights,
+              time_limit: float | None) -> dict:
+    """1 バックエンド分の L1 / L1+L2 探索 (allowed=None なら自分の L1 経路から作る)"""
+    st1, st2 = {}, {}
+    t0 = time.perf_counter()
+    l1 = CU.l1_shortest_paths(G, s, t, k, weights=weights, budget=CU.Budget(time_limit), stats=st1, backend=backend)
+    t1 = time.perf_counter()
+    if allowed is None:
+        allowed = {v for p in l1 for v in p}
+    l1l2 = CU.l1l2_paths(G, allowed, s, t, k or 5, weights=weights, budget=CU.Budget(time_limit), stats=st2,
+                         backend=backend) if allowed else []
+    t2 = time.perf_counter()
+    return {"l1": l1, "l1_stats": st1, "l1l2": l1l2, "l1l2_stats": st2, "allowed": allowed,
+            "l1_seconds": t1 - t0, "l1l2_seconds": t2 - t1}
+
+
+def _cut(stats: dict) -> bool:
+    return stats.get("stopped") in ("time", "expansions")
+
+
+def check(G, ref: dict, res: dict, k: int | None, weights: CU.Weights) -> list[str]:
+    """res を基準 ref と突き合わせ、食い違いの説明を返す (予算切れの列挙は比較しない)"""
+    problems = []
+    if not (_cut(ref["l1_stats"]) or _cut(res["l1_stats"])):
+        if ref["l1_stats"].get("cost") != res["l1_stats"].get("cost"):
+            problems.append(f"L1 cost {res['l1_stats'].get('cost')} != {ref['l1_stats'].get('cost')}")
+        for p in res["l1"]:
+            if any(c != "black" for c in CU.path_colors(G, p)) or len(set(p)) != len(p):
+                problems.append(f"L1 path {p} is not a simple black path")
+            elif abs(CU.path_cost(G, p, weights) - (ref["l1_stats"].get("cost") or 0.0)) > EPS:
+                problems.append(f"L1 path {p} is not shortest")
+        same = {tuple(p) for p in ref["l1"]} == {tuple(p) for p in res["l1"]}
+        if ref["l1_stats"]["exhaustive"] and res["l1_stats"]["exhaustive"] and not same:
+            problems.append("L1 path sets differ")
+        elif len(ref["l1"]) != len(res["l1"]):
+            problems.append(f"L1 path count {len(res['l1'])} != {len(ref['l1'])}")
+
+    if not (_cut(ref["l1l2_stats"]) or _cut(res["l1l2_stats"])):
+        costs = {}
+        for name, r in (("ref", ref), ("res", res)):
+            costs[name] = [CU.path_cost(G, p, weights) for p in r["l1l2"]]
+        for p in res["l1l2"]:
+            cols = CU.path_colors(G, p)
+            if None in cols or all(c == "black" for c in cols) or len(set(p)) != len(p) or not set(p) <= ref["allowed"]:
+                problems.append(f"L1+L2 path {p} is not a simple allowed path with a red/blue edge")
+        a, b = sorted(costs["ref"]), sorted(costs["res"])
+        if len(a) != len(b) or any(abs(x - y) > EPS for x, y in zip(a, b)):
+            problems.append(f"L1+L2 costs {b} != {a}")
+        else:
+            # k 本目と同コストの経路はどれが選ばれてもよい
+            limit = float("inf") if len(a) < (k or 5) else a[-1] - EPS
+            below = [{tuple(p) for p, c in zip(r["l1l2"], costs[name]) if c < limit}
+                     for name, r in (("ref", ref), ("res", res))]
+            if below[0] != below[1]:
+                problems.append("L1+L2 path sets differ")
+    return problems
+
+
+def bench_db(l1l2_path: Path, l2_path: Path, backends: list[str], args: argparse.Namespace) -> dict:
+    with contextlib.redirect_stdout(sys.stderr):   # 構築中の進捗表示を結果と混ぜない
+        G, _, _ = CU.build_graph(l1l2_path, l2_path, implicit_l2=args.implicit_l2)
+    weights = CU.parse_weights(args.weights)
+    k = args.k_paths if args.k_paths > 0 else None
+
+    # 隣接リスト等のグラフ毎の前処理は初回だけなので、クエリ時間とは分けて測る
+    setup = {}
+    for name in backends:
+        t0 = time.perf_counter()
+        run_query(G, name, 0, 0, k, {0}, weights, None)
+        setup[name] = _ms(time.perf_counter() - t0)
+
+    rng = random.Random(args.seed)
+    pairs = [tuple(rng.sample(range(G.vcount()), 2)) for _ in range(args.queries)]
+    times = {name: {"l1": [], "l1l2": []} for name in backends}
+    mismatches = []
+    n_l1 = n_l1l2 = 0
+    for s, t in pairs:
+        ref = run_query(G, backends[0], s, t, k, None, weights, args.time_limit)
+        n_l1 += bool(ref["l1"])
+        n_l1l2 += bool(ref["l1l2"])
+        for name in backends:
+            res = ref if name == backends[0] else run_query(G, name, s, t, k, ref["allowed"], weights,
+                                                            args.time_limit)
+            times[name]["l1"].append(res["l1_seconds"])
+            times[name]["l1l2"].append(res["l1l2_seconds"])
+            if name != backends[0]:
+                mismatches += [{"backend": name, "start": s, "goal": t, "problem": msg}
+                               for msg in check(G, ref, res, k, weights)]
+
+    return {"db": l1l2_path.name, "nodes": G.vcount(), "edges": G.ecount(), "implicit_l2": args.implicit_l2,
+            "queries": len(pairs), "with_l1_paths": n_l1, "with_l1l2_paths": n_l1l2, "reference": backends[0],
+            "backends": {name: {"setup_ms": setup[name], "l1": _percentiles(times[name]["l1"]),
+                                "l1l2": _percentiles(times[name]["l1l2"]),
+                                "mismatches": sum(m["backend"] == name for m in mismatches)} for name in backends},
+            "mismatches": mismatches}
+
+
+def report(r: dict) -> None:
+    print(f"[+] {r['db']}  |V|={r['nodes']} |E|={r['edges']}  queries={r['queries']} "
+          f"(L1 found {r['with_l1_paths']}, L1+L2 found {r['with_l1l2_paths']})")
+    for name, b in r["backends"].items():
+        cells = [f"{ph}: mean={b[ph].get('mean_ms', 0):.2f}ms p95={b[ph].get('p95_ms', 0):.2f}ms" for ph in ("l1", "l1l2")]
+        tag = "ref" if name == r["reference"] else f"{b['mismatches']} mismatches"
+        print(f"      {name:<9} setup={b['setup_ms']:.1f}ms  " + "  ".join(cells) + f"  [{tag}]")
+    for m in r["mismatches"][:10]:
+        print(f"[!] {m['backend']} s={m['start']} g={m['goal']}: {m['problem']}")
+
+
+# ---------- CLI -------------------------------------------------------
+def cli() -> argparse.Namespace:
+    p = argparse.ArgumentParser(description="Check that search backends agree and compare their per-query speed.")
+    p.add_argument("--l1l2", default="1020000_L1-L2_DB.txt", help="L1-L2 DB file path")
+    p.add_argument("--l2",   default="1020000_L2_DB.txt",    help="L2 DB file path")
+    p.add_argument("--synthetic", default="", help="Also run on synthetic DBs of these comma-separated node counts")
+    p.add_argument("--work-dir", default="bench_data", help="Where synthetic DBs are generated / reused")
+    p.add_argument("--backends", default=",".join(BACKENDS),
+                   help=f"Comma-separated backends; the first is the reference (available: {', '.join(BACKENDS)})")
+    p.add_argument("--implicit-l2", action="store_true", help="Build graphs with implicit red/blue L2 edges")
+    p.add_argument("--queries", type=int, default=20, help="Random (start, goal) pairs per DB")
+    p.add_argument("-k", "--k_paths", type=int, default=10, help="Paths per query (0 = all)")
+    p.add_argument("--weights", default=None, metavar="SPEC", help="Weight profile / overrides (see shortest_path_.py)")
+    p.add_argument("--time-limit", type=float, default=5.0, help="Per-query enumeration budget in seconds")
+    p.add_argument("--seed", type=int, default=0)
+    p.add_argument("-o", "--out", default="bench_backends.json", help="Result JSON file")
+    return p.parse_args()
+
+
+def main():
+    args = cli()
+    backends = [b.strip() for b in args.backends.split(",") if b.strip()]
+    unknown = [b for b in backends if b not in BACKENDS]
+    if unknown or not backends:
+        sys.exit(f"[!] unknown backend(s) {unknown} (available: {', '.join(BACKENDS)})")
+    if backends[0] != DEFAULT_BACKEND:
+        print(f"[i] reference backend is {backends[0]}")
+
+    dbs = [(Path(args.l1l2).expanduser().resolve(), Path(args.l2).expanduser().resolve())]
+    dbs += [ensure_db(Path(args.work_dir), int(n), []) for n in args.synthetic.split(",") if n.strip()]
+    results = {"commit": git_commit(), "created": time.strftime("%Y-%m-%dT%H:%M:%S"), "k": args.k_paths,
+               "weights": CU.parse_weights(args.weights)._asdict(), "results": []}
+    for l1l2_path, l2_path in dbs:
+        r = bench_db(l1l2_path, l2_path, backends, args)
+        results["results"].append(r)
+        report(r)
+
+    Path(args.out).write_text(json.dumps(results, indent=2))
+    n_bad = sum(len(r["mismatches"]) for r in results["results"])
+    print(f"[✓] Results written → {args.out}" + (f" ({n_bad} mismatches)" if n_bad else " (all backends agree)"))
+    if n_bad:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
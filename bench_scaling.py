@@ -0,0 +1,160 @@
+from __future__ import annotations
+import argparse, contextlib, json, platform, random, resource, shutil, subprocess, sys, tempfile, time
+from pathlib import Path
+
+# ---------- スケーリングベンチマーク ----------------------------------
+#
+# gen_synthetic_db.py で規模毎の DB を作り (既にあれば再利用)、規模毎に
+# 子プロセスで parse / build / キャッシュ保存・読込 / L1 経路 / L1+L2 経路 /
+# 描画 を計測する。各段階の所要時間とその時点までのピーク RSS を JSON で
+# 書き出し、--compare で別コミットの結果との比を表示する。
+
+HERE = Path(__file__).resolve().parent
+PHASES = ("parse", "build", "cache_save", "cache_load", "l1_paths", "l1l2_paths", "render")
+
+
+def _peak_rss_mb() -> float:
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+@contextlib.contextmanager
+def _phase(out: dict, name: str):
+    t0 = time.perf_counter()
+    with contextlib.redirect_stdout(sys.stderr):   # 構築中の進捗表示を結果 JSON と混ぜない
+        yield
+    out[name] = {"seconds": round(time.perf_counter() - t0, 4), "peak_rss_mb": round(_peak_rss_mb(), 1)}
+
+
+def run_child(l1l2_path: Path, l2_path: Path, queries: int, seed: int, time_limit: float) -> dict:
+    """1 規模分の計測 (子プロセス内で実行)"""
+    sys.path.insert(0, str(HERE))
+    import Common_Utility as CU
+    from graph_cache import fingerprint, load_graph_cache, save_graph_cache
+    from graph_csr import CSRGraph
+    from render_pipeline import RenderCache, build_dot
+
+    phases: dict = {}
+    with _phase(phases, "parse"):
+        CU.parse_dbs(l1l2_path, l2_path)
+    with _phase(phases, "build"):
+        G, labels, L1num_to_L2code = CU.build_graph(l1l2_path, l2_path)
+    info = {"nodes": G.vcount(), "edges": G.ecount()}
+
+    with tempfile.TemporaryDirectory() as tmp:
+        cache_path = Path(tmp) / "bench_graph.csr"
+        with _phase(phases, "cache_save"):
+            save_graph_cache(cache_path, CSRGraph.from_igraph(G, L1num_to_L2code), labels, L1num_to_L2code,
+                             fingerprint(l1l2_path, l2_path))
+        del G
+        with _phase(phases, "cache_load"):
+            cache = load_graph_cache(cache_path)
+            G = cache.csr
+
+        rng = random.Random(seed)
+        pairs = [tuple(rng.sample(range(G.vcount()), 2)) for _ in range(queries)]
+        l1, cut = [], 0
+        with _phase(phases, "l1_paths"):
+            for s, t in pairs:
+                stats = {}
+                l1.append(CU.l1_shortest_paths(G, s, t, 10, budget=CU.Budget(time_limit), stats=stats))
+                cut += stats["stopped"] in ("time", "expansions")
+        l12 = []
+        with _phase(phases, "l1l2_paths"):
+            for (s, t), paths in zip(pairs, l1):
+                nodes = {v for p in paths for v in p}
+                l12.append(CU.l1l2_paths(G, nodes, s, t, 5, budget=CU.Budget(time_limit)))
+        with _phase(phases, "render"):
+            sources = [build_dot(G, cache.labels, s, t, p, q, L1num_to_L2code=cache.L1num_to_L2code)
+                       for (s, t), p, q in zip(pairs, l1, l12)]
+            if shutil.which("dot") and sources:
+                RenderCache(Path(tmp) / "render").render(sources[0])
+        info["rendered_pdf"] = bool(shutil.which("dot"))
+        del cache, G
+
+    info.update(queries=queries, l1_cut_off=cut, phases=phases)
+    return info
+
+
+# ---------- 親プロセス ----------------------------------------------------
+
+def ensure_db(work_dir: Path, n: int, gen_args: list[str]) -> tuple[Path, Path]:
+    prefix = f"9{n}"
+    l1l2_path, l2_path = work_dir / f"{prefix}_L1-L2_DB.txt", work_dir / f"{prefix}_L2_DB.txt"
+    if not (l1l2_path.exists() and l2_path.exists()):
+        print(f"[i] Generating {n}-node DB in {work_dir}…")
+        subprocess.run([sys.executable, str(HERE / "gen_synthetic_db.py"), "-n", str(n), "-o", str(work_dir),
+                        "--prefix", prefix, *gen_args], check=True, stdout=subprocess.DEVNULL)
+    return l1l2_path, l2_path
+
+
+def measure(l1l2_path: Path, l2_path: Path, args: argparse.Namespace) -> dict:
+    cmd = [sys.executable, str(Path(__file__).resolve()), "--child", str(l1l2_path), str(l2_path),
+           "--queries", str(args.queries), "--seed", str(args.seed), "--time-limit", str(args.time_limit)]
+    proc = subprocess.run(cmd, capture_output=True, text=True)
+    if proc.returncode != 0:
+        raise RuntimeError(f"benchmark child failed:\n{proc.stderr[-2000:]}")
+    return json.loads(proc.stdout.strip().splitlines()[-1])
+
+
+def git_commit() -> str | None:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=HERE, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results: dict, baseline: dict) -> None:
+    base = {r["nodes"]: r for r in baseline["results"]}
+    print(f"[i] Compared with {baseline.get('commit') or 'baseline'} (ratio = now / baseline)")
+    for r in results["results"]:
+        b = base.get(r["nodes"])
+        if b is None:
+            continue
+        cells = [f"{ph}={r['phases'][ph]['seconds'] / b['phases'][ph]['seconds']:.2f}x"
+                 for ph in PHASES if ph in b["phases"] and b["phases"][ph]["seconds"] > 0]
+        print(f"      n={r['nodes']:<8} " + "  ".join(cells))
+
+
+# ---------- CLI -------------------------------------------------------
+def cli() -> argparse.Namespace:
+    p = argparse.ArgumentParser(description="Scaling benchmark over synthetic DBs.")
+    p.add_argument("--scales", default="1000,10000,100000", help="Comma-separated node counts (up to 1000000)")
+    p.add_argument("--work-dir", default="bench_data", help="Where synthetic DBs are generated / reused")
+    p.add_argument("--queries", type=int, default=20, help="Random (start, goal) pairs per scale")
+    p.add_argument("--time-limit", type=float, default=5.0, help="Per-query enumeration budget in seconds")
+    p.add_argument("--seed", type=int, default=0)
+    p.add_argument("--gen-args", default="", help="Extra arguments for gen_synthetic_db.py, e.g. '--class-dist zipf'")
+    p.add_argument("-o", "--out", default="bench_scaling.json", help="Result JSON file")
+    p.add_argument("--compare", default=None, help="Baseline result JSON to compare against")
+    p.add_argument("--child", nargs=2, default=None, help=argparse.SUPPRESS)
+    return p.parse_args()
+
+
+def main():
+    args = cli()
+    if args.child:
+        res = run_child(Path(args.child[0]), Path(args.child[1]), args.queries, args.seed, args.time_limit)
+        print(json.dumps(res))
+        return
+
+    work_dir = Path(args.work_dir)
+    results = {"commit": git_commit(), "python": platform.python_version(), "machine": platform.machine(),
+               "created": time.strftime("%Y-%m-%dT%H:%M:%S"), "queries": args.queries,
+               "gen_args": args.gen_args, "results": []}
+    for n in (int(x) for x in args.scales.split(",")):
+        l1l2_path, l2_path = ensure_db(work_dir, n, args.gen_args.split())
+        r = measure(l1l2_path, l2_path, args)
+        results["results"].append(r)
+        print(f"[+] n={r['nodes']:<8} |E|={r['edges']:<9} " +
+              "  ".join(f"{ph}={v['seconds']:.3f}s" for ph, v in r["phases"].items()) +
+              f"  peak={max(v['peak_rss_mb'] for v in r['phases'].values()):.0f}MB")
+
+    Path(args.out).write_text(json.dumps(results, indent=2))
+    print(f"[✓] Results written → {args.out}")
+    if args.compare:
+        compare(results, json.loads(Path(args.compare).read_text()))
+
+
+if __name__ == "__main__":
+    main()
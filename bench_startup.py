@@ -0,0 +1,93 @@
+from __future__ import annotations
+import argparse, json, statistics, subprocess, sys, time
+from pathlib import Path
+
+# ---------- 起動時間ベンチマーク --------------------------------------
+#
+# ヘッドレス問い合わせ (shortest_path_.py --format json) を別プロセスで
+# 繰り返し起動し、-X importtime の出力から import 時間を、壁時計から
+# 最初の結果が出るまでの時間を測る。描画系 (graphviz / networkx) が
+# 読み込まれていないことも併せて確認する。
+
+HERE = Path(__file__).resolve().parent
+LAZY = ("graphviz", "networkx")
+
+
+def parse_importtime(stderr: str) -> tuple[float, dict[str, float], set[str]]:
+    """(トップレベル import 合計 ms, トップレベルモジュール毎 ms, 読み込まれた全モジュール)"""
+    total, top, seen = 0.0, {}, set()
+    for ln in stderr.splitlines():
+        if not ln.startswith("import time:") or "|" not in ln:
+            continue
+        _, cum, name = ln.split("|", 2)
+        if not cum.strip().isdigit():
+            continue                                    # 見出し行
+        mod = name.strip()
+        seen.add(mod)
+        if name.startswith(" ") and not name.startswith("  "):   # インデント 1 段 = トップレベル
+            top[mod] = int(cum) / 1e3
+            total += int(cum) / 1e3
+    return total, top, seen
+
+
+def run_once(cmd: list[str], cwd: Path | None = None) -> dict:
+    t0 = time.perf_counter()
+    proc = subprocess.run([sys.executable, "-X", "importtime", *cmd], cwd=cwd, capture_output=True, text=True)
+    wall = (time.perf_counter() - t0) * 1e3
+    if proc.returncode != 0:
+        raise RuntimeError(f"{' '.join(cmd)} failed:\n{proc.stderr[-2000:]}")
+    total, top, seen = parse_importtime(proc.stderr)
+    return {"wall_ms": wall, "import_ms": total, "top": top, "lazy_loaded": sorted(m for m in LAZY if m in seen)}
+
+
+def summarize(runs: list[dict]) -> dict:
+    med = lambda key: statistics.median(r[key] for r in runs)
+    top = {m: statistics.median(r["top"].get(m, 0.0) for r in runs) for m in runs[0]["top"]}
+    return {
+        "runs": len(runs),
+        "wall_ms_median": round(med("wall_ms"), 2),
+        "wall_ms_min": round(min(r["wall_ms"] for r in runs), 2),
+        "import_ms_median": round(med("import_ms"), 2),
+        "top_imports_ms": dict(sorted(((m, round(v, 2)) for m, v in top.items()), key=lambda kv: -kv[1])[:10]),
+        "lazy_loaded": sorted(set().union(*(r["lazy_loaded"] for r in runs))),
+    }
+
+
+# ---------- CLI -------------------------------------------------------
+def cli() -> argparse.Namespace:
+    p = argparse.ArgumentParser(description="Measure import time and time-to-first-result of headless queries.")
+    p.add_argument("--l1l2", default="1020000_L1-L2_DB.txt", help="L1-L2 DB file path")
+    p.add_argument("--l2",   default="1020000_L2_DB.txt",    help="L2 DB file path")
+    p.add_argument("-c", "--cache", default=None, help="Cache file (default: auto)")
+    p.add_argument("-s", "--start", type=int, default=0)
+    p.add_argument("-g", "--goal",  type=int, default=25)
+    p.add_argument("-k", "--k_paths", type=int, default=10)
+    p.add_argument("-n", "--repeat", type=int, default=10, help="Number of process launches per measurement")
+    p.add_argument("-o", "--out", default=None, help="Write results as JSON to this file")
+    return p.parse_args()
+
+
+def main():
+    args = cli()
+    query = [str(HERE / "shortest_path_.py"), "--l1l2", str(Path(args.l1l2).resolve()), "--l2", str(Path(args.l2).resolve()),
+             "-s", str(args.start), "-g", str(args.goal), "-k", str(args.k_paths), "--format", "json"]
+    if args.cache:
+        query += ["--cache", str(Path(args.cache).resolve())]
+
+    run_once(query)   # キャッシュが無ければここで作らせ、計測からは除外する
+    results = {
+        "import_only": summarize([run_once(["-c", "import shortest_path_"], cwd=HERE) for _ in range(args.repeat)]),
+        "first_result": summarize([run_once(query) for _ in range(args.repeat)]),
+    }
+    for name, r in results.items():
+        print(f"[i] {name:<12}: wall {r['wall_ms_median']:.1f} ms (min {r['wall_ms_min']:.1f}), "
+              f"imports {r['import_ms_median']:.1f} ms, lazy modules loaded: {r['lazy_loaded'] or 'none'}")
+        for mod, ms in r["top_imports_ms"].items():
+            print(f"      {mod:<28} {ms:8.1f} ms")
+    if args.out:
+        Path(args.out).write_text(json.dumps(results, indent=2))
+        print(f"[✓] Results written → {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,38 +1,108 @@
 from __future__ import annotations
-import argparse, pickle
+import argparse, sys
 from pathlib import Path
-from shortest_path_base import build_graph, auto_prefix
+from Common_Utility import auto_prefix
+from graph_cache import cache_lock, fingerprint, load_graph_cache, load_or_build, load_or_build_pickle, same_inputs
+from graph_delta import apply_delta
+from node_index import default_l1_db, open_index
+from path_oracle import LAYERS, PathOracle, build_oracle, drop_oracle
+import instrument
 
 
 def cli() -> argparse.Namespace:
-    p = argparse.ArgumentParser(description="Build NetworkX graph and cache it as Pickle.")
+    p = argparse.ArgumentParser(description="Build the L1/L2 graph and cache it (mmap CSR format, or Pickle for *.pkl).")
     p.add_argument("--l1l2", default="1050400_L1-L2_DB.txt", help="L1-L2 DB file path")
     p.add_argument("--l2",   default="1050400_L2_DB.txt",    help="L2 DB file path")
-    p.add_argument("-c", "--cache", default=None, help="Pickle cache file path (default: auto)")
+    p.add_argument("-c", "--cache", default=None, help="Cache file path (default: auto, <prefix>_graph.csr; *.pkl = legacy Pickle)")
     p.add_argument("-f", "--force", action="store_true", help="Rebuild even if cache exists")
+    p.add_argument("--implicit-l2", action="store_true", help="Keep red/blue L2 edges implicit (class membership + L2 adjacency)")
+    p.add_argument("--delta", action="store_true", help="Update an existing cache from changed DB files, regenerating only the red/blue edges of affected L2 classes (still parses the whole DB and rewrites the cache: O(DB))")
+    p.add_argument("--l1-db", default=None, metavar="FILE", help="L1 DB with state hashes for the node index (default: <prefix>_L1_DB.txt or ROBOT_DB_L1.txt beside --l1l2)")
+    p.add_argument("--apsp", action="store_true", help="Also precompute all-pairs distance/predecessor matrices (black and full)")
+    p.add_argument("--apsp-block", type=int, default=1024, help="Rows per APSP block")
+    p.add_argument("--parse-workers", type=int, default=None, help="DB parser worker processes (default: auto from CPU count and file size)")
+    p.add_argument("--profile", default=None, metavar="FILE", help="Write per-phase timings and counters as JSON (or set SP_PROFILE)")
+    p.add_argument("--trace", default=None, metavar="FILE", help="Write a Chrome trace-event file (or set SP_TRACE)")
     return p.parse_args()
 
 
+def build_apsp(G, cache_path: Path, block: int) -> None:
+    for layer in LAYERS:
+        build_oracle(G, cache_path, layer, block=block)
+
+
+def drop_apsp(cache_path: Path) -> None:
+    """再構築したグラフと合わない古い行列は残さない"""
+    for layer in LAYERS:
+        drop_oracle(cache_path, layer)
+
+
+def try_delta(l1l2_path: Path, l2_path: Path, cache_path: Path, implicit_l2: bool) -> bool:
+    """同じ重み・モードで作られた古いキャッシュがあれば差分だけ反映する"""
+    cache = load_graph_cache(cache_path) if cache_path.exists() else None
+    if cache is None or cache.csr.implicit != implicit_l2:
+        return False
+    prev = cache.header["fingerprint"]
+    fp = fingerprint(l1l2_path, l2_path, implicit_l2=implicit_l2, prev=prev)
+    if prev["weights"] != fp["weights"] or same_inputs(prev, fp):
+        return False
+    apply_delta(cache, l1l2_path, l2_path, cache_path)
+    return True
+
+
+def sync_apsp(cache, cache_path: Path, build: bool, block: int) -> None:
+    """レイヤ内容ハッシュが変わった APSP 行列だけを作り直す / 捨てる"""
+    G = None
+    for layer in LAYERS:
+        h = cache.header["layer_hash"][layer]
+        if PathOracle.exists(cache_path, layer, h):
+            continue
+        if build:
+            G = G or cache.csr
+            build_oracle(G, cache_path, layer, block=block, layer_hash=h)
+        else:
+            drop_oracle(cache_path, layer)
+
+
 def main():
     args = cli()
+    instrument.setup(args.profile, args.trace)
 
     l1l2_path = Path(args.l1l2).expanduser().resolve()
     l2_path   = Path(args.l2).expanduser().resolve()
 
     # --- default cache name -----------------------------------------
     if args.cache is None:
-        args.cache = f"{auto_prefix(l1l2_path)}_graph.pkl"
+        args.cache = f"{auto_prefix(l1l2_path)}_graph.csr"
     cache_path = Path(args.cache).expanduser().resolve()
 
-    if cache_path.exists() and not args.force:
-        print(f"[✓] Cache already exists → {cache_path.name} (use --force to rebuild)")
+    if cache_path.suffix != ".pkl":
+        updated = False
+        if args.delta and not args.force:
+            with cache_lock(cache_path):
+                updated = try_delta(l1l2_path, l2_path, cache_path, args.implicit_l2)
+        cache = load_or_build(l1l2_path, l2_path, cache_path, implicit_l2=args.implicit_l2, force=args.force,
+                              verify=True, parse_workers=args.parse_workers)
+        if not (cache.rebuilt or updated):
+            print(f"[✓] Cache up to date → {cache_path.name} (use --force to rebuild)")
+        sync_apsp(cache, cache_path, args.apsp, args.apsp_block)
+        l1_db = Path(args.l1_db).expanduser().resolve() if args.l1_db else default_l1_db(l1l2_path)
+        open_index(cache_path, cache.labels, cache.L1num_to_L2code, l2_path, l1_db)
         return
 
-    G, node_labels, L1num_to_L2code = build_graph(l1l2_path, l2_path)
-
-    with cache_path.open("wb") as f:
-        pickle.dump((G, node_labels, L1num_to_L2code), f)
-    print(f"[+] Graph cached to {cache_path.relative_to(Path.cwd())}")
+    try:
+        (G, _, _), rebuilt = load_or_build_pickle(l1l2_path, l2_path, cache_path, implicit_l2=args.implicit_l2,
+                                                  force=args.force, parse_workers=args.parse_workers)
+    except ValueError as exc:
+        sys.exit(f"[!] {exc}")
+    if not rebuilt:
+        print(f"[✓] Cache already exists → {cache_path.name} (use --force to rebuild)")
+        if args.apsp and not all(PathOracle.exists(cache_path, layer) for layer in LAYERS):
+            build_apsp(G, cache_path, args.apsp_block)
+    elif args.apsp:
+        build_apsp(G, cache_path, args.apsp_block)
+    else:
+        drop_apsp(cache_path)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
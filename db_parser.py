@@ -0,0 +1,269 @@
+from __future__ import annotations
+import itertools, os, re
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Iterable, Iterator, NamedTuple
+import numpy as np
+from instrument import count, phase
+
+# ---------- DB 解析 (ストリーミング) ----------------------------------
+#
+# ファイル全体を読み込まず chunk_bytes 程度のブロック単位で処理する。
+# ノード節は読みながら行境界で区切ったブロックを、エッジ節は節の開始位置から
+# chunk_bytes 毎のバイト範囲を (workers > 1 ならプロセスプールで) 解析する。
+# エッジは範囲毎に int64 の (m, 2) 配列で返り、ファイル記載順に連結される。
+# メモリは「ラベル辞書 + エッジ配列 + 処理中ブロック (workers × 2) × chunk_bytes」。
+#
+# 行形式は次の 2 通りを受け付ける (ラベルの切り出し位置はどちらも同じ):
+#   L1-L2 ノード行: "L1 |" / "L1  |" … "L2",  "L2 |" / "L2  |" … "#"
+#   L2 ノード行   : "encode_level: 2 |" / "encode_level: 2 L2 |" … "Connected"
+#   L2 エッジ行   : "<idx> <a> <b> <action>" / "<a> <b> <action>" / "<a> <b>"
+# エッジ行末尾の操作ラベル (例 "Disassemble Port(2, 1) : Port(1, 0)") は
+# 文字列プール actions と行毎の番号 (無ければ -1) に分けて保持する。
+
+CHUNK_BYTES = 8 << 20
+_L1_EDGES = re.compile(r"# number of l1 edges", re.IGNORECASE)
+_L2_EDGES = re.compile(r"# number of l2 edges", re.IGNORECASE)
+
+
+class ParsedDB(NamedTuple):
+    """L1-L2 / L2 DB の解析結果"""
+    n_nodes: int
+    node_labels: dict[int, str]
+    L1num_to_L2code: dict[int, str]
+    L2code_to_L1num: dict[str, list[int]]
+    l1_edges: np.ndarray              # (m, 2) int64, ファイル記載順
+    l2_pairs: list[tuple[str, str]]   # L2 エッジ (コード対), ファイル記載順
+    l1_actions: np.ndarray            # (m,) int32, l1_edges 各行の操作ラベル番号 (-1 = 無し)
+    l2_actions: list[int]             # l2_pairs 各要素の操作ラベル番号
+    actions: list[str]                # 操作ラベルの文字列プール (L1 / L2 共通)
+
+
+# ---------- 行単位のラベル切り出し ------------------------------------
+
+def node_line_labels(ln: str) -> tuple[int, str, str]:
+    """L1-L2 ノード行 → (ノード番号, L1 ラベル, L2 コード)"""
+    nid = int(ln.split(None, 1)[0])
+    L1s = ln.find("|", ln.find("L1")) + 1
+    L1e = ln.find("L2", L1s)
+    L2s = ln.find("|", L1e) + 1
+    L2e = ln.find("#", L2s)
+    return nid, ln[L1s:L1e].strip().replace("|", "\n"), ln[L2s:L2e].strip()
+
+
+def l2_line_code(ln: str) -> tuple[int, str]:
+    """L2 ノード行 → (L2 番号, L2 コード)"""
+    i = ln.find("encode_level: 2")
+    s = ln.find("|", i if i >= 0 else ln.find("L2")) + 1
+    return int(ln.split(None, 1)[0]), ln[s:ln.find("Connected", s)].strip()
+
+
+# ---------- ブロック単位の解析 (ワーカーでも実行) ----------------------
+
+def parse_node_block(data: bytes) -> list[tuple[int, str, str]]:
+    """L1-L2 ノード行のまとまり → [(ノード番号, 表示ラベル, L2 コード)]"""
+    out = []
+    for ln in data.decode("utf-8").splitlines():
+        if ln.strip():
+            nid, l1_label, l2_label = node_line_labels(ln)
+            out.append((nid, f"# {nid}\n{l1_label}\n{l2_label}", l2_label))
+    return out
+
+
+def parse_l2_node_block(data: bytes) -> list[tuple[int, str]]:
+    return [l2_line_code(ln) for ln in data.decode("utf-8").splitlines() if ln.strip()]
+
+
+def parse_edge_block(data: bytes, *, l2: bool = False) -> tuple[np.ndarray, np.ndarray, list[str]]:
+    """エッジ行のバイト列 → ((m, 2) int64, 操作ラベル番号 (m,) int32, ブロック内の文字列プール)
+
+    数字で始まらない行は読み飛ばす。l2=True では 3 列目も数字なら先頭を
+    通し番号とみなして 2, 3 列目を使う。操作ラベルの無い "<a> <b>" 行も受け付ける。
+    """
+    pairs, ids = [], []
+    pool: dict[bytes, int] = {}
+    for ln in data.split(b"\n"):
+        if l2:
+            sp = ln.split(None, 3)
+            if len(sp) < 2 or not sp[0].isdigit():
+                continue
+            if len(sp) > 2 and sp[2].isdigit():
+                pairs.append((int(sp[1]), int(sp[2])))
+                rest = sp[3] if len(sp) > 3 else b""
+            else:
+                pairs.append((int(sp[0]), int(sp[1])))
+                rest = ln.split(None, 2)[2] if len(sp) > 2 else b""
+        else:
+            sp = ln.split(None, 2)
+            if len(sp) < 2 or not sp[0].isdigit():
+                continue
+            pairs.append((int(sp[0]), int(sp[1])))
+            rest = sp[2] if len(sp) > 2 else b""
+        rest = rest.rstrip()
+        ids.append(pool.setdefault(rest, len(pool)) if rest else -1)
+    return (np.asarray(pairs, dtype=np.int64).reshape(-1, 2), np.asarray(ids, dtype=np.int32),
+            [b.decode("utf-8") for b in pool])
+
+
+def _read_range(path: Path, section_start: int, lo: int, hi: int) -> bytes:
+    """lo 以降に始まり hi より前に始まる行をまとめて読む (範囲を跨ぐ行は前の範囲に属する)"""
+    with path.open("rb") as f:
+        if lo > section_start:
+            f.seek(lo - 1)
+            f.readline()            # lo-1 を含む行の残りを捨てる
+        else:
+            f.seek(lo)
+        pos = f.tell()
+        if pos >= hi:
+            return b""
+        data = f.read(hi - pos)
+        if data and not data.endswith(b"\n"):
+            data += f.readline()
+        return data
+
+
+def _parse_edge_range(path: Path, section_start: int, lo: int, hi: int, l2: bool) -> tuple[np.ndarray, np.ndarray, list[str]]:
+    return parse_edge_block(_read_range(path, section_start, lo, hi), l2=l2)
+
+
+# ---------- ファイル走査 ------------------------------------------------
+
+def _node_blocks(f, n: int, chunk_bytes: int) -> Iterator[bytes]:
+    """f の現在位置から n 行を、行境界で区切った chunk_bytes 程度のまとまりで返す"""
+    left = n
+    while left > 0:
+        data = f.read(chunk_bytes)
+        if not data:
+            return
+        if not data.endswith(b"\n"):
+            data += f.readline()
+        lines = data.count(b"\n") + (not data.endswith(b"\n"))
+        if lines > left:            # ノード節の終わり: 余分に読んだ行は戻す
+            cut = 0
+            for _ in range(left):
+                cut = data.index(b"\n", cut) + 1
+            f.seek(cut - len(data), 1)
+            data, lines = data[:cut], left
+        left -= lines
+        yield data
+
+
+def _find_header(f, header: re.Pattern, path: Path) -> int:
+    """f の現在位置から header 行を探し、その直後のバイト位置を返す"""
+    for raw in iter(f.readline, b""):
+        if header.search(raw.decode("utf-8", "replace")):
+            return f.tell()
+    raise ValueError(f"{path.name}: '{header.pattern}' header not found")
+
+
+class _Runner:
+    """ブロック解析をその場で、またはプロセスプールで順序通りに実行する"""
+
+    def __init__(self, workers: int):
+        self.workers = workers
+        self.pool = ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+
+    def map(self, fn, args: Iterable[tuple]) -> Iterator:
+        """fn(*a) の結果を args の順に返す。同時に抱えるのは workers × 2 件まで"""
+        if self.pool is None:
+            yield from (fn(*a) for a in args)
+            return
+        todo = iter(args)
+        pending = deque(self.pool.submit(fn, *a) for a in itertools.islice(todo, self.workers * 2))
+        while pending:
+            res = pending.popleft().result()
+            pending.extend(self.pool.submit(fn, *a) for a in itertools.islice(todo, 1))
+            yield res
+
+    def close(self) -> None:
+        if self.pool is not None:
+            self.pool.shutdown()
+
+
+class ActionPool:
+    """操作ラベルの文字列プール (ブロック毎のプールを併合する)"""
+
+    def __init__(self):
+        self.labels: list[str] = []
+        self._index: dict[str, int] = {}
+
+    def merge(self, ids: np.ndarray, local: list[str]) -> np.ndarray:
+        """ブロック内番号 ids をこのプールの番号に付け替える (-1 はそのまま)"""
+        remap = []
+        for a in local:
+            i = self._index.get(a)
+            if i is None:
+                i = self._index[a] = len(self.labels)
+                self.labels.append(a)
+            remap.append(i)
+        return np.asarray(remap + [-1], dtype=np.int32)[ids]
+
+
+def _edge_section(runner: _Runner, path: Path, section_start: int, chunk_bytes: int, pool: ActionPool, *,
+                  l2: bool = False) -> tuple[np.ndarray, np.ndarray]:
+    size = path.stat().st_size
+    ranges = [(path, section_start, lo, min(lo + chunk_bytes, size), l2) for lo in range(section_start, size, chunk_bytes)]
+    count("parse.edge_chunks", len(ranges))
+    edges, ids = [np.empty((0, 2), np.int64)], [np.empty(0, np.int32)]
+    for E, a, local in runner.map(_parse_edge_range, ranges):
+        edges.append(E)
+        ids.append(pool.merge(a, local))
+    return np.concatenate(edges), np.concatenate(ids)
+
+
+def default_workers(l1l2_path: Path, chunk_bytes: int = CHUNK_BYTES) -> int:
+    """CPU 数と L1-L2 ファイルのチャンク数の小さい方 (1 チャンクに収まるならプールを作らない)"""
+    chunks = -(-l1l2_path.stat().st_size // chunk_bytes)
+    return max(1, min(os.cpu_count() or 1, chunks))
+
+
+def parse_dbs(l1l2_path: Path, l2_path: Path, *, workers: int | None = None,
+              chunk_bytes: int = CHUNK_BYTES) -> ParsedDB:
+    """L1-L2 / L2 DB を解析する (workers=None で CPU 数とファイルサイズから自動)"""
+    node_labels: dict[int, str] = {}
+    L2code_to_L1num: dict[str, list[int]] = {}
+    L1num_to_L2code: dict[int, str] = {}
+    pool = ActionPool()
+    runner = _Runner(default_workers(l1l2_path, chunk_bytes) if workers is None else max(1, workers))
+    try:
+        with l1l2_path.open("rb") as f:
+            n_nodes = int(f.readline().split()[0])
+            with phase("parse.nodes", file=l1l2_path.name):
+                blocks = ((b,) for b in _node_blocks(f, n_nodes, chunk_bytes))
+                for rows in runner.map(parse_node_block, blocks):
+                    for nid, label, l2_label in rows:
+                        node_labels[nid] = label
+                        L2code_to_L1num.setdefault(l2_label, []).append(nid)
+                        L1num_to_L2code[nid] = l2_label
+            count("parse.nodes", len(node_labels))
+            l1_start = _find_header(f, _L1_EDGES, l1l2_path)
+
+        with phase("parse.l1_edges", file=l1l2_path.name):
+            E, l1_actions = _edge_section(runner, l1l2_path, l1_start, chunk_bytes, pool)
+        count("parse.l1_edges", len(E))
+
+        with phase("parse.l2", file=l2_path.name):
+            L2num_to_code: dict[int, str] = {}
+            with l2_path.open("rb") as f:
+                n_l2 = int(f.readline().split()[0])
+                blocks = ((b,) for b in _node_blocks(f, n_l2, chunk_bytes))
+                for rows in runner.map(parse_l2_node_block, blocks):
+                    L2num_to_code.update(rows)
+                l2_start = _find_header(f, _L2_EDGES, l2_path)
+            l2_pairs, l2_actions = [], []
+            E2, a2 = _edge_section(runner, l2_path, l2_start, chunk_bytes, pool, l2=True)
+            for (a, b), act in zip(E2.tolist(), a2.tolist()):
+                la, lb = L2num_to_code.get(a), L2num_to_code.get(b)
+                if la is None or lb is None:
+                    count("parse.l2_edges_unknown_code")
+                    continue
+                l2_pairs.append((la, lb))
+                l2_actions.append(act)
+        count("parse.l2_edges", len(l2_pairs))
+    finally:
+        runner.close()
+
+    count("parse.actions", len(pool.labels))
+    return ParsedDB(n_nodes, node_labels, L1num_to_L2code, L2code_to_L1num, E, l2_pairs, l1_actions, l2_actions,
+                    pool.labels)
@@ -0,0 +1,244 @@
+from __future__ import annotations
+import argparse, csv, sys, zipfile
+from pathlib import Path
+from typing import Iterable, Iterator, NamedTuple
+import igraph as ig
+import numpy as np
+import Common_Utility as CU
+from graph_csr import COLORS, ETYPE
+from instrument import count, phase
+
+# ---------- エッジ書き出し --------------------------------------------
+#
+# グラフのエッジを列 (source, target, type, weight, action) の配列にまとめ、
+# chunk_rows 行ずつ各形式の書き手へ流す。
+#   npz     : 列毎の .npy (+ action_labels / type_names)。np.load でそのまま読める
+#   csv     : source,target,type,weight,action (action は操作ラベル文字列)
+#   parquet / arrow : pyarrow がある場合のみ。action は辞書型列
+#   text    : 従来の write_edge_lists と同じ色別一覧 (20 組 / 行)
+# source → target は小さい番号 → 大きい番号で、DB にその向きの行が無く逆向きの行だけが
+# ある場合は逆向きで書く (action はその向きの操作)。暗黙 L2 層のグラフでは赤・青エッジを
+# 展開して書き出す。
+
+CHUNK_ROWS = 1 << 18
+FORMATS = {".npz": "npz", ".csv": "csv", ".parquet": "parquet", ".arrow": "arrow", ".feather": "arrow",
+           ".txt": "text"}
+
+
+class EdgeColumns(NamedTuple):
+    """エッジ表 (1 行 = 1 無向エッジ)"""
+    source: np.ndarray   # int64
+    target: np.ndarray   # int64
+    etype: np.ndarray    # uint8, graph_csr.COLORS の添字
+    weight: np.ndarray   # float32
+    action: np.ndarray   # int32, actions の添字 (-1 = 無し)
+    actions: list[str]   # 操作ラベルの文字列プール
+
+    @property
+    def rows(self) -> int:
+        return len(self.source)
+
+    def chunks(self, chunk_rows: int = CHUNK_ROWS) -> Iterator[EdgeColumns]:
+        for lo in range(0, self.rows, chunk_rows):
+            sl = slice(lo, lo + chunk_rows)
+            yield EdgeColumns(self.source[sl], self.target[sl], self.etype[sl], self.weight[sl], self.action[sl],
+                              self.actions)
+
+
+def _type_codes(colors) -> np.ndarray:
+    col = np.asarray(colors, dtype=str)
+    etype = np.full(len(col), 255, dtype=np.uint8)
+    for c, i in ETYPE.items():
+        etype[col == c] = i
+    return etype
+
+
+def _columns(u, v, etype, action, actions: list[str], weights: CU.Weights | None,
+             action_back=None) -> EdgeColumns:
+    """(u, v) は u < v。action_back (v → u の操作) は action が無い行の向きと操作に使う"""
+    weights = weights or CU.DEFAULT_WEIGHTS
+    wt = np.asarray([weights.of(c) for c in COLORS], dtype=np.float32)
+    u, v, action = np.asarray(u, np.int64), np.asarray(v, np.int64), np.asarray(action, np.int32)
+    if action_back is not None:
+        flip = (action < 0) & (np.asarray(action_back) >= 0)
+        u, v, action = np.where(flip, v, u), np.where(flip, u, v), np.where(flip, action_back, action).astype(np.int32)
+    return EdgeColumns(u, v, etype, wt[etype], action, actions)
+
+
+def columns_from_edges(edges: Iterable[tuple[int, int, str]], weights: CU.Weights | None = None) -> EdgeColumns:
+    """(u, v, color) の並びからエッジ表を作る (操作ラベル無し、黒/赤/青以外は除く)"""
+    E = list(edges)
+    etype = _type_codes([c for _, _, c in E])
+    keep = etype != 255
+    uv = np.asarray([(u, v) for u, v, _ in E], dtype=np.int64).reshape(-1, 2)[keep]
+    return _columns(uv[:, 0], uv[:, 1], etype[keep], np.full(int(keep.sum()), -1), [], weights)
+
+
+def edge_columns(G: ig.Graph, weights: CU.Weights | None = None) -> EdgeColumns:
+    """グラフ G のエッジ表。weight は weights (既定プロファイル) をエッジ種別毎に適用した値"""
+    m = G.ecount()
+    attrs = G.es.attributes()
+    E = np.asarray(G.get_edgelist(), dtype=np.int64).reshape(-1, 2)
+    etype = _type_codes(G.es["color"] if m else [])
+    action, back = (np.asarray([-1 if a is None else a for a in G.es[name]] if name in attrs and m else [-1] * m,
+                               dtype=np.int32) for name in ("action", "action_back"))
+    u, v = E[:, 0], E[:, 1]
+    actions = list(G["actions"]) if "actions" in G.attributes() else []
+    if not CU.is_implicit(G):
+        return _columns(u, v, etype, action, actions, weights, back)
+
+    # 暗黙 L2 層: 構築時と同じ順序・操作番号で赤 (L2 エッジの直積)・青 (同一クラス) を展開
+    n = G.vcount()
+    members = {c: np.asarray(m, dtype=np.int64) for c, m in G["L2code_to_L1num"].items()}
+    if "l2_pairs" in G.attributes():
+        pairs, pair_action = G["l2_pairs"], np.asarray(G["l2_actions"], dtype=np.int32)
+    else:
+        pairs = [(a, b) for a, adj in G["L2_adj"].items() for b in adj if a <= b]
+        pair_action = np.full(len(pairs), -1, dtype=np.int32)
+    seen = CU._pair_keys(E[:, 0], E[:, 1], n)
+    ru, rv, rp = CU._red_edge_arrays(pairs, members, pair_index=True)
+    keep, keys = CU._unique_index(ru, rv, n, seen)
+    r_act, r_back = CU._directed_actions(keys, ru <= rv, pair_action[rp], keep)
+    ru, rv = np.minimum(ru[keep], rv[keep]), np.maximum(ru[keep], rv[keep])
+    lu, lv, _ = CU._unique_edges(*CU._blue_edge_arrays(members, None), n, np.concatenate((seen, keys[keep])))
+    none = np.full(len(lu), -1, np.int32)
+    return _columns(np.concatenate((u, ru, lu)), np.concatenate((v, rv, lv)),
+                    np.concatenate((etype, np.full(len(ru), ETYPE["red"], np.uint8),
+                                    np.full(len(lu), ETYPE["blue"], np.uint8))),
+                    np.concatenate((action, r_act, none)), actions, weights, np.concatenate((back, r_back, none)))
+
+
+# ---------- 形式毎の書き手 --------------------------------------------
+
+def write_npz(path: Path, cols: EdgeColumns, chunk_rows: int = CHUNK_ROWS) -> None:
+    """列毎の .npy を zip に逐次書き込む (np.savez と同じ構成)"""
+    arrays = {"source": cols.source, "target": cols.target, "type": cols.etype, "weight": cols.weight,
+              "action": cols.action}
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_STORED, allowZip64=True) as zf:
+        for name, arr in arrays.items():
+            with zf.open(f"{name}.npy", "w", force_zip64=True) as f:
+                np.lib.format.write_array_header_1_0(
+                    f, {"descr": np.lib.format.dtype_to_descr(arr.dtype), "fortran_order": False, "shape": (len(arr),)})
+                for lo in range(0, len(arr), chunk_rows):
+                    f.write(np.ascontiguousarray(arr[lo:lo + chunk_rows]).tobytes())
+        for name, arr in (("action_labels", np.asarray(cols.actions, dtype=str)), ("type_names", np.asarray(COLORS))):
+            with zf.open(f"{name}.npy", "w") as f:
+                np.lib.format.write_array(f, arr, allow_pickle=False)
+
+
+def write_csv(path: Path, cols: EdgeColumns, chunk_rows: int = CHUNK_ROWS) -> None:
+    labels = cols.actions + [""]     # -1 → ""
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        w = csv.writer(f)
+        w.writerow(["source", "target", "type", "weight", "action"])
+        for ch in cols.chunks(chunk_rows):
+            w.writerows(zip(ch.source.tolist(), ch.target.tolist(), ch.etype.tolist(), ch.weight.tolist(),
+                            [labels[a] for a in ch.action.tolist()]))
+
+
+def _arrow_batches(cols: EdgeColumns, chunk_rows: int):
+    try:
+        import pyarrow as pa
+    except ImportError:
+        raise RuntimeError("Parquet / Arrow export needs pyarrow (pip install pyarrow)") from None
+    labels = pa.array(cols.actions, type=pa.string())
+    schema = pa.schema([("source", pa.int64()), ("target", pa.int64()), ("type", pa.uint8()),
+                        ("weight", pa.float32()), ("action", pa.dictionary(pa.int32(), pa.string()))])
+
+    def batches():
+        for ch in cols.chunks(chunk_rows):
+            action = pa.DictionaryArray.from_arrays(pa.array(ch.action, mask=ch.action < 0), labels)
+            yield pa.table([pa.array(ch.source), pa.array(ch.target), pa.array(ch.etype), pa.array(ch.weight), action],
+                           schema=schema)
+
+    return pa, schema, batches()
+
+
+def write_parquet(path: Path, cols: EdgeColumns, chunk_rows: int = CHUNK_ROWS) -> None:
+    pa, schema, batches = _arrow_batches(cols, chunk_rows)
+    import pyarrow.parquet as pq
+    with pq.ParquetWriter(str(path), schema) as w:
+        for table in batches:
+            w.write_table(table)
+
+
+def write_arrow(path: Path, cols: EdgeColumns, chunk_rows: int = CHUNK_ROWS) -> None:
+    pa, schema, batches = _arrow_batches(cols, chunk_rows)
+    with pa.OSFile(str(path), "wb") as sink, pa.ipc.new_file(sink, schema) as w:
+        for table in batches:
+            w.write_table(table)
+
+
+_TEXT_SECTIONS = (("black", "Black Edges (L1 edges)"), ("red", "Red Edges (L2 relationship edges)"),
+                  ("blue", "Blue Edges (Same L2 code, dotted)"))
+
+
+def write_text(path: Path, cols: EdgeColumns, chunk_rows: int = CHUNK_ROWS, per_line: int = 20) -> None:
+    """色別の人間向け一覧 ("u-v | u-v | …" を per_line 組ずつ、u < v)"""
+    with open(path, "w", encoding="utf-8") as f:
+        for color, title in _TEXT_SECTIONS:
+            code = ETYPE[color]
+            f.write(f"### {title} - {int((cols.etype == code).sum())} edges\n")
+            buf: list[str] = []
+            first = True
+            for ch in cols.chunks(chunk_rows):
+                sel = ch.etype == code
+                lo, hi = np.minimum(ch.source[sel], ch.target[sel]), np.maximum(ch.source[sel], ch.target[sel])
+                buf += [f"{a}-{b}" for a, b in zip(lo.tolist(), hi.tolist())]
+                while len(buf) >= per_line:
+                    f.write(("" if first else "\n") + " | ".join(buf[:per_line]))
+                    first, buf = False, buf[per_line:]
+            if buf:
+                f.write(("" if first else "\n") + " | ".join(buf))
+            f.write("\n\n\n")
+
+
+WRITERS = {"npz": write_npz, "csv": write_csv, "parquet": write_parquet, "arrow": write_arrow, "text": write_text}
+
+
+def export_edges(G: ig.Graph, path: Path, fmt: str | None = None, *, weights: CU.Weights | None = None,
+                 chunk_rows: int = CHUNK_ROWS) -> int:
+    """G のエッジ表を path に書き出し、行数を返す (fmt 省略時は拡張子から決める)"""
+    path = Path(path)
+    fmt = fmt or FORMATS.get(path.suffix.lower())
+    if fmt not in WRITERS:
+        raise ValueError(f"cannot infer export format from {path.name!r}; use one of {', '.join(WRITERS)}")
+    with phase("export.columns"):
+        cols = edge_columns(G, weights)
+    with phase("export.write", format=fmt, rows=cols.rows):
+        WRITERS[fmt](path, cols, chunk_rows)
+    count("export.rows", cols.rows)
+    return cols.rows
+
+
+# ---------- CLI -------------------------------------------------------
+def cli() -> argparse.Namespace:
+    p = argparse.ArgumentParser(description="Export graph edges (source, target, type, weight, action) in columnar formats.")
+    p.add_argument("--l1l2", default="1020000_L1-L2_DB.txt", help="L1-L2 DB file path")
+    p.add_argument("--l2",   default="1020000_L2_DB.txt",    help="L2 DB file path")
+    p.add_argument("-o", "--out", required=True, help="Output file (.npz / .csv / .parquet / .arrow / .txt)")
+    p.add_argument("--format", choices=tuple(WRITERS), default=None, help="Output format (default: from --out suffix)")
+    p.add_argument("--weights", default=None, metavar="SPEC", help="Weight profile for the weight column (see shortest_path_.py --weights)")
+    p.add_argument("--implicit-l2", action="store_true", help="Build with implicit red/blue L2 edges (expanded on export)")
+    p.add_argument("--chunk-rows", type=int, default=CHUNK_ROWS, help="Rows per write chunk")
+    p.add_argument("--parse-workers", type=int, default=None, help="DB parser worker processes (default: auto)")
+    return p.parse_args()
+
+
+def main():
+    args = cli()
+    try:
+        weights = CU.parse_weights(args.weights)
+    except ValueError as exc:
+        sys.exit(f"[!] {exc}")
+    G, _, _ = CU.build_graph(Path(args.l1l2), Path(args.l2), implicit_l2=args.implicit_l2,
+                             parse_workers=args.parse_workers)
+    try:
+        n = export_edges(G, Path(args.out), args.format, weights=weights, chunk_rows=args.chunk_rows)
+    except (RuntimeError, ValueError) as exc:
+        sys.exit(f"[!] {exc}")
+    print(f"[✓] {n} edges written → {args.out}")
+
+
+if __name__ == "__main__":
+    main()
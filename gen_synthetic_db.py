@@ -0,0 +1,149 @@
+from __future__ import annotations
+import argparse, hashlib
+from pathlib import Path
+import numpy as np
+
+# ---------- 合成 DB 生成 ----------------------------------------------
+#
+# build_graph が読む形式そのままの <prefix>_L1-L2_DB.txt / <prefix>_L2_DB.txt を
+# 書き出す。ノード数・L2 クラスサイズ分布・平均次数を指定でき、L1 エッジは
+# ランダム全域木 (連結性の保証) + 同一 / 隣接 L2 クラス寄りのランダム辺で作る。
+
+SLOTS = 12   # B000 × 8 + L001 × 2 + L002 × 2
+
+
+def _slots(digits: np.ndarray, fmt) -> list[str]:
+    """各行の 12 スロットを B000/L001/L002 の 3 区画に並べた文字列"""
+    out = []
+    for row in digits.tolist():
+        s = [fmt(d) for d in row]
+        out.append(f"B000:{''.join(s[:8])} | L001:{''.join(s[8:10])} | L002:{''.join(s[10:])}")
+    return out
+
+
+def l2_codes(n_classes: int) -> list[str]:
+    """クラス番号を 4 進 12 桁に割り当てた一意な L2 コード"""
+    digits = (np.arange(n_classes)[:, None] // 4 ** np.arange(SLOTS)) % 4
+    return _slots(digits, lambda d: "[---]" if d == 0 else f"[{d - 1:03d}]")
+
+
+def l1_codes(n: int, rng: np.random.Generator) -> list[str]:
+    vals = rng.integers(0, 4, size=(n, SLOTS))
+    frac = rng.integers(0, 10, size=(n, SLOTS))
+    return _slots(vals * 10 + frac, lambda d: "[---.-]" if d < 10 else f"[{d // 10 - 1:03d}.{d % 10}]")
+
+
+def class_assignment(n: int, n_classes: int, dist: str, rng: np.random.Generator, *, zipf_a: float = 1.2) -> np.ndarray:
+    """各ノードの L2 クラス番号 (全クラス非空)"""
+    if dist == "uniform":
+        w = np.ones(n_classes)
+    elif dist == "zipf":
+        w = 1.0 / np.arange(1, n_classes + 1) ** zipf_a
+    else:   # lognormal
+        w = rng.lognormal(0.0, 1.0, n_classes)
+    # 1 クラス 1 ノードを先に確保し、残りを重みに従って配る
+    extra = rng.choice(n_classes, size=n - n_classes, p=w / w.sum())
+    cls = np.concatenate((np.arange(n_classes), extra))
+    rng.shuffle(cls)
+    return cls
+
+
+def _actions(m: int, rng: np.random.Generator) -> list[str]:
+    kind = np.where(rng.random(m) < 0.5, "Assemble", "Disassemble")
+    p = rng.integers(0, 8, size=(m, 4)).tolist()
+    return [f"{k} Port({a}, {b}) : Port({c}, {d})" for k, (a, b, c, d) in zip(kind.tolist(), p)]
+
+
+def l2_edges(n_classes: int, degree: float, rng: np.random.Generator) -> np.ndarray:
+    """L2 隣接: 環 + ランダム辺 (平均次数 degree)"""
+    ring = np.stack((np.arange(n_classes), (np.arange(n_classes) + 1) % n_classes), axis=1)[:max(n_classes - 1, 0)]
+    extra = rng.integers(0, n_classes, size=(max(int(n_classes * degree / 2) - len(ring), 0), 2))
+    E = np.concatenate((ring, extra))
+    E = E[E[:, 0] != E[:, 1]]
+    return np.unique(np.sort(E, axis=1), axis=0)
+
+
+def l1_edges(cls: np.ndarray, l2e: np.ndarray, degree: float, local: float, rng: np.random.Generator) -> np.ndarray:
+    """L1 エッジ: ランダム全域木 + 同一/隣接クラス寄りの辺 (平均次数 degree)"""
+    n = len(cls)
+    perm = rng.permutation(n)
+    tree = np.stack((perm[1:], perm[(rng.random(n - 1) * np.arange(1, n)).astype(np.int64)]), axis=1)
+
+    m = max(int(n * degree / 2) - len(tree), 0)
+    u = rng.integers(0, n, size=m)
+    # 相手: local の確率で「同じクラス or L2 隣接クラスの 1 つ (半々)」の中から、残りは全体から一様
+    order = np.argsort(cls, kind="stable")
+    start = np.searchsorted(cls[order], np.arange(cls.max() + 2))
+    a, b = np.concatenate((l2e[:, 0], l2e[:, 1])), np.concatenate((l2e[:, 1], l2e[:, 0]))
+    nbr = b[np.argsort(a, kind="stable")]
+    nptr = np.searchsorted(np.sort(a), np.arange(cls.max() + 2))
+    tc = cls[u]
+    deg = nptr[tc + 1] - nptr[tc]
+    hop = (rng.random(m) < 0.5) & (deg > 0)
+    tc[hop] = nbr[nptr[tc[hop]] + (rng.random(int(hop.sum())) * deg[hop]).astype(np.int64)]
+    size = start[tc + 1] - start[tc]
+    v_local = order[start[tc] + (rng.random(m) * size).astype(np.int64)]
+    v = np.where(rng.random(m) < local, v_local, rng.integers(0, n, size=m))
+
+    E = np.concatenate((tree, np.stack((u, v), axis=1)))
+    E = E[E[:, 0] != E[:, 1]]
+    return np.unique(np.sort(E, axis=1), axis=0)
+
+
+def write_db(out_dir: Path, prefix: str, n: int, *, class_size: float = 8.0, dist: str = "lognormal",
+             degree: float = 6.0, l2_degree: float = 3.0, local: float = 0.9, zipf_a: float = 1.2,
+             seed: int = 0) -> tuple[Path, Path]:
+    rng = np.random.default_rng(seed)
+    n_classes = max(1, min(n, round(n / class_size)))
+    cls = class_assignment(n, n_classes, dist, rng, zipf_a=zipf_a)
+    codes = l2_codes(n_classes)
+    l2e = l2_edges(n_classes, l2_degree, rng)
+    E = l1_edges(cls, l2e, degree, local, rng)
+
+    out_dir.mkdir(parents=True, exist_ok=True)
+    l1l2_path = out_dir / f"{prefix}_L1-L2_DB.txt"
+    l2_path = out_dir / f"{prefix}_L2_DB.txt"
+    l1 = l1_codes(n, rng)
+    with l1l2_path.open("w", encoding="utf-8") as f:
+        f.write(f"{n} # number of nodes\n")
+        f.writelines(f"{i}\tL1 | {l1[i]}\tL2 | {codes[c]} #\n" for i, c in enumerate(cls.tolist()))
+        f.write(f"{len(E)} # number of L1 edges\n")
+        f.writelines(f"{a}\t{b}\t{act}\n" for (a, b), act in zip(E.tolist(), _actions(len(E), rng)))
+
+    with l2_path.open("w", encoding="utf-8") as f:
+        f.write(f"{n_classes} # number of nodes\n")
+        for i, code in enumerate(codes):
+            h = hashlib.sha1(code.encode("utf-8")).hexdigest().upper()
+            f.write(f"{i}\t{h}\tencode_ver: 2.0, encode_level: 2 L2 | {code}\tConnected 0,0|Not connected 0,1|\n")
+        f.write(f"{len(l2e)} # number of L2 edges\n")
+        f.writelines(f"{i}\t{a}\t{b}\t{act}\n" for i, ((a, b), act) in enumerate(zip(l2e.tolist(), _actions(len(l2e), rng))))
+    return l1l2_path, l2_path
+
+
+# ---------- CLI -------------------------------------------------------
+def cli() -> argparse.Namespace:
+    p = argparse.ArgumentParser(description="Generate synthetic L1-L2 / L2 DB files.")
+    p.add_argument("-n", "--nodes", type=int, required=True, help="Number of L1 nodes (10^3 .. 10^6)")
+    p.add_argument("-o", "--out-dir", default=".", help="Output directory")
+    p.add_argument("--prefix", default=None, help="Numeric file prefix (default: 9 followed by the node count)")
+    p.add_argument("--class-size", type=float, default=8.0, help="Mean L2 class size")
+    p.add_argument("--class-dist", choices=("uniform", "zipf", "lognormal"), default="lognormal", help="L2 class size distribution")
+    p.add_argument("--zipf-a", type=float, default=1.2, help="Exponent for --class-dist zipf")
+    p.add_argument("--degree", type=float, default=6.0, help="Mean L1 degree")
+    p.add_argument("--l2-degree", type=float, default=3.0, help="Mean L2 adjacency degree")
+    p.add_argument("--local", type=float, default=0.9, help="Share of L1 edges within the same or an adjacent L2 class")
+    p.add_argument("--seed", type=int, default=0)
+    return p.parse_args()
+
+
+def main():
+    args = cli()
+    prefix = args.prefix or f"9{args.nodes}"
+    l1l2_path, l2_path = write_db(Path(args.out_dir), prefix, args.nodes, class_size=args.class_size,
+                                  dist=args.class_dist, degree=args.degree, l2_degree=args.l2_degree,
+                                  local=args.local, zipf_a=args.zipf_a, seed=args.seed)
+    print(f"[✓] Wrote {l1l2_path} and {l2_path}")
+
+
+if __name__ == "__main__":
+    main()
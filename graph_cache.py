@@ -0,0 +1,372 @@
+from __future__ import annotations
+import contextlib, hashlib, json, os, pickle, struct, threading, time
+from collections.abc import Mapping
+from pathlib import Path
+from typing import Iterator
+import numpy as np
+import igraph as ig
+import Common_Utility as CU
+from graph_csr import ARRAY_DTYPES, CSRGraph
+from instrument import phase
+
+# ---------- バージョン付き mmap グラフキャッシュ ----------------------
+#
+# レイアウト:  MAGIC(8) | format_version(u32) | header_len(u32) | header(JSON)
+#              | pad | 配列群 (各 64 byte 境界)
+# ヘッダには配列のオフセット/dtype/shape、元 DB ファイルのハッシュ、重み定数、
+# レイヤ毎のエッジ内容ハッシュ (派生データの無効化用) を記録する。配列は numpy.memmap でコピーせずに開く。ラベルと
+# エッジの操作ラベルは文字列プール (UTF-8 連結 + オフセット) に intern して整数 ID で参照する。
+#
+# 経路探索と描画は GraphCache.csr (mmap 上の配列を指す CSRGraph) に対して直接行い、触れた行の
+# ページだけが読み込まれる。igraph への全体コピー (graph()) はエッジ書き出しなど igraph 前提の処理に限る。
+#
+# 書き出しは隣の一時ファイルへ行って rename で置き換えるので、読み手 (mmap 中のものも) が
+# 書きかけのファイルを見ることはない。ヘッダには配列部の長さと sha1 も記録し、読込時に長さを、
+# verify=True なら内容も確かめる。構築は <cache>.lock の advisory lock で 1 プロセスに限り、
+# 同時に起動した他のプロセスはその完成を待って同じキャッシュを使う。
+
+MAGIC = b"SPGCACHE"
+FORMAT_VERSION = 3
+_ALIGN = 64
+_PREFIX = struct.Struct("<8sII")
+
+
+def _aligned(n: int) -> int:
+    return -(-n // _ALIGN) * _ALIGN
+
+
+def file_digest(path: Path) -> str:
+    h = hashlib.sha1()
+    with path.open("rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _source_entry(path: Path, prev: dict | None = None) -> dict:
+    """ファイルの (名前, サイズ, mtime, sha1)。stat が前回と同じならハッシュを再利用"""
+    st = path.stat()
+    entry = {"name": path.name, "size": st.st_size, "mtime_ns": st.st_mtime_ns}
+    if prev and all(prev.get(key) == entry[key] for key in ("size", "mtime_ns")):
+        entry["sha1"] = prev["sha1"]
+    else:
+        entry["sha1"] = file_digest(path)
+    return entry
+
+
+def fingerprint(l1l2_path: Path, l2_path: Path, *, implicit_l2: bool = False, prev: dict | None = None) -> dict:
+    """キャッシュの妥当性を決める入力一式"""
+    prev = prev or {}
+    return {
+        "l1l2": _source_entry(l1l2_path, prev.get("l1l2")),
+        "l2": _source_entry(l2_path, prev.get("l2")),
+        "weights": {"black": CU.W_BLACK, "red": CU.W_RED, "blue": CU.W_BLUE},
+        "implicit_l2": implicit_l2,
+    }
+
+
+def same_inputs(a: dict, b: dict, *, check_mode: bool = True) -> bool:
+    return (a["l1l2"]["sha1"] == b["l1l2"]["sha1"] and a["l2"]["sha1"] == b["l2"]["sha1"]
+            and a["weights"] == b["weights"] and (not check_mode or a["implicit_l2"] == b["implicit_l2"]))
+
+
+# ---------- 文字列プール ------------------------------------------------
+
+def intern_strings(strings: list[str]) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """重複を除いた文字列プール (blob, offsets) と各要素の ID 配列"""
+    pool: dict[str, int] = {}
+    ids = np.fromiter((pool.setdefault(s, len(pool)) for s in strings), dtype=np.int32, count=len(strings))
+    encoded = [s.encode("utf-8") for s in pool]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(b) for b in encoded], out=offsets[1:])
+    blob = np.frombuffer(b"".join(encoded), dtype=np.uint8)
+    return blob, offsets, ids
+
+
+class StringTable:
+    def __init__(self, blob: np.ndarray, offsets: np.ndarray):
+        self.blob = blob
+        self.offsets = offsets
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i: int) -> str:
+        return bytes(self.blob[self.offsets[i]:self.offsets[i + 1]]).decode("utf-8")
+
+
+class LabelTable(Mapping):
+    """ノード番号 → 描画ラベル ("# id\\nL1\\nL2") を必要時に組み立てる dict 互換表"""
+
+    def __init__(self, strings: StringTable, l1_ids: np.ndarray, l2_class: np.ndarray, codes: list[str]):
+        self.strings = strings
+        self.l1_ids = l1_ids
+        self.l2_class = l2_class
+        self.codes = codes
+
+    def __getitem__(self, nid: int) -> str:
+        if not 0 <= nid < len(self.l1_ids) or self.l1_ids[nid] < 0:
+            raise KeyError(nid)
+        return f"# {nid}\n{self.strings[int(self.l1_ids[nid])]}\n{self.codes[int(self.l2_class[nid])]}"
+
+    def __iter__(self) -> Iterator[int]:
+        return iter(np.flatnonzero(np.asarray(self.l1_ids) >= 0).tolist())
+
+    def __len__(self) -> int:
+        return int((np.asarray(self.l1_ids) >= 0).sum())
+
+
+# ---------- 読み書き ----------------------------------------------------
+
+@contextlib.contextmanager
+def atomic_path(path: Path) -> Iterator[Path]:
+    """path の隣の一時ファイルに書かせ、成功したら path へ rename する (失敗時は一時ファイルを消す)"""
+    tmp = path.with_name(f"{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    try:
+        yield tmp
+        os.replace(tmp, path)
+    finally:
+        tmp.unlink(missing_ok=True)
+
+
+@contextlib.contextmanager
+def cache_lock(path: Path, log=None) -> Iterator[None]:
+    """path の構築を 1 プロセスに限る advisory lock (<path>.lock)。fcntl の無い環境では何もしない"""
+    try:
+        import fcntl
+    except ImportError:
+        yield
+        return
+    with path.with_name(f"{path.name}.lock").open("a") as f:
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            print(f"[i] Waiting for another process building {path.name}…", file=log)
+            t0 = time.perf_counter()
+            fcntl.flock(f, fcntl.LOCK_EX)
+            print(f"[i] Lock on {path.name} acquired after {time.perf_counter() - t0:.1f}s", file=log)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def write_arrays(path: Path, arrays: dict[str, np.ndarray], meta: dict) -> None:
+    """meta と arrays を 1 ファイルに書き出す (一時ファイル経由で置き換え)"""
+    layout, offset = {}, 0
+    h = hashlib.sha1()
+    for name, a in arrays.items():
+        layout[name] = {"offset": offset, "dtype": a.dtype.str, "shape": list(a.shape)}
+        offset = _aligned(offset + a.nbytes)
+        h.update(np.ascontiguousarray(a).data)
+    header = json.dumps({**meta, "format_version": FORMAT_VERSION, "arrays": layout, "data_size": offset,
+                         "data_sha1": h.hexdigest()}).encode("utf-8")
+    data_start = _aligned(_PREFIX.size + len(header))
+    with atomic_path(path) as tmp, tmp.open("wb") as f:
+        f.write(_PREFIX.pack(MAGIC, FORMAT_VERSION, len(header)))
+        f.write(header)
+        for name, a in arrays.items():
+            f.seek(data_start + layout[name]["offset"])
+            f.write(np.ascontiguousarray(a).tobytes())
+        f.truncate(data_start + offset)
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def read_header(path: Path) -> tuple[dict, int] | None:
+    """(header, data_start)。形式/バージョン違い・途中で切れたファイルは None"""
+    try:
+        with path.open("rb") as f:
+            magic, version, n = _PREFIX.unpack(f.read(_PREFIX.size))
+            if magic != MAGIC or version != FORMAT_VERSION:
+                return None
+            header = json.loads(f.read(n))
+            data_start = _aligned(_PREFIX.size + n)
+            # data_size の無いファイルは長さを記録する前に書かれたもの
+            if os.fstat(f.fileno()).st_size < data_start + header.get("data_size", 0):
+                return None
+    except (OSError, struct.error, ValueError):
+        return None
+    return header, data_start
+
+
+def verify_arrays(header: dict, arrays: dict[str, np.ndarray]) -> bool:
+    """配列部の sha1 がヘッダの記録と一致するか (記録の無い古いファイルは True)"""
+    if "data_sha1" not in header:
+        return True
+    h = hashlib.sha1()
+    for a in arrays.values():
+        h.update(np.ascontiguousarray(a).data)
+    return h.hexdigest() == header["data_sha1"]
+
+
+def open_arrays(path: Path, header: dict, data_start: int) -> dict[str, np.ndarray]:
+    """ファイル全体を 1 度だけ mmap し、各配列をそのビューとして返す"""
+    raw = np.memmap(path, dtype=np.uint8, mode="r")
+    out = {}
+    for name, spec in header["arrays"].items():
+        dtype = np.dtype(spec["dtype"])
+        shape = tuple(spec["shape"])
+        start = data_start + spec["offset"]
+        nbytes = int(np.prod(shape, dtype=np.int64)) * dtype.itemsize
+        out[name] = raw[start:start + nbytes].view(dtype).reshape(shape)
+    return out
+
+
+class GraphCache:
+    """mmap で開いたキャッシュ。探索・描画は csr (CSRGraph) をそのまま使い、igraph 版は graph() で作る"""
+
+    def __init__(self, path: Path, header: dict, arrays: dict[str, np.ndarray]):
+        self.path = path
+        self.header = header
+        self.arrays = arrays
+        strings = StringTable(arrays["str_blob"], arrays["str_offsets"])
+        self.codes = [strings[int(i)] for i in arrays["code_str"]]
+        self.actions = [strings[int(i)] for i in arrays["action_str"]]
+        self.csr = CSRGraph(header["n"], self.codes, header["fingerprint"]["implicit_l2"], self.actions,
+                            **{name: arrays[name] for name in ARRAY_DTYPES})
+        self.labels = LabelTable(strings, arrays["l1_label"], arrays["l2_class"], self.codes)
+        self._L1num_to_L2code: dict[int, str] | None = None
+        self.rebuilt = False
+
+    @property
+    def L1num_to_L2code(self) -> dict[int, str]:
+        if self._L1num_to_L2code is None:
+            self._L1num_to_L2code = self.csr.L1num_to_L2code()
+        return self._L1num_to_L2code
+
+    def graph(self) -> ig.Graph:
+        """igraph グラフ (エッジ書き出しなど igraph 前提の処理用)。mmap 上の配列から毎回全体を組み立てる"""
+        with phase("cache.to_igraph"):
+            return self.csr.to_igraph()
+
+
+def save_graph_cache(path: Path, csr: CSRGraph, node_labels: dict[int, str], L1num_to_L2code: dict[int, str],
+                     fp: dict) -> None:
+    with phase("cache.write", file=path.name):
+        _save_graph_cache(path, csr, node_labels, L1num_to_L2code, fp)
+
+
+def _save_graph_cache(path: Path, csr: CSRGraph, node_labels: dict[int, str], L1num_to_L2code: dict[int, str],
+                      fp: dict) -> None:
+    # ラベル "# id\nL1\nL2" から L1 部分だけを取り出して intern する
+    l1_parts, l1_nodes = [], []
+    for nid, label in node_labels.items():
+        head = f"# {nid}\n"
+        tail = f"\n{L1num_to_L2code[nid]}"
+        l1_parts.append(label[len(head):len(label) - len(tail)])
+        l1_nodes.append(nid)
+    blob, offsets, ids = intern_strings(csr.codes + l1_parts + csr.actions)
+    n_codes, n_labels = len(csr.codes), len(l1_parts)
+    l1_label = np.full(csr.n, -1, dtype=np.int32)
+    l1_label[np.asarray(l1_nodes, dtype=np.int64)] = ids[n_codes:n_codes + n_labels]
+
+    arrays = {**csr.arrays(), "str_blob": blob, "str_offsets": offsets, "code_str": ids[:n_codes],
+              "l1_label": l1_label, "action_str": ids[n_codes + n_labels:]}
+    write_arrays(path, arrays, {"n": csr.n, "fingerprint": fp, "layer_hash": csr.layer_hashes()})
+
+
+def load_graph_cache(path: Path, *, verify: bool = False) -> GraphCache | None:
+    """キャッシュを開く。読めない/途中で切れている (verify=True では内容が壊れている) 場合は None"""
+    with phase("cache.load", file=path.name):
+        head = read_header(path)
+        if head is None:
+            return None
+        header, data_start = head
+        arrays = open_arrays(path, header, data_start)
+        if verify and not verify_arrays(header, arrays):
+            return None
+        return GraphCache(path, header, arrays)
+
+
+def _open_current(l1l2_path: Path, l2_path: Path, cache_path: Path, implicit_l2: bool | None,
+                  verify: bool) -> tuple[GraphCache | None, dict, str | None]:
+    """(入力と一致するキャッシュ, 入力の fingerprint, 使えない理由)"""
+    if not cache_path.exists():
+        head, reason = None, "missing"
+    else:
+        head = read_header(cache_path)
+        reason = None if head else "unreadable"
+    prev = head[0]["fingerprint"] if head else None
+    check_mode = implicit_l2 is not None
+    if implicit_l2 is None:
+        implicit_l2 = prev["implicit_l2"] if prev else False
+    fp = fingerprint(l1l2_path, l2_path, implicit_l2=implicit_l2, prev=prev)
+    if prev is None:
+        return None, fp, reason
+    if not same_inputs(prev, fp, check_mode=check_mode):
+        return None, fp, "stale"
+    cache = load_graph_cache(cache_path, verify=verify)
+    return cache, fp, None if cache else "corrupt"
+
+
+def load_or_build(l1l2_path: Path, l2_path: Path, cache_path: Path, *, implicit_l2: bool | None = None,
+                  force: bool = False, verify: bool = False, parse_workers: int | None = None,
+                  log=None) -> GraphCache:
+    """有効なキャッシュがあれば開き、無い/古い/壊れている場合は構築し直して保存する
+
+    implicit_l2=None はキャッシュ側のモードをそのまま受け入れる (新規構築時は明示展開)。
+    構築は cache_lock の下で行い、ロック待ちの間に他のプロセスが作り終えていればそれを開く。
+    verify=True では配列部の sha1 も確かめる。
+    """
+    if not force:
+        cache, _, _ = _open_current(l1l2_path, l2_path, cache_path, implicit_l2, verify)
+        if cache is not None:
+            return cache
+    with cache_lock(cache_path, log):
+        cache, fp, reason = _open_current(l1l2_path, l2_path, cache_path, implicit_l2, verify)
+        if cache is not None and not force:
+            return cache
+        print(f"[i] Cache {cache_path.name} {'forced' if force else reason}. Building…", file=log)
+        G, node_labels, L1num_to_L2code = CU.build_graph(l1l2_path, l2_path, implicit_l2=fp["implicit_l2"],
+                                                         parse_workers=parse_workers)
+        with phase("cache.to_csr"):
+            csr = CSRGraph.from_igraph(G, L1num_to_L2code)
+        save_graph_cache(cache_path, csr, node_labels, L1num_to_L2code, fp)
+    print(f"[+] Graph cached to {cache_path.name}", file=log)
+    cache = load_graph_cache(cache_path)
+    cache.rebuilt = True
+    return cache
+
+
+# ---------- 旧 Pickle 形式 ---------------------------------------------
+
+def _load_pickle(path: Path) -> tuple | None:
+    """(G, node_labels, L1num_to_L2code)。読めなければ None、igraph 以外の旧形式は ValueError"""
+    try:
+        with phase("cache.load", file=path.name), path.open("rb") as f:
+            data = pickle.load(f)
+    except (OSError, EOFError, pickle.UnpicklingError):
+        return None
+    except (ImportError, AttributeError):   # 今は無いモジュール/クラスを参照する Pickle
+        data = None
+    if not (isinstance(data, tuple) and len(data) == 3 and isinstance(data[0], ig.Graph)):
+        # networkx 時代の Pickle などは黙って上書きせず、作り直しを明示してもらう
+        raise ValueError(f"{path.name} is a legacy cache format (not an igraph graph); "
+                         "rebuild it with build_graph_.py --force or use a .csr cache")
+    return data
+
+
+def load_or_build_pickle(l1l2_path: Path, l2_path: Path, cache_path: Path, *, implicit_l2: bool = False,
+                         force: bool = False, parse_workers: int | None = None, log=None) -> tuple[tuple, bool]:
+    """((G, node_labels, L1num_to_L2code), 構築したか)。無い/読めない *.pkl は同じロックの下で作り直す
+
+    Pickle には入力の記録が無いので、DB が変わっても自動では作り直さない (--force で再構築)。
+    igraph 以外を収めた旧形式の *.pkl は ValueError (force=True なら作り直す)。
+    """
+    data = None if force or not cache_path.exists() else _load_pickle(cache_path)
+    if data is not None:
+        return data, False
+    with cache_lock(cache_path, log):
+        data = None if force else _load_pickle(cache_path)
+        if data is not None:
+            return data, False
+        reason = "forced" if force else "missing" if not cache_path.exists() else "unreadable"
+        print(f"[i] Cache {cache_path.name} {reason}. Building…", file=log)
+        data = CU.build_graph(l1l2_path, l2_path, implicit_l2=implicit_l2, parse_workers=parse_workers)
+        with phase("cache.write", file=cache_path.name), atomic_path(cache_path) as tmp, tmp.open("wb") as f:
+            pickle.dump(data, f)
+            f.flush()
+            os.fsync(f.fileno())
+    print(f"[+] Graph cached to {cache_path.name}", file=log)
+    return data, True
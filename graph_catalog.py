@@ -0,0 +1,233 @@
+from __future__ import annotations
+import argparse, sys, threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import NamedTuple
+import igraph as ig
+from graph_cache import load_or_build, read_header
+from node_index import NodeIndex, default_l1_db, open_index, resolve_plain
+from result_cache import ResultCache
+
+# ---------- グラフカタログ (複数プレフィックスの常駐管理) ----------------
+#
+# ディレクトリ内の <prefix>_L1-L2_DB.txt / <prefix>_L2_DB.txt の組 (ROBOT_DB_L1-L2.txt /
+# ROBOT_DB_L2.txt 形式も可) を見つけ、プレフィックス毎のグラフを必要になった時点で
+# <prefix>_graph.csr キャッシュから読み込む (無い/古ければ構築)。常駐グラフはメモリ予算付きの
+# LRU で持ち、予算を超えたら最も長く使われていないものから手放す。手放したグラフは次に
+# 使われた時に読み直す。読込中の他プレフィックスへの問い合わせは止めない。
+#
+# *.csr から読んだグラフは mmap 上の CSRGraph のまま常駐させ、探索もその配列上で行う。常駐サイズは
+# 配列の大きさ (触れた分だけページが載る上限) + ノード番号 → L2 コード表などの ≈ 200 B/ノード。
+# igraph (旧 Pickle 由来) は実測に基づく見積もり: igraph (属性付き) ≈ 300 B/エッジ、探索用隣接リスト
+# ≈ 280 B/エッジ、ノード番号 → L2 コード表などで ≈ 600 B/ノード。
+
+EDGE_BYTES = 600
+NODE_BYTES = 600
+CSR_NODE_BYTES = 200
+_PATTERNS = (("_L1-L2_DB.txt", "_L2_DB.txt"), ("_L1-L2.txt", "_L2.txt"))
+
+
+class CatalogEntry(NamedTuple):
+    prefix: str
+    l1l2: Path
+    l2: Path
+    cache: Path
+    l1_db: Path | None = None
+
+
+def prefix_of(l1l2_path: Path) -> str | None:
+    """L1-L2 DB のファイル名からプレフィックス ("1020000", "ROBOT_DB") を返す"""
+    for suffix, _ in _PATTERNS:
+        if l1l2_path.name.endswith(suffix) and len(l1l2_path.name) > len(suffix):
+            return l1l2_path.name[:-len(suffix)]
+    return None
+
+
+def discover(root: Path) -> dict[str, CatalogEntry]:
+    """root 直下の DB 組をプレフィックス順に列挙する"""
+    out = {}
+    for l1l2 in sorted(root.glob("*_L1-L2*.txt")):
+        prefix = prefix_of(l1l2)
+        if prefix is None or prefix in out:
+            continue
+        l2_suffix = dict(_PATTERNS)[l1l2.name[len(prefix):]]
+        l2 = root / f"{prefix}{l2_suffix}"
+        if l2.exists():
+            l1l2, l2 = l1l2.absolute(), l2.absolute()
+            out[prefix] = CatalogEntry(prefix, l1l2, l2, l2.parent / f"{prefix}_graph.csr", default_l1_db(l1l2))
+    return out
+
+
+def graph_nbytes(G) -> int:
+    if isinstance(G, ig.Graph):
+        return G.ecount() * EDGE_BYTES + G.vcount() * NODE_BYTES
+    return sum(a.nbytes for a in G.arrays().values()) + G.vcount() * CSR_NODE_BYTES
+
+
+class ResidentGraph:
+    """読み込み済みの 1 プレフィックス分。階層探索器・ノード索引・結果キャッシュは初回使用時に開く"""
+
+    def __init__(self, entry: CatalogEntry, G, labels, L1num_to_L2code: dict[int, str], *,
+                 result_cache: bool = True):
+        self.entry = entry
+        self.G = G
+        self.labels = labels
+        self.L1num_to_L2code = L1num_to_L2code
+        self.nbytes = graph_nbytes(G)
+        self._hier = None
+        self._index: NodeIndex | None = None
+        self.result_cache = result_cache
+        self._results: ResultCache | None = None
+        self._lock = threading.Lock()
+
+    @property
+    def prefix(self) -> str:
+        return self.entry.prefix
+
+    @property
+    def hier(self):
+        with self._lock:
+            if self._hier is None:
+                from hier_search import L2Hierarchy
+                self._hier = L2Hierarchy(self.G, self.L1num_to_L2code)
+            return self._hier
+
+    def index(self, log=None) -> NodeIndex:
+        with self._lock:
+            if self._index is None:
+                e = self.entry
+                self._index = open_index(e.cache, self.labels, self.L1num_to_L2code, e.l2, e.l1_db, log=log)
+            return self._index
+
+    def results(self) -> ResultCache | None:
+        """経路探索結果のキャッシュ (result_cache=False なら None)"""
+        with self._lock:
+            if self._results is None and self.result_cache:
+                self._results = ResultCache.for_graph(self.entry.cache)
+            return self._results
+
+    def resolve(self, ident: str, log=None) -> list[int]:
+        """ノード指定を番号列にする (番号以外はノード索引で引く)。該当なしは ValueError"""
+        nodes = resolve_plain(ident)
+        return nodes if nodes is not None else self.index(log).resolve(ident)
+
+
+class GraphCatalog:
+    """プレフィックス → グラフの読込と、メモリ予算付き LRU による常駐管理"""
+
+    def __init__(self, entries: dict[str, CatalogEntry], *, memory_budget: int | None = None,
+                 implicit_l2: bool | None = None, result_cache: bool = True, log=None):
+        self.entries = entries
+        self.result_cache = result_cache
+        self.memory_budget = memory_budget
+        self.implicit_l2 = implicit_l2
+        self.log = log
+        self.stats = {"hits": 0, "loads": 0, "evictions": 0}
+        self._resident: OrderedDict[str, ResidentGraph] = OrderedDict()
+        self._loading: dict[str, threading.Lock] = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def scan(cls, root: Path, **kw) -> GraphCatalog:
+        return cls(discover(root), **kw)
+
+    def prefixes(self) -> list[str]:
+        return list(self.entries)
+
+    def entry(self, prefix: str) -> CatalogEntry:
+        try:
+            return self.entries[prefix]
+        except KeyError:
+            raise ValueError(f"unknown graph prefix {prefix!r} (known: {', '.join(self.entries) or 'none'})") from None
+
+    def _hit(self, prefix: str) -> ResidentGraph | None:
+        g = self._resident.get(prefix)
+        if g is not None:
+            self._resident.move_to_end(prefix)
+            self.stats["hits"] += 1
+        return g
+
+    def get(self, prefix: str) -> ResidentGraph:
+        """prefix のグラフ (常駐していなければ読み込み、予算超過分を追い出す)"""
+        entry = self.entry(prefix)
+        with self._lock:
+            g = self._hit(prefix)
+            if g is not None:
+                return g
+            loading = self._loading.setdefault(prefix, threading.Lock())
+        with loading:   # 同じプレフィックスを同時に 2 度読まない
+            with self._lock:
+                g = self._hit(prefix)
+            if g is not None:
+                return g
+            cache = load_or_build(entry.l1l2, entry.l2, entry.cache, implicit_l2=self.implicit_l2, log=self.log)
+            g = ResidentGraph(entry, cache.csr, cache.labels, cache.L1num_to_L2code,
+                              result_cache=self.result_cache)
+            print(f"[✓] {prefix}: graph loaded (|V|={g.G.vcount()}, |E|={g.G.ecount()}, ~{g.nbytes / 2**20:.0f} MB)",
+                  file=self.log)
+            with self._lock:
+                self._resident[prefix] = g
+                self.stats["loads"] += 1
+                self._evict(keep=prefix)
+        return g
+
+    def put(self, g: ResidentGraph) -> None:
+        """読み込み済みのグラフ (旧 Pickle キャッシュ由来など) を常駐に加える"""
+        with self._lock:
+            self.entries.setdefault(g.prefix, g.entry)
+            self._resident[g.prefix] = g
+            self._resident.move_to_end(g.prefix)
+            self._evict(keep=g.prefix)
+
+    def _evict(self, keep: str) -> None:
+        while self.memory_budget is not None and self.resident_bytes() > self.memory_budget:
+            victim = next((p for p in self._resident if p != keep), None)
+            if victim is None:
+                break
+            self._resident.pop(victim)
+            self.stats["evictions"] += 1
+            print(f"[i] {victim}: evicted from memory (budget {self.memory_budget / 2**20:.0f} MB)", file=self.log)
+
+    def drop(self, prefix: str) -> bool:
+        """prefix を常駐から外す (使用中の問い合わせが終われば解放される)"""
+        with self._lock:
+            return self._resident.pop(prefix, None) is not None
+
+    def resident_bytes(self) -> int:
+        return sum(g.nbytes for g in self._resident.values())
+
+    def status(self) -> dict:
+        """常駐状況 (LRU の古い順) と統計"""
+        with self._lock:
+            return {"prefixes": self.prefixes(), "memory_budget": self.memory_budget,
+                    "resident": [{"prefix": p, "nodes": g.G.vcount(), "edges": g.G.ecount(), "bytes": g.nbytes,
+                                  "result_cache": g._results.status() if g._results is not None else None}
+                                 for p, g in self._resident.items()],
+                    "resident_bytes": self.resident_bytes(), **self.stats}
+
+
+def budget_bytes(mb: float | None) -> int | None:
+    return None if mb is None else int(mb * 2**20)
+
+
+# ---------- CLI (一覧表示) ----------------------------------------------
+def cli() -> argparse.Namespace:
+    p = argparse.ArgumentParser(description="List the graph prefixes found in a directory.")
+    p.add_argument("dir", nargs="?", default=".", help="Directory holding <prefix>_L1-L2_DB.txt / <prefix>_L2_DB.txt")
+    return p.parse_args()
+
+
+def main():
+    args = cli()
+    entries = discover(Path(args.dir))
+    if not entries:
+        sys.exit(f"[!] no L1-L2 / L2 DB pairs in {args.dir}")
+    for e in entries.values():
+        head = read_header(e.cache) if e.cache.exists() else None
+        state = f"cached |V|={head[0]['n']}" if head else "not cached"
+        print(f"{e.prefix:<16} {e.l1l2.name:<28} {e.l2.name:<24} {state}"
+              + (f"  hashes: {e.l1_db.name}" if e.l1_db else ""))
+
+
+if __name__ == "__main__":
+    main()
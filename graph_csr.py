@@ -0,0 +1,310 @@
+from __future__ import annotations
+import hashlib, itertools
+import numpy as np
+import igraph as ig
+from Common_Utility import is_implicit
+
+# ---------- CSR 配列表現 ----------------------------------------------
+#
+# 無向グラフを両方向分の CSR (indptr / indices) で持ち、エッジ種別は
+# uint8 コード、重みは float32 で保持する。L2 クラス所属 (l2_class) と
+# 暗黙 L2 層用のクラス隣接 CSR も同じ配列群に含めるので、共有メモリや
+# ディスクへそのまま載せられる。操作ラベルは文字列プール (actions) の番号で、
+# 行 → 近傍の向き (action / l2_action) と逆向き (action_back) を持つ (-1 = 無し)。
+
+COLORS = ("black", "red", "blue")
+ETYPE = {c: i for i, c in enumerate(COLORS)}
+
+ARRAY_DTYPES = {
+    "indptr":      np.int64,
+    "indices":     np.int32,
+    "etype":       np.uint8,
+    "weight":      np.float32,
+    "action":      np.int32,
+    "action_back": np.int32,
+    "l2_class":    np.int32,
+    "l2_indptr":   np.int64,
+    "l2_indices":  np.int32,
+    "l2_action":   np.int32,
+}
+
+
+def _csr(n: int, u: np.ndarray, v: np.ndarray, *cols: np.ndarray,
+         back_cols: tuple[np.ndarray, ...] | None = None) -> tuple[np.ndarray, ...]:
+    """無向エッジ列を両方向 CSR (行内は近傍番号順、自己ループは 1 回) に変換
+
+    back_cols は v → u 側の行に入れる列 (省略時は cols と同じ値)。
+    """
+    back = u != v
+    src = np.concatenate((u, v[back]))
+    dst = np.concatenate((v, u[back]))
+    order = np.lexsort((dst, src))
+    indptr = np.zeros(n + 1, dtype=np.int64)
+    np.cumsum(np.bincount(src, minlength=n), out=indptr[1:])
+    return (indptr, dst[order]) + tuple(np.concatenate((c, b[back]))[order]
+                                        for c, b in zip(cols, back_cols or cols))
+
+
+class CSRRows:
+    """CSR の行を隣接リストとして引くビュー。adj[u] の度にその行だけを Python のリストにする
+
+    etype を渡すと各要素は (近傍, 重み, 色)、省略時は近傍番号だけ。配列は mmap / 共有メモリ上の
+    ままでよく、全体を Python のオブジェクトに展開しない。
+    """
+
+    __slots__ = ("indptr", "indices", "etype", "weight")
+
+    def __init__(self, indptr: np.ndarray, indices: np.ndarray, etype: np.ndarray | None = None,
+                 weight: np.ndarray | None = None):
+        self.indptr = indptr
+        self.indices = indices
+        self.etype = etype
+        self.weight = weight
+
+    def __len__(self) -> int:
+        return len(self.indptr) - 1
+
+    def __getitem__(self, u: int) -> list:
+        lo, hi = self.indptr[u], self.indptr[u + 1]
+        if self.etype is None:
+            return self.indices[lo:hi].tolist()
+        return list(zip(self.indices[lo:hi].tolist(), self.weight[lo:hi].tolist(),
+                        [COLORS[e] for e in self.etype[lo:hi].tolist()]))
+
+
+def _find(indptr: np.ndarray, indices: np.ndarray, u: int, v: int) -> int:
+    """行 u (近傍番号順) 内の v の位置。無ければ -1"""
+    lo, hi = int(indptr[u]), int(indptr[u + 1])
+    i = lo + int(np.searchsorted(indices[lo:hi], v))
+    return i if i < hi and indices[i] == v else -1
+
+
+class CSRGraph:
+    """igraph グラフと相互変換できる読み取り専用 CSR グラフ
+
+    探索 (Common_Utility / hier_search / search_backends) はこのまま配列上で行える。
+    to_igraph() は描画以外の igraph 前提の処理 (エッジ書き出しなど) 用。
+    """
+
+    __slots__ = ("n", "codes", "implicit", "actions", *ARRAY_DTYPES, "__weakref__")
+
+    def __init__(self, n: int, codes: list[str], implicit: bool, actions: list[str], **arrays: np.ndarray):
+        self.n = n
+        self.codes = codes
+        self.implicit = implicit
+        self.actions = actions
+        for name, dtype in ARRAY_DTYPES.items():
+            setattr(self, name, np.asarray(arrays[name], dtype=dtype))
+
+    @classmethod
+    def from_edges(cls, n: int, u: np.ndarray, v: np.ndarray, etype: np.ndarray, weight: np.ndarray,
+                   L1num_to_L2code: dict[int, str], L2_adj: dict[str, set[str]], *, implicit: bool = False,
+                   actions: list[str] = (), action: np.ndarray | None = None, action_back: np.ndarray | None = None,
+                   l2_actions: dict[tuple[str, str], int] | None = None) -> CSRGraph:
+        """無向エッジ配列 (各エッジ 1 回) とクラス情報から組み立てる
+
+        action / action_back は各エッジの u → v / v → u 向きの操作番号、
+        l2_actions は (L2 コード, L2 コード) 向きの操作番号 (いずれも actions の添字)。
+        """
+        none = np.full(len(u), -1, dtype=np.int32)
+        action = none if action is None else np.asarray(action, dtype=np.int32)
+        action_back = none if action_back is None else np.asarray(action_back, dtype=np.int32)
+        indptr, indices, etype, weight, action, action_back = _csr(
+            n, u, v, etype, weight, action, action_back, back_cols=(etype, weight, action_back, action))
+
+        codes = sorted(set(L1num_to_L2code.values()))
+        code_id = {c: i for i, c in enumerate(codes)}
+        l2_class = np.full(n, -1, dtype=np.int32)
+        for nid, code in L1num_to_L2code.items():
+            l2_class[nid] = code_id[code]
+
+        # 所属 L1 ノードを持たない L2 コードは L1 エッジに影響しないので落とす
+        pairs = [(code_id[a], code_id[b]) for a, adj in L2_adj.items() for b in adj
+                 if a <= b and a in code_id and b in code_id]
+        P = np.asarray(pairs, dtype=np.int64).reshape(-1, 2)
+        l2_actions = l2_actions or {}
+        fwd = np.asarray([l2_actions.get((codes[a], codes[b]), -1) for a, b in pairs], dtype=np.int32)
+        back = np.asarray([l2_actions.get((codes[b], codes[a]), -1) for a, b in pairs], dtype=np.int32)
+        l2_indptr, l2_indices, l2_action = _csr(len(codes), P[:, 0], P[:, 1], fwd, back_cols=(back,))
+        return cls(n, codes, implicit, list(actions), indptr=indptr, indices=indices, etype=etype, weight=weight,
+                   action=action, action_back=action_back, l2_class=l2_class, l2_indptr=l2_indptr,
+                   l2_indices=l2_indices, l2_action=l2_action)
+
+    @classmethod
+    def from_igraph(cls, G: ig.Graph, L1num_to_L2code: dict[int, str]) -> CSRGraph:
+        E = np.asarray(G.get_edgelist(), dtype=np.int64).reshape(-1, 2)
+        etype = np.asarray([ETYPE[c] for c in G.es["color"]] if G.ecount() else [], dtype=np.uint8)
+        weight = np.asarray(G.es["weight"] if G.ecount() else [], dtype=np.float32)
+        action, action_back = (np.asarray([-1 if a is None else a for a in G.es[name]], dtype=np.int32)
+                               if name in G.es.attributes() else None for name in ("action", "action_back"))
+        gattrs = G.attributes()
+        L2_adj = G["L2_adj"] if "L2_adj" in gattrs else {}
+        l2_actions: dict[tuple[str, str], int] = {}
+        if "l2_pairs" in gattrs:
+            for (a, b), act in zip(G["l2_pairs"], G["l2_actions"]):
+                if act >= 0:
+                    l2_actions.setdefault((a, b), act)
+        return cls.from_edges(G.vcount(), E[:, 0], E[:, 1], etype, weight, L1num_to_L2code, L2_adj,
+                              implicit=is_implicit(G), actions=G["actions"] if "actions" in gattrs else [],
+                              action=action, action_back=action_back, l2_actions=l2_actions)
+
+    def _upper(self) -> tuple[np.ndarray, np.ndarray]:
+        src = np.repeat(np.arange(self.n, dtype=np.int64), np.diff(self.indptr))
+        return src, src <= self.indices
+
+    def edges(self) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        """各無向エッジを 1 回ずつ (u <= v) の (u, v, etype, weight) で返す"""
+        src, keep = self._upper()
+        return src[keep], self.indices[keep].astype(np.int64), self.etype[keep], self.weight[keep]
+
+    def edge_actions(self) -> tuple[np.ndarray, np.ndarray]:
+        """edges() と同じ順で各エッジの (u → v, v → u) 向きの操作番号"""
+        _, keep = self._upper()
+        return self.action[keep], self.action_back[keep]
+
+    def l2_pair_actions(self) -> tuple[list[tuple[str, str]], list[int]]:
+        """操作ラベルのある (L2 コード, L2 コード) 向きの対とその操作番号"""
+        src = np.repeat(np.arange(len(self.codes)), np.diff(self.l2_indptr))
+        has = np.flatnonzero(self.l2_action >= 0)
+        pairs = [(self.codes[a], self.codes[b]) for a, b in zip(src[has].tolist(), self.l2_indices[has].tolist())]
+        return pairs, self.l2_action[has].tolist()
+
+    def layer_hashes(self) -> dict[str, str]:
+        """黒レイヤ / 全体のエッジ内容ハッシュ (派生データの無効化判定用)"""
+        u, v, etype, weight = self.edges()
+        black = etype == ETYPE["black"]
+        out = {}
+        for layer, mask in (("black", black), ("full", slice(None))):
+            h = hashlib.sha1(np.int64(self.n).tobytes())
+            for a in (u[mask], v[mask], etype[mask], weight[mask]):
+                h.update(np.ascontiguousarray(a).tobytes())
+            out[layer] = h.hexdigest()
+        return out
+
+    def L2_adj(self) -> dict[str, set[str]]:
+        return {
+            self.codes[a]: {self.codes[b] for b in self.l2_indices[self.l2_indptr[a]:self.l2_indptr[a + 1]].tolist()}
+            for a in range(len(self.codes))
+        }
+
+    def arrays(self) -> dict[str, np.ndarray]:
+        return {name: getattr(self, name) for name in ARRAY_DTYPES}
+
+    def neighbors(self, u: int) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """u の (近傍, エッジ種別, 重み)"""
+        lo, hi = self.indptr[u], self.indptr[u + 1]
+        return self.indices[lo:hi], self.etype[lo:hi], self.weight[lo:hi]
+
+    def L1num_to_L2code(self) -> dict[int, str]:
+        return {v: self.codes[c] for v, c in enumerate(self.l2_class.tolist()) if c >= 0}
+
+    # ---------- 探索用アクセサ (igraph 版と同じ順序・結果) ----------------
+    def vcount(self) -> int:
+        return self.n
+
+    def ecount(self) -> int:
+        return int(np.count_nonzero(self._upper()[1]))
+
+    def rows(self) -> CSRRows:
+        """全エッジの行ビュー (近傍, 重み, 色)。暗黙 L2 層は含まない"""
+        return CSRRows(self.indptr, self.indices, self.etype, self.weight)
+
+    def black_rows(self) -> CSRRows:
+        """黒エッジの行ビュー (近傍番号)。全エッジが黒なら元の配列をそのまま使う"""
+        black = self.etype == ETYPE["black"]
+        if black.all():
+            return CSRRows(self.indptr, self.indices)
+        before = np.concatenate(([0], np.cumsum(black, dtype=np.int64)))
+        return CSRRows(before[self.indptr], self.indices[black])
+
+    def edge_at(self, u: int, v: int) -> tuple[str, int, int] | None:
+        """実在する (u, v) エッジの (色, u → v の操作番号, v → u の操作番号)。無ければ None"""
+        if not (0 <= u < self.n and 0 <= v < self.n):
+            return None
+        i = _find(self.indptr, self.indices, u, v)
+        if i < 0:
+            return None
+        return COLORS[self.etype[i]], int(self.action[i]), int(self.action_back[i])
+
+    def implicit_color(self, u: int, v: int) -> str | None:
+        """暗黙 L2 層での (u, v) の色 (赤 > 青)。該当なしは None"""
+        if u == v:
+            return None
+        cu, cv = int(self.l2_class[u]), int(self.l2_class[v])
+        if cu < 0 or cv < 0:
+            return None
+        if _find(self.l2_indptr, self.l2_indices, cu, cv) >= 0:
+            return "red"
+        return "blue" if cu == cv else None
+
+    def implicit_actions(self, u: int, v: int) -> tuple[int, int]:
+        """暗黙 L2 層の赤エッジ u → v / v → u の操作番号 (-1 = 無し)"""
+        cu, cv = int(self.l2_class[u]), int(self.l2_class[v])
+        out = []
+        for a, b in ((cu, cv), (cv, cu)):
+            i = _find(self.l2_indptr, self.l2_indices, a, b)
+            out.append(int(self.l2_action[i]) if i >= 0 else -1)
+        return out[0], out[1]
+
+    def implicit_edges_among(self, nodes: set[int]) -> list[tuple[int, int, str]]:
+        """nodes 内に両端を持つ暗黙 L2 層の赤・青エッジ (黒エッジのある組は除く)"""
+        by_class: dict[int, list[int]] = {}
+        for n in sorted(nodes):
+            c = int(self.l2_class[n])
+            if c >= 0:
+                by_class.setdefault(c, []).append(n)
+        out = []
+        for ca, A in by_class.items():
+            adj = self.l2_indices[self.l2_indptr[ca]:self.l2_indptr[ca + 1]].tolist()
+            for cb in adj:
+                if cb not in by_class or cb < ca:
+                    continue
+                pairs = itertools.combinations(A, 2) if ca == cb else itertools.product(A, by_class[cb])
+                out += [(u, v, "red") for u, v in pairs if _find(self.indptr, self.indices, u, v) < 0]
+            if ca not in adj:
+                out += [(u, v, "blue") for u, v in itertools.combinations(A, 2)
+                        if _find(self.indptr, self.indices, u, v) < 0]
+        return out
+
+    def l2_members(self) -> dict[str, np.ndarray]:
+        """L2 コード → 所属ノード (番号順)"""
+        order = np.argsort(self.l2_class, kind="stable")
+        cls = self.l2_class[order]
+        bounds = np.searchsorted(cls, np.arange(len(self.codes) + 1))
+        return {code: order[bounds[c]:bounds[c + 1]].astype(np.int64) for c, code in enumerate(self.codes)
+                if bounds[c + 1] > bounds[c]}
+
+    def l2_code_pairs(self) -> list[tuple[str, str]]:
+        """L2 隣接 (a <= b) のコード対"""
+        src = np.repeat(np.arange(len(self.codes)), np.diff(self.l2_indptr))
+        keep = src <= self.l2_indices
+        return [(self.codes[a], self.codes[b]) for a, b in zip(src[keep].tolist(), self.l2_indices[keep].tolist())]
+
+    def to_igraph(self) -> ig.Graph:
+        """CSR から igraph グラフを復元 (暗黙 L2 層の属性も含む)
+
+        エッジ列と属性を Python のリスト経由で igraph へ全てコピーする。探索はこの変換を
+        経ずに CSRGraph 上で行えるので、エッジ書き出しなど igraph 前提の処理でだけ使う。
+        """
+        u, v, etype, weight = self.edges()
+        G = ig.Graph(n=self.n, directed=False)
+        G.vs["name"] = list(range(self.n))
+        colors = np.asarray(COLORS)[etype].tolist()
+        action, action_back = self.edge_actions()
+        attrs = {"color": colors, "weight": weight.astype(np.float64).tolist(),
+                 "action": action.tolist(), "action_back": action_back.tolist()}
+        if (etype == ETYPE["blue"]).any():
+            attrs["style"] = ["dotted" if c == "blue" else None for c in colors]
+        G.add_edges(np.column_stack((u, v)).tolist(), attributes=attrs)
+        G["L2_adj"] = self.L2_adj()
+        G["actions"] = list(self.actions)
+        if self.implicit:
+            L1num_to_L2code = self.L1num_to_L2code()
+            L2code_to_L1num: dict[str, list[int]] = {}
+            for nid, code in L1num_to_L2code.items():
+                L2code_to_L1num.setdefault(code, []).append(nid)
+            G["implicit_l2"] = True
+            G["L1num_to_L2code"] = L1num_to_L2code
+            G["L2code_to_L1num"] = L2code_to_L1num
+            G["l2_pairs"], G["l2_actions"] = self.l2_pair_actions()
+        return G
@@ -0,0 +1,155 @@
+from __future__ import annotations
+from pathlib import Path
+import numpy as np
+import Common_Utility as CU
+from graph_cache import GraphCache, fingerprint, save_graph_cache
+from graph_csr import ETYPE, CSRGraph
+from instrument import phase
+
+# ---------- 差分更新 ----------------------------------------------------
+#
+# 赤・青エッジの有無は「両端の L2 クラス」「クラス間の L2 隣接」「黒エッジの有無」
+# 「(青のみ) クラスサイズ」だけで決まる。そこで、所属ノードまたは L2 隣接が
+# 変化したクラス (affected) に触れる赤・青エッジだけを作り直し、それ以外は
+# 旧キャッシュから引き継ぐ。黒エッジの増減は個別に色を付け直す。
+#
+# 計算量の限界: 差分を取るのは解析後のグラフ同士で、DB の変更行ではない。旧 DB の本文は
+# キャッシュに残らないので、新しい DB の全行解析・黒エッジの重複除去・CSR の組み直しと
+# 書き出しは毎回 O(DB) かかる。省けるのは影響外クラスの赤・青エッジ (クラスサイズの 2 乗で
+# 増える展開) の再生成だけで、変更がわずかでも全再構築より速くなるのはその分に限られる。
+
+BLUE_MAX_CLASS = 100   # Common_Utility._blue_edge_arrays の既定値と同じ
+
+
+def _class_ids(codes: list[str], code_of: dict[int, str], n: int) -> np.ndarray:
+    """ノード毎の (共通コード表での) クラス番号。所属なしは -1"""
+    code_id = {c: i for i, c in enumerate(codes)}
+    out = np.full(n, -1, dtype=np.int64)
+    for nid, code in code_of.items():
+        out[nid] = code_id[code]
+    return out
+
+
+def _adj_pairs(L2_adj: dict[str, set[str]], known: set[str]) -> set[tuple[str, str]]:
+    return {(a, b) for a, adj in L2_adj.items() for b in adj if a <= b and a in known and b in known}
+
+
+def _pair_action_ids(l2_pairs: list[tuple[str, str]], l2_actions: list[int]) -> dict[tuple[str, str], int]:
+    """(L2 コード, L2 コード) 向き → 初出行の操作番号"""
+    out: dict[tuple[str, str], int] = {}
+    for pair, act in zip(l2_pairs, l2_actions):
+        if act >= 0:
+            out.setdefault(tuple(pair), act)
+    return out
+
+
+def apply_delta(cache: GraphCache, l1l2_path: Path, l2_path: Path, cache_path: Path, *, log=None) -> dict:
+    """新しい DB と旧キャッシュの差分だけを反映したキャッシュを書き出す"""
+    with phase("delta.apply", file=cache_path.name):
+        return _apply_delta(cache, l1l2_path, l2_path, cache_path, log)
+
+
+def _apply_delta(cache: GraphCache, l1l2_path: Path, l2_path: Path, cache_path: Path, log) -> dict:
+    old = cache.csr
+    implicit = old.implicit
+    db = CU.parse_dbs(l1l2_path, l2_path)
+    n = db.n_nodes
+    nk = max(n, old.n)                          # ペアキー用のノード数
+
+    # --- ノード / クラスの差分 -----------------------------------------
+    old_code_of = old.L1num_to_L2code()
+    codes = sorted(set(old_code_of.values()) | set(db.L1num_to_L2code.values()))
+    c_old = _class_ids(codes, old_code_of, nk)
+    c_new = _class_ids(codes, db.L1num_to_L2code, nk)
+    changed = np.flatnonzero(c_old != c_new)
+
+    old_adj = _adj_pairs(old.L2_adj(), set(old_code_of.values()))
+    new_L2_adj = CU.l2_adjacency(db.l2_pairs, db.L2code_to_L1num)
+    new_adj = _adj_pairs(new_L2_adj, set(db.L2code_to_L1num))
+    adj_diff = old_adj ^ new_adj
+
+    # 操作ラベルの変わった L2 エッジも両端クラスの赤エッジを作り直す
+    pair_act = _pair_action_ids(db.l2_pairs, db.l2_actions)
+    old_pairs, old_ids = old.l2_pair_actions()
+    old_act = {pair: old.actions[i] for pair, i in zip(old_pairs, old_ids)}
+    new_act = {pair: db.actions[i] for pair, i in pair_act.items()}
+    act_diff = {pair for pair in old_act.keys() | new_act.keys() if old_act.get(pair) != new_act.get(pair)}
+
+    code_id = {c: i for i, c in enumerate(codes)}
+    affected = set(c_old[changed].tolist()) | set(c_new[changed].tolist())
+    affected |= {code_id[c] for pair in adj_diff for c in pair}
+    affected |= {code_id[c] for pair in act_diff for c in pair if c in code_id}
+    affected.discard(-1)
+    aff_class = np.zeros(len(codes) + 1, dtype=bool)      # 末尾 = 所属なし (-1)
+    aff_class[list(affected)] = True
+    aff_node = aff_class[c_old] | aff_class[c_new]
+
+    # --- 黒エッジ ------------------------------------------------------
+    ou, ov, ot, ow = old.edges()
+    okeys = CU._pair_keys(ou, ov, nk)
+    E = db.l1_edges
+    bi, keys = CU._unique_index(E[:, 0], E[:, 1], nk, np.empty(0, np.int64))
+    b_act = CU._directed_actions(keys, E[:, 0] <= E[:, 1], db.l1_actions, bi)
+    bu, bv, bkeys = np.minimum(E[bi, 0], E[bi, 1]), np.maximum(E[bi, 0], E[bi, 1]), keys[bi]
+    old_black = ot == ETYPE["black"]
+    parts = [(bu, bv, np.full(len(bu), ETYPE["black"], np.uint8), np.full(len(bu), CU.W_BLACK, np.float32), *b_act)]
+    stats = {
+        "nodes_changed": int(len(changed)),
+        "black_added": int((~np.isin(bkeys, okeys[old_black])).sum()),
+        "black_removed": int((~np.isin(okeys[old_black], bkeys)).sum()),
+        "l2_edges_changed": len(adj_diff),
+        "l2_actions_changed": len(act_diff),
+        "classes_affected": len(affected),
+    }
+
+    if not implicit:
+        members = {c: np.asarray(m, dtype=np.int64) for c, m in db.L2code_to_L1num.items()}
+        untouched = ~aff_node[ou] & ~aff_node[ov]
+        new_id = {a: i for i, a in enumerate(db.actions)}
+        remap = np.asarray([new_id.get(a, -1) for a in old.actions] + [-1], dtype=np.int32)   # 旧番号 → 新番号 (-1 → -1)
+        oa, ob = (remap[a] for a in old.edge_actions())
+
+        # 影響外クラス間の赤・青は引き継ぐ (新たに黒になったものは除く)
+        keep = ~old_black & untouched & ~np.isin(okeys, bkeys)
+        parts.append((ou[keep], ov[keep], ot[keep], ow[keep], oa[keep], ob[keep]))
+
+        # 黒でなくなった影響外のエッジは新しい規則で色を付け直す
+        freed = old_black & untouched & ~np.isin(okeys, bkeys)
+        fu, fv = ou[freed], ov[freed]
+        cu, cv = c_new[fu], c_new[fv]
+        is_red = np.fromiter(((codes[a], codes[b]) in new_adj or (codes[b], codes[a]) in new_adj
+                              for a, b in zip(cu.tolist(), cv.tolist())), dtype=bool, count=len(fu)) & (fu != fv)
+        size_ok = np.fromiter((len(members[codes[a]]) <= BLUE_MAX_CLASS for a in cu.tolist()), dtype=bool, count=len(fu))
+        is_blue = ~is_red & (cu == cv) & (fu != fv) & size_ok
+        n_red, n_blue = int(is_red.sum()), int(is_blue.sum())
+        red_cls = list(zip(cu[is_red].tolist(), cv[is_red].tolist()))
+        f_act = np.asarray([pair_act.get((codes[a], codes[b]), -1) for a, b in red_cls], dtype=np.int32)
+        f_back = np.asarray([pair_act.get((codes[b], codes[a]), -1) for a, b in red_cls], dtype=np.int32)
+        parts.append((fu[is_red], fv[is_red], np.full(n_red, ETYPE["red"], np.uint8),
+                      np.full(n_red, CU.W_RED, np.float32), f_act, f_back))
+        parts.append((fu[is_blue], fv[is_blue], np.full(n_blue, ETYPE["blue"], np.uint8),
+                      np.full(n_blue, CU.W_BLUE, np.float32), np.full(n_blue, -1, np.int32), np.full(n_blue, -1, np.int32)))
+
+        # 影響クラスに触れる赤・青だけを再生成 (L2 エッジ行は向きと操作ラベル付きのまま使う)
+        aff_codes = {codes[c] for c in affected}
+        sel = np.asarray([i for i, (a, b) in enumerate(db.l2_pairs) if a in aff_codes or b in aff_codes], dtype=np.int64)
+        ru, rv, rp = CU._red_edge_arrays([db.l2_pairs[i] for i in sel.tolist()], members, pair_index=True)
+        ri, keys = CU._unique_index(ru, rv, nk, bkeys)
+        r_act = CU._directed_actions(keys, ru <= rv, np.asarray(db.l2_actions, dtype=np.int32)[sel][rp], ri)
+        ru, rv, rkeys = np.minimum(ru[ri], rv[ri]), np.maximum(ru[ri], rv[ri]), keys[ri]
+        aff_members = {c: members[c] for c in aff_codes if c in members}
+        lu, lv, _ = CU._unique_edges(*CU._blue_edge_arrays(aff_members, BLUE_MAX_CLASS), nk,
+                                     np.concatenate((bkeys, rkeys)))
+        parts.append((ru, rv, np.full(len(ru), ETYPE["red"], np.uint8), np.full(len(ru), CU.W_RED, np.float32), *r_act))
+        parts.append((lu, lv, np.full(len(lu), ETYPE["blue"], np.uint8), np.full(len(lu), CU.W_BLUE, np.float32),
+                      np.full(len(lu), -1, np.int32), np.full(len(lu), -1, np.int32)))
+        stats.update(red_blue_kept=int(keep.sum()), red_blue_recolored=int(is_red.sum() + is_blue.sum()),
+                     red_regenerated=int(len(ru)), blue_regenerated=int(len(lu)))
+
+    u, v, t, w, a, b = (np.concatenate(cols) for cols in zip(*parts))
+    csr = CSRGraph.from_edges(n, u, v, t, w, db.L1num_to_L2code, new_L2_adj, implicit=implicit, actions=db.actions,
+                              action=a, action_back=b, l2_actions=pair_act)
+    fp = fingerprint(l1l2_path, l2_path, implicit_l2=implicit)
+    save_graph_cache(cache_path, csr, db.node_labels, db.L1num_to_L2code, fp)
+    print("[+] Delta applied: " + ", ".join(f"{key}={val}" for key, val in stats.items()), file=log)
+    return stats
@@ -0,0 +1,139 @@
+from __future__ import annotations
+import heapq
+from collections import deque
+import igraph as ig
+from Common_Utility import DEFAULT_WEIGHTS, Budget, Weights, edge_arrays, iter_dag_paths
+from instrument import count, phase
+
+# ---------- 階層探索 (L2 抽象グラフ → L1) -----------------------------
+#
+# L2 クラスを 1 点に縮約した商グラフ (黒エッジのみ、クラス間移動は黒エッジ
+# 1 本分、クラス内移動は 0) 上の距離は、L1 黒グラフ上の距離の下界になる。これを A* のヒューリスティックに使えば厳密解のまま
+# 展開ノード数を減らせる。corridor を指定すると、L2 上の最短回廊から
+# slack 以内のクラスに属する L1 ノードだけを探索する (近似)。
+
+EPS = 1e-9
+
+
+class L2Hierarchy:
+    """黒エッジ L1 グラフと L2 商グラフを保持する階層探索器
+
+    黒の重みは全エッジ共通なので、隣接と商グラフ上の距離はホップ数で持ち、
+    問い合わせ毎の weights.black を掛けて使う (l1_shortest_paths と同じ重み・予算に従う)。
+    """
+
+    def __init__(self, G: ig.Graph, L1num_to_L2code: dict[int, str]):
+        self.n = G.vcount()
+        self.codes = sorted(set(L1num_to_L2code.values()))
+        code_id = {c: i for i, c in enumerate(self.codes)}
+        self.class_of = [code_id.get(L1num_to_L2code.get(v)) for v in range(self.n)]
+
+        self.adj: list[list[int]] = [[] for _ in range(self.n)]
+        self.qadj: list[set[int]] = [set() for _ in self.codes]
+        u_arr, v_arr, _ = edge_arrays(G, "black")
+        for u, v in zip(u_arr.tolist(), v_arr.tolist()):
+            self.adj[u].append(v)
+            self.adj[v].append(u)
+            cu, cv = self.class_of[u], self.class_of[v]
+            if cu is None or cv is None or cu == cv:
+                continue
+            self.qadj[cu].add(cv)
+            self.qadj[cv].add(cu)
+        self._qdist: dict[int, list[float]] = {}
+
+    def l2_distances(self, c: int) -> list[float]:
+        """商グラフ上のクラス c からのホップ数 (クラス単位でキャッシュ)"""
+        if c not in self._qdist:
+            dist = [float("inf")] * len(self.codes)
+            dist[c] = 0.0
+            queue = deque([c])
+            while queue:
+                a = queue.popleft()
+                for b in self.qadj[a]:
+                    if dist[b] == float("inf"):
+                        dist[b] = dist[a] + 1
+                        queue.append(b)
+            self._qdist[c] = dist
+        return self._qdist[c]
+
+    def corridor(self, s: int, t: int, slack: float, w: float = DEFAULT_WEIGHTS.black) -> set[int]:
+        """L2 最短回廊 (± slack、黒の重み w で換算) 上のクラス集合"""
+        ds = self.l2_distances(self.class_of[s])
+        dt = self.l2_distances(self.class_of[t])
+        best = ds[self.class_of[t]]
+        return {c for c in range(len(self.codes)) if (ds[c] + dt[c]) * w <= best * w + slack + EPS}
+
+    def shortest_paths(self, s: int, t: int, k: int | None, *, corridor: float | None = None,
+                       heuristic: bool = True, weights: Weights | None = None, budget: Budget | None = None,
+                       stats: dict | None = None) -> list[list[int]]:
+        """s→t の等コスト最短経路を最大 k 本返す (A*、既定は厳密)"""
+        stats = {} if stats is None else stats
+        w = (weights or DEFAULT_WEIGHTS).black
+        budget = budget.start() if budget is not None else None
+        with phase("search.hier", start=s, goal=t):
+            paths = self._shortest_paths(s, t, k, corridor, heuristic, w, budget, stats)
+        count("paths.l1", len(paths))
+        count("hier.expanded", stats.get("expanded", 0))
+        return paths
+
+    def _shortest_paths(self, s: int, t: int, k: int | None, corridor: float | None, heuristic: bool,
+                        w: float, budget: Budget | None, stats: dict) -> list[list[int]]:
+        if not (0 <= s < self.n and 0 <= t < self.n):
+            stats.update(expanded=0, cost=None, corridor=None, exhaustive=True, stopped=None, paths=0)
+            return []
+        if self.class_of[s] is None or self.class_of[t] is None:
+            heuristic, corridor = False, None
+
+        hops = self.l2_distances(self.class_of[t]) if heuristic else None
+        h = [x * w for x in hops] if hops else None
+        allowed = self.corridor(s, t, corridor, w) if corridor is not None else None
+        class_of = self.class_of
+
+        g = {s: 0.0}
+        preds: dict[int, list[int]] = {s: []}
+        closed = set()
+        heap = [(h[class_of[s]] if h else 0.0, 0.0, s)]
+        best = float("inf")
+        expanded = 0
+        stopped = None
+        while heap:
+            f, d, u = heapq.heappop(heap)
+            if f > best + EPS:
+                break
+            if u in closed:
+                continue
+            if budget is not None and (stopped := budget.charge()):
+                break
+            closed.add(u)
+            expanded += 1
+            if u == t:
+                best = d
+                continue
+            nd = d + w
+            for v in self.adj[u]:
+                if allowed is not None and class_of[v] not in allowed:
+                    continue
+                gv = g.get(v)
+                if gv is None or nd < gv - EPS:
+                    g[v] = nd
+                    preds[v] = [u]
+                    heapq.heappush(heap, (nd + (h[class_of[v]] if h else 0.0), nd, v))
+                elif abs(nd - gv) <= EPS and u not in preds[v]:
+                    preds[v].append(u)
+
+        found = t in closed
+        stats.update(expanded=expanded, cost=best if found else None,
+                     corridor=len(allowed) if allowed is not None else None)
+        if stopped or not found:
+            stats.update(exhaustive=not stopped, stopped=stopped, paths=0)
+            return []
+
+        # 先行ノード DAG を t から逆向きに辿って経路列挙
+        return list(iter_dag_paths(preds, s, t, k, budget=budget, stats=stats))
+
+
+def l1_shortest_paths_hier(G: ig.Graph, L1num_to_L2code: dict[int, str], s: int, t: int, k: int | None,
+                           *, corridor: float | None = None, weights: Weights | None = None,
+                           budget: Budget | None = None) -> list[list[int]]:
+    """l1_shortest_paths の階層探索版 (単発呼び出し用)"""
+    return L2Hierarchy(G, L1num_to_L2code).shortest_paths(s, t, k, corridor=corridor, weights=weights, budget=budget)
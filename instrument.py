@@ -0,0 +1,120 @@
+from __future__ import annotations
+import atexit, json, os, sys, threading, time
+from contextlib import contextmanager, nullcontext
+from pathlib import Path
+
+# ---------- 計測 (フェーズ時間 / カウンタ) ----------------------------
+#
+# 既定では無効: phase() は共有の nullcontext を返し、count() は即 return する。
+# enable() するか、環境変数 SP_PROFILE=<file.json> / SP_TRACE=<file.json> を
+# 指定するとフェーズの開始時刻・所要時間とカウンタを記録し、終了時に
+# 集計 JSON / Chrome trace-event 形式 (chrome://tracing, Perfetto) で書き出す。
+# フェーズ名は "build.red" のように . 区切りで、先頭がカテゴリになる。
+
+_NULL = nullcontext()
+
+
+class Recorder:
+    def __init__(self):
+        self.t0 = time.perf_counter_ns()
+        self.events: list[tuple[str, int, int, int, dict]] = []   # (name, start_ns, dur_ns, tid, args)
+        self.counters: dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def phase(self, name: str, args: dict):
+        start = time.perf_counter_ns()
+        try:
+            yield
+        finally:
+            ev = (name, start - self.t0, time.perf_counter_ns() - start, threading.get_native_id(), args)
+            with self._lock:
+                self.events.append(ev)
+
+    def count(self, name: str, n: int) -> None:
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def _snapshot(self) -> tuple[list[tuple[str, int, int, int, dict]], dict[str, int]]:
+        with self._lock:
+            return list(self.events), dict(self.counters)
+
+    def summary(self) -> dict:
+        """フェーズ毎の呼出回数・合計/最大時間 (初出順) とカウンタ"""
+        events, counters = self._snapshot()
+        phases: dict[str, dict] = {}
+        for name, _, dur, _, _ in events:
+            p = phases.setdefault(name, {"calls": 0, "total_ms": 0.0, "max_ms": 0.0})
+            p["calls"] += 1
+            p["total_ms"] += dur / 1e6
+            p["max_ms"] = max(p["max_ms"], dur / 1e6)
+        for p in phases.values():
+            p["total_ms"] = round(p["total_ms"], 3)
+            p["max_ms"] = round(p["max_ms"], 3)
+        return {"phases": phases, "counters": dict(sorted(counters.items()))}
+
+    def chrome_trace(self) -> dict:
+        pid = os.getpid()
+        recorded, counters = self._snapshot()
+        events = [{"name": name, "cat": name.split(".")[0], "ph": "X", "ts": start / 1e3, "dur": dur / 1e3,
+                   "pid": pid, "tid": tid, "args": args}
+                  for name, start, dur, tid, args in recorded]
+        end = max((e["ts"] + e["dur"] for e in events), default=0.0)
+        events += [{"name": name, "ph": "C", "ts": end, "pid": pid, "args": {"value": v}}
+                   for name, v in sorted(counters.items())]
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+
+_rec: Recorder | None = None
+
+
+def enabled() -> bool:
+    return _rec is not None
+
+
+def enable() -> Recorder:
+    global _rec
+    if _rec is None:
+        _rec = Recorder()
+    return _rec
+
+
+def disable() -> None:
+    global _rec
+    _rec = None
+
+
+def phase(name: str, **args):
+    """with phase("build.red"): ... の区間を記録する (無効時は何もしない)"""
+    return _NULL if _rec is None else _rec.phase(name, args)
+
+
+def count(name: str, n: int = 1) -> None:
+    if _rec is not None:
+        _rec.count(name, n)
+
+
+def write_json(path: Path) -> None:
+    Path(path).write_text(json.dumps(_rec.summary() if _rec else {}, indent=2))
+
+
+def write_chrome_trace(path: Path) -> None:
+    Path(path).write_text(json.dumps(_rec.chrome_trace() if _rec else {"traceEvents": []}))
+
+
+def setup(profile: str | None = None, trace: str | None = None) -> None:
+    """profile / trace の出力先が指定されていれば計測を有効にし、終了時に書き出す"""
+    if not (profile or trace):
+        return
+    enable()
+
+    def _dump():
+        for path, write in ((profile, write_json), (trace, write_chrome_trace)):
+            if path:
+                write(path)
+                print(f"[i] Profile written → {path}", file=sys.stderr)
+
+    atexit.register(_dump)
+
+
+setup(os.environ.get("SP_PROFILE"), os.environ.get("SP_TRACE"))
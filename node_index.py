@@ -0,0 +1,254 @@
+from __future__ import annotations
+import bisect, itertools, re
+from collections.abc import Mapping
+from pathlib import Path
+import numpy as np
+from db_parser import l2_line_code
+from graph_cache import StringTable, _source_entry, intern_strings, open_arrays, read_header, write_arrays
+from instrument import count, phase
+
+# ---------- ノード索引 (状態ハッシュ / L1 コード / L2 コード → ノード番号) ------
+#
+# グラフキャッシュ (xxx_graph.csr) の隣に xxx_graph_index.idx として保存する。
+# 形式はキャッシュと同じ (ヘッダ + 64 byte 境界の配列群) で、mmap で開く。
+#   hash_hi / hash_bytes / hash_kind / hash_target : SHA-1 を上位 8 byte の昇順に並べた表
+#       (kind 1 = L1 状態 → ノード番号, kind 2 = L2 状態 → l2 表の行)
+#   l1_blob / l1_offsets / l1_node : 正規化 L1 コードの昇順表 (同じコードの状態は複数行)
+#   l2_blob / l2_offsets / l2_indptr / l2_nodes : 正規化 L2 コードの昇順表と所属 L1 ノード
+# 引きはいずれも二分探索 (O(log n)) で、L2 コードは前方一致でもまとめて引ける。
+# コードは空白と "|" を除いて比較する (描画ラベルでは "|" が改行になっているため)。
+# L1 状態ハッシュは ROBOT_DB_L1.txt 形式のファイル (--l1-db) から、L2 状態ハッシュは L2 DB から取る。
+
+INDEX_VERSION = 1
+HASH_L1, HASH_L2 = 1, 2
+_HEX40 = re.compile(r"[0-9A-Fa-f]{40}")
+_NORM = re.compile(r"[\s|]+")
+
+
+def norm_code(code: str) -> str:
+    return _NORM.sub("", code)
+
+
+def index_path(cache_path: Path) -> Path:
+    stem = cache_path.with_suffix("")
+    return stem.with_name(f"{stem.name}_index.idx")
+
+
+def default_l1_db(l1l2_path: Path) -> Path | None:
+    """L1-L2 DB と同じディレクトリの <prefix>_L1_DB.txt / ROBOT_DB_L1.txt (無ければ None)"""
+    prefix = l1l2_path.name.split("_L1-L2_DB")[0]
+    for name in (f"{prefix}_L1_DB.txt", "ROBOT_DB_L1.txt"):
+        if (l1l2_path.parent / name).exists():
+            return l1l2_path.parent / name
+    return None
+
+
+# ---------- 構築 ------------------------------------------------------
+
+def _node_lines(path: Path):
+    """先頭行 "N # number of nodes" に続く N 行のノード行"""
+    with path.open(encoding="utf-8") as f:
+        n = int(f.readline().split()[0])
+        yield from itertools.islice(f, n)
+
+
+def _read_l1_hashes(l1_db: Path, l1_code: dict[int, str], log=None) -> tuple[list[bytes], list[int]]:
+    """L1 DB のノード行 "id HASH encode_ver: .., encode_level: 1 | code\\tConnected .." から (ハッシュ, ノード番号)"""
+    digests, nodes, skipped = [], [], 0
+    for ln in _node_lines(l1_db):
+        sp = ln.split(None, 2)
+        if len(sp) < 3 or not _HEX40.fullmatch(sp[1]):
+            continue
+        nid, rest = int(sp[0]), sp[2]
+        code = rest[rest.find("|", rest.find("encode_level")) + 1:].split("\t", 1)[0]
+        if l1_code.get(nid) != norm_code(code):   # 番号の振り方が L1-L2 DB と違う行は使わない
+            skipped += 1
+            continue
+        digests.append(bytes.fromhex(sp[1]))
+        nodes.append(nid)
+    if skipped:
+        print(f"[i] {skipped} L1 hashes in {l1_db.name} skipped (code differs from the L1-L2 DB)", file=log)
+    return digests, nodes
+
+
+def _read_l2_hashes(l2_path: Path, l2_row: dict[str, int]) -> tuple[list[bytes], list[int]]:
+    digests, rows = [], []
+    for ln in _node_lines(l2_path):
+        sp = ln.split(None, 2)
+        if len(sp) < 3 or not _HEX40.fullmatch(sp[1]):
+            continue
+        row = l2_row.get(norm_code(l2_line_code(ln)[1]))
+        if row is not None:                       # 所属 L1 ノードの無い L2 状態は引けなくてよい
+            digests.append(bytes.fromhex(sp[1]))
+            rows.append(row)
+    return digests, rows
+
+
+def _string_table(strings: list[str]) -> tuple[np.ndarray, np.ndarray]:
+    blob, offsets, _ = intern_strings(strings)
+    return blob, offsets
+
+
+def build_index(node_labels: Mapping[int, str], L1num_to_L2code: Mapping[int, str], l2_path: Path,
+                l1_db: Path | None = None, *, log=None) -> dict[str, np.ndarray]:
+    """索引の配列群を作る (node_labels は "# id\\nL1\\nL2" 形式)"""
+    with phase("index.build"):
+        # L1 コード (重複あり): (コード, ノード番号) 順
+        l1_code = {nid: norm_code("".join(label.split("\n")[1:-1])) for nid, label in node_labels.items()}
+        l1_sorted = sorted((code, nid) for nid, code in l1_code.items())
+
+        # L2 コード: 昇順の一意な表と所属ノード
+        l2_of = {nid: norm_code(code) for nid, code in L1num_to_L2code.items()}
+        l2_codes = sorted(set(l2_of.values()))
+        l2_row = {c: i for i, c in enumerate(l2_codes)}
+        nodes = np.fromiter(l2_of, dtype=np.int64, count=len(l2_of))
+        rows = np.fromiter((l2_row[c] for c in l2_of.values()), dtype=np.int64, count=len(l2_of))
+        order = np.lexsort((nodes, rows))
+        l2_indptr = np.zeros(len(l2_codes) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(rows, minlength=len(l2_codes)), out=l2_indptr[1:])
+
+        # 状態ハッシュ
+        d1, n1 = _read_l1_hashes(l1_db, l1_code, log) if l1_db is not None else ([], [])
+        d2, r2 = _read_l2_hashes(l2_path, l2_row)
+        digests = d1 + d2
+        H = np.frombuffer(b"".join(digests), dtype=np.uint8).reshape(-1, 20)
+        hi = H[:, :8].copy().view(">u8").ravel().astype(np.uint64)
+        horder = np.argsort(hi, kind="stable")
+
+        l1_blob, l1_offsets = _string_table([c for c, _ in l1_sorted])
+        l2_blob, l2_offsets = _string_table(l2_codes)
+        count("index.hashes", len(digests))
+        return {
+            "hash_hi": hi[horder],
+            "hash_bytes": H[horder],
+            "hash_kind": np.asarray([HASH_L1] * len(d1) + [HASH_L2] * len(d2), dtype=np.uint8)[horder],
+            "hash_target": np.asarray(n1 + r2, dtype=np.int32)[horder],
+            "l1_blob": l1_blob, "l1_offsets": l1_offsets,
+            "l1_node": np.asarray([nid for _, nid in l1_sorted], dtype=np.int32),
+            "l2_blob": l2_blob, "l2_offsets": l2_offsets,
+            "l2_indptr": l2_indptr, "l2_nodes": nodes[order].astype(np.int32),
+        }
+
+
+# ---------- 問い合わせ ------------------------------------------------
+
+class NodeIndex:
+    """状態ハッシュ / L1 コード / L2 コード (前方一致) → ノード番号列"""
+
+    def __init__(self, arrays: dict[str, np.ndarray]):
+        self.arrays = arrays
+        self.l1 = StringTable(arrays["l1_blob"], arrays["l1_offsets"])
+        self.l2 = StringTable(arrays["l2_blob"], arrays["l2_offsets"])
+
+    def _l2_members(self, lo: int, hi: int) -> list[int]:
+        a = self.arrays
+        return sorted(a["l2_nodes"][a["l2_indptr"][lo]:a["l2_indptr"][hi]].tolist())
+
+    def hash(self, hexdigest: str) -> list[int]:
+        """SHA-1 状態ハッシュ (16 進 40 桁)。L1 状態なら 1 ノード、L2 状態なら所属ノード全て"""
+        a = self.arrays
+        d = bytes.fromhex(hexdigest)
+        key = np.uint64(int.from_bytes(d[:8], "big"))
+        for i in range(int(np.searchsorted(a["hash_hi"], key, "left")), int(np.searchsorted(a["hash_hi"], key, "right"))):
+            if bytes(a["hash_bytes"][i]) == d:
+                target = int(a["hash_target"][i])
+                return [target] if a["hash_kind"][i] == HASH_L1 else self._l2_members(target, target + 1)
+        return []
+
+    def l1_code(self, code: str) -> list[int]:
+        key = norm_code(code)
+        lo, hi = bisect.bisect_left(self.l1, key), bisect.bisect_right(self.l1, key)
+        return sorted(self.arrays["l1_node"][lo:hi].tolist())
+
+    def l2_class(self, nid: int) -> list[int]:
+        """ノード nid と同じ L2 クラスに属する全ノード (nid 自身を含む)"""
+        a = self.arrays
+        pos = np.flatnonzero(a["l2_nodes"] == nid)
+        if not len(pos):
+            return []
+        row = int(np.searchsorted(a["l2_indptr"], pos[0], "right")) - 1
+        return self._l2_members(row, row + 1)
+
+    def l2_code(self, code: str, *, prefix: bool = False) -> list[int]:
+        """L2 コードの所属ノード。prefix=True では code で始まる全 L2 コードの所属ノード"""
+        key = norm_code(code)
+        lo = bisect.bisect_left(self.l2, key)
+        hi = bisect.bisect_left(self.l2, key + "\U0010ffff") if prefix else bisect.bisect_right(self.l2, key)
+        return self._l2_members(lo, hi)
+
+    def resolve(self, ident: str) -> list[int]:
+        """ノード指定を番号列に解決する
+
+        "123" ノード番号 / 16 進 40 桁 状態ハッシュ / "l1:CODE" "l2:CODE" コード /
+        "CODE" L1 コード (無ければ L2 コード) / "CODE*" L2 コードの前方一致 /
+        "class:123" ノード 123 と同じ L2 クラスの全ノード。カンマ区切りは和集合 (昇順)。
+        """
+        if "," in ident:
+            return sorted(set(itertools.chain.from_iterable(self.resolve(x) for x in ident.split(",") if x.strip())))
+        ident = ident.strip()
+        kind, _, rest = ident.partition(":")
+        if _HEX40.fullmatch(ident):
+            nodes = self.hash(ident)
+        elif ident.isdigit():
+            return [int(ident)]
+        elif kind == "class" and rest.strip().isdigit():
+            nodes = self.l2_class(int(rest))
+        elif ident.endswith("*"):
+            nodes = self.l2_code(ident[:-1].removeprefix("l2:"), prefix=True)
+        elif kind in ("l1", "l2"):
+            nodes = self.l1_code(rest) if kind == "l1" else self.l2_code(rest)
+        else:
+            nodes = self.l1_code(ident) or self.l2_code(ident)
+        if not nodes:
+            raise ValueError(f"no node matches {ident!r}")
+        count("index.lookups")
+        return nodes
+
+
+def resolve_plain(ident: str) -> list[int] | None:
+    """索引なしで解決できる指定 (ノード番号とそのカンマ区切り) ならその番号列、そうでなければ None"""
+    parts = [x.strip() for x in ident.split(",") if x.strip()]
+    if not parts or not all(x.isdigit() and not _HEX40.fullmatch(x) for x in parts):
+        return None
+    return [int(parts[0])] if len(parts) == 1 else sorted({int(x) for x in parts})
+
+
+# ---------- 保存 / 読込 -----------------------------------------------
+
+def _graph_key(cache_header: dict) -> dict:
+    fp = cache_header["fingerprint"]
+    return {"l1l2": fp["l1l2"]["sha1"], "l2": fp["l2"]["sha1"]}
+
+
+def load_index(path: Path, graph_key: dict | None = None, l1_db_entry: dict | None = None) -> NodeIndex | None:
+    """索引ファイルを開く。graph_key / L1 DB が記録と違う (古い) 場合は None"""
+    head = read_header(path) if path.exists() else None
+    if head is None or head[0].get("kind") != "node_index" or head[0].get("index_version") != INDEX_VERSION:
+        return None
+    header, data_start = head
+    if graph_key is not None and header["graph"] != graph_key:
+        return None
+    if (header["l1_db"] or {}).get("sha1") != (l1_db_entry or {}).get("sha1"):
+        return None
+    with phase("index.load"):
+        return NodeIndex(open_arrays(path, header, data_start))
+
+
+def open_index(cache_path: Path, node_labels: Mapping[int, str], L1num_to_L2code: Mapping[int, str], l2_path: Path,
+               l1_db: Path | None = None, *, log=None) -> NodeIndex:
+    """キャッシュ隣の索引を開く (無い/古い場合は作って保存)。*.pkl キャッシュではメモリ上に作るだけ"""
+    if cache_path.suffix == ".pkl":
+        return NodeIndex(build_index(node_labels, L1num_to_L2code, l2_path, l1_db, log=log))
+    cache_head = read_header(cache_path)
+    graph_key = _graph_key(cache_head[0]) if cache_head else None
+    path = index_path(cache_path)
+    prev = read_header(path) if path.exists() else None
+    entry = _source_entry(l1_db, (prev[0].get("l1_db") if prev else None)) if l1_db is not None else None
+    index = load_index(path, graph_key, entry)
+    if index is not None:
+        return index
+    arrays = build_index(node_labels, L1num_to_L2code, l2_path, l1_db, log=log)
+    write_arrays(path, arrays, {"kind": "node_index", "index_version": INDEX_VERSION, "graph": graph_key,
+                                "l1_db": entry})
+    print(f"[+] Node index written → {path.name} ({len(arrays['hash_hi'])} hashes)", file=log)
+    return load_index(path, graph_key, entry)
@@ -0,0 +1,122 @@
+from __future__ import annotations
+import json
+from pathlib import Path
+import numpy as np
+import igraph as ig
+from Common_Utility import edge_arrays
+from instrument import phase
+
+# ---------- 全点対最短距離オラクル ----------------------------------
+#
+# グラフキャッシュ (xxx_graph.pkl) の隣に、レイヤ毎の距離行列 (float32) と
+# 先行ノード行列 (int32, 到達不能/始点は -1) を .npy で保存する。
+# 行ブロック単位で計算して open_memmap に書き込むため、行列全体を
+# メモリに載せずに構築でき、読込も mmap で行う。
+
+LAYERS = ("black", "full")
+
+
+def oracle_paths(cache_path: Path, layer: str) -> tuple[Path, Path]:
+    """レイヤの (距離, 先行ノード) .npy ファイルパス"""
+    stem = cache_path.with_suffix("")
+    return (stem.with_name(f"{stem.name}_apsp_{layer}_dist.npy"),
+            stem.with_name(f"{stem.name}_apsp_{layer}_pred.npy"))
+
+
+def _meta_path(cache_path: Path, layer: str) -> Path:
+    stem = cache_path.with_suffix("")
+    return stem.with_name(f"{stem.name}_apsp_{layer}.json")
+
+
+def oracle_hash(cache_path: Path, layer: str) -> str | None:
+    """行列を計算したときのレイヤ内容ハッシュ (記録が無ければ None)"""
+    try:
+        return json.loads(_meta_path(cache_path, layer).read_text())["layer_hash"]
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def drop_oracle(cache_path: Path, layer: str) -> None:
+    for p in (*oracle_paths(cache_path, layer), _meta_path(cache_path, layer)):
+        p.unlink(missing_ok=True)
+
+
+def build_oracle(G: ig.Graph, cache_path: Path, layer: str = "full", *, block: int = 1024,
+                 layer_hash: str | None = None) -> tuple[Path, Path]:
+    """layer の全点対最短距離と先行ノード行列を計算して保存
+
+    layer_hash (キャッシュヘッダのレイヤ内容ハッシュ) を渡すと併せて記録し、
+    グラフ更新後に行列が古いかどうかを判定できるようにする。
+    """
+    with phase("oracle.build", layer=layer, nodes=G.vcount()):
+        return _build_oracle(G, cache_path, layer, block, layer_hash)
+
+
+def _build_oracle(G: ig.Graph, cache_path: Path, layer: str, block: int, layer_hash: str | None) -> tuple[Path, Path]:
+    from scipy.sparse import csr_matrix
+    from scipy.sparse.csgraph import dijkstra
+
+    n = G.vcount()
+    u, v, w = edge_arrays(G, layer)
+    M = csr_matrix((w, (u, v)), shape=(n, n))
+
+    dist_path, pred_path = oracle_paths(cache_path, layer)
+    dist = np.lib.format.open_memmap(dist_path, mode="w+", dtype=np.float32, shape=(n, n))
+    pred = np.lib.format.open_memmap(pred_path, mode="w+", dtype=np.int32, shape=(n, n))
+    for lo in range(0, n, block):
+        rows = np.arange(lo, min(lo + block, n))
+        d, p = dijkstra(M, directed=False, indices=rows, return_predecessors=True)
+        dist[lo:lo + len(rows)] = d
+        pred[lo:lo + len(rows)] = np.where(p < 0, -1, p)
+    dist.flush()
+    pred.flush()
+    del dist, pred
+    meta = _meta_path(cache_path, layer)
+    if layer_hash is not None:
+        meta.write_text(json.dumps({"layer": layer, "layer_hash": layer_hash}))
+    else:
+        meta.unlink(missing_ok=True)
+    print(f"[+] APSP ({layer}) written → {dist_path.name}, {pred_path.name}")
+    return dist_path, pred_path
+
+
+class PathOracle:
+    """保存済み距離/先行ノード行列への O(1) 距離・O(経路長) 経路問い合わせ"""
+
+    def __init__(self, dist: np.ndarray, pred: np.ndarray):
+        self.dist = dist
+        self.pred = pred
+
+    @classmethod
+    def load(cls, cache_path: Path, layer: str = "full") -> PathOracle:
+        dist_path, pred_path = oracle_paths(cache_path, layer)
+        return cls(np.load(dist_path, mmap_mode="r"), np.load(pred_path, mmap_mode="r"))
+
+    @staticmethod
+    def exists(cache_path: Path, layer: str = "full", layer_hash: str | None = None) -> bool:
+        """行列が存在し、layer_hash 指定時はそのグラフ内容から計算されたものか"""
+        if not all(p.exists() for p in oracle_paths(cache_path, layer)):
+            return False
+        return layer_hash is None or oracle_hash(cache_path, layer) == layer_hash
+
+    def distance(self, s: int, t: int) -> float:
+        return float(self.dist[s, t])
+
+    def path(self, s: int, t: int) -> list[int]:
+        """s→t の最短経路 1 本 (到達不能なら空)"""
+        if s == t:
+            return [s]
+        if not np.isfinite(self.dist[s, t]):
+            return []
+        row = self.pred[s]
+        rev = [t]
+        while rev[-1] != s:
+            rev.append(int(row[rev[-1]]))
+        return rev[::-1]
+
+    def distances(self, starts, goals) -> np.ndarray:
+        """(start, goal) 配列に対する距離をまとめて返す"""
+        return np.asarray(self.dist[np.asarray(starts), np.asarray(goals)])
+
+    def paths(self, starts, goals) -> list[list[int]]:
+        return [self.path(int(s), int(t)) for s, t in zip(starts, goals)]
@@ -0,0 +1,24 @@
+from __future__ import annotations
+import argparse
+from collections.abc import Sequence
+
+# ---------- 問い合わせ引数 (shortest_path_.py / query_client.py 共通) ---
+#
+# 始点・終点と探索オプションの定義を 1 か所にまとめる。query_client.py は標準ライブラリだけで
+# 動かすので、ここでは igraph を読み込むモジュールを import しない。終点集合モードと
+# バックエンドの選択肢は呼び出し側が渡す (None なら検証はサーバ側に任せる)。
+
+
+def add_query_args(p: argparse.ArgumentParser, *, goal_modes: Sequence[str] | None = None,
+                   backends: Sequence[str] | None = None, default_backend: str | None = None) -> None:
+    """-s / -g / --goal-mode / -k / --hier / --corridor / --backend / --max-expansions / --weights / --plan を足す"""
+    p.add_argument("-s", "--start", default="0",  help="Start node: id, state hash, L1/L2 code, or L2-code prefix ending in '*'")
+    p.add_argument("-g", "--goal",  default="25", help="Goal node (same forms as --start); several nodes, e.g. '5,77' or 'class:42', form a goal set")
+    p.add_argument("--goal-mode", choices=goal_modes, default="nearest", help="Goal sets: paths to the nearest goal(s), or distances to every goal")
+    p.add_argument("-k", "--k_paths", type=int, default=10)
+    p.add_argument("--hier", action="store_true", help="Use L2-guided A* search for L1 paths (exact)")
+    p.add_argument("--corridor", type=float, default=None, help="Restrict L1 search to L2 corridor within this slack (approximate, implies --hier)")
+    p.add_argument("--backend", choices=backends, default=default_backend, help="Search engine for L1 / L1+L2 paths (--hier replaces the L1 search)")
+    p.add_argument("--max-expansions", type=int, default=None, help="Stop L1 path enumeration after this many node expansions")
+    p.add_argument("--weights", default=None, metavar="SPEC", help="Edge weights applied at query time: a profile name (default, uniform, free_blue) and/or overrides like 'red=2,blue=0.25'")
+    p.add_argument("--plan", action="store_true", help="Headless/batch: include the action plan (operation, ports, direction) for every path")
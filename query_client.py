@@ -0,0 +1,109 @@
+from __future__ import annotations
+import argparse, http.client, json, socket, sys
+from urllib.parse import urlencode, urlparse
+from query_args import add_query_args
+
+# ---------- クエリサーバ用クライアント --------------------------------
+#
+# 標準ライブラリだけで query_server.py に問い合わせる薄い CLI。
+# 始点・終点と探索オプションは shortest_path_.py と同じ定義 (query_args.add_query_args) で、
+# -s / -g は状態ハッシュやコードもそのままサーバへ渡す (解決はサーバのノード索引)。
+# 終点集合モードとバックエンドの選択肢はサーバが検証する。
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, path: str, timeout: float | None = None):
+        super().__init__("localhost", timeout=timeout)
+        self.unix_path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.unix_path)
+
+
+def query(server: str, params: dict, *, timeout: float | None = 30.0) -> tuple[int, dict]:
+    """server ("http://host:port" または Unix ソケットのパス) に /paths を問い合わせる"""
+    if server.startswith("http://"):
+        url = urlparse(server)
+        conn = http.client.HTTPConnection(url.hostname, url.port or 80, timeout=timeout)
+    else:
+        conn = UnixHTTPConnection(server, timeout=timeout)
+    try:
+        conn.request("GET", "/paths?" + urlencode(params))
+        resp = conn.getresponse()
+        return resp.status, json.loads(resp.read())
+    finally:
+        conn.close()
+
+
+def cli() -> argparse.Namespace:
+    p = argparse.ArgumentParser(description="Client for query_server.py.")
+    p.add_argument("--server", default="http://127.0.0.1:8765", help="Server URL or Unix socket path")
+    p.add_argument("--prefix", default=None, help="Graph prefix on a --catalog server (default: the server's)")
+    add_query_args(p)
+    p.add_argument("--format", choices=("json", "text"), default="text", help="Print the raw JSON response, or paths as text")
+    p.add_argument("--json", dest="format", action="store_const", const="json", help="Same as --format json")
+    return p.parse_args()
+
+
+def request_params(args: argparse.Namespace) -> dict:
+    """CLI 引数 → /paths のクエリ (既定値のものは送らずサーバの既定に任せる)"""
+    params = {"start": args.start, "goal": args.goal, "k": args.k_paths}
+    if args.hier:
+        params["hier"] = 1
+    if args.plan:
+        params["plan"] = 1
+    for key in ("corridor", "max_expansions", "weights", "backend", "prefix"):
+        if getattr(args, key) is not None:
+            params[key] = getattr(args, key)
+    if args.goal_mode != "nearest":
+        params["goal_mode"] = args.goal_mode
+    return params
+
+
+def print_paths(res: dict) -> None:
+    """1 始点分の応答を shortest_path_.py --format text に近い形で出す (色とコストは応答に無いので省く)"""
+    if res.get("mode") == "all":
+        for row in res["distances"]:
+            print(f"goal {row['goal']}: unreachable" if row["path"] is None
+                  else f"goal {row['goal']}: cost={row['cost']:g}  {row['path']}")
+            if row.get("plan"):
+                print(plan_lines(row["plan"]))
+        return
+    if res.get("l1_stopped") in ("time", "expansions"):
+        print(f"[i] Enumeration cut off by {res['l1_stopped']} budget", file=sys.stderr)
+    if "nearest" in res:
+        print(f"nearest  {', '.join(map(str, res['nearest'])) or '-'} of {res['goal_count']} goals")
+    for name, key in (("L1", "l1"), ("L1+L2", "l1l2")):
+        plans = res.get(f"{key}_plans")
+        for i, p in enumerate(res[f"{key}_paths"], 1):
+            print(f"{name:<8} {i}: {p}")
+            if plans:
+                print(plan_lines(plans[i - 1]))
+
+
+def plan_lines(plan: list[dict]) -> str:
+    """操作プランの 1 手 1 行表記 (Common_Utility.plan_str と同じ)"""
+    lines = []
+    for i, st in enumerate(plan, 1):
+        what = st["action"] or f"({st['edge'] or 'no edge'})"
+        rev = "  [reverse]" if st["direction"] == "reverse" else ""
+        lines.append(f"{i:3d}. {st['from']} -> {st['to']}: {what}{rev}")
+    return "\n".join(lines)
+
+
+def main():
+    args = cli()
+    status, body = query(args.server, request_params(args))
+    if args.format == "json" or status != 200:
+        print(json.dumps(body))
+        sys.exit(0 if status == 200 else 1)
+    for res in body.get("results", [body]):
+        if "results" in body:
+            print(f"start {res['start']}")
+        print_paths(res)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,215 @@
+from __future__ import annotations
+import argparse, itertools, json, os, socketserver, sys, time
+from concurrent.futures import ThreadPoolExecutor, wait
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import parse_qs, urlparse
+from batch_query import solve, solve_goal_set
+from Common_Utility import GOAL_MODES, parse_weights
+from graph_catalog import CatalogEntry, GraphCatalog, ResidentGraph, budget_bytes
+from node_index import default_l1_db
+from search_backends import get_backend
+from shortest_path_ import load_graph, resolve_paths
+
+# ---------- 常駐クエリサーバ ------------------------------------------
+#
+# グラフを 1 度だけ読み込み、localhost HTTP または Unix ドメインソケットで
+# GET /paths?start=..&goal=..&k=..[&hier=1][&corridor=..][&max_expansions=..][&weights=..][&plan=1][&backend=..]
+# [&goal_mode=nearest|all] に JSON で答える。
+# weights は重みプロファイル名か black=..,red=..,blue=.. の上書き (Common_Utility.parse_weights)。
+# plan=1 で各経路の操作プラン (operation / ports / direction) も返す。backend= で探索バックエンドを選ぶ
+# (search_backends.BACKENDS、既定 native)。
+# 各リクエストはスレッドプールで解き、timeout 秒を超えたら 504 を返す。
+# start / goal はノード番号のほか状態ハッシュ・L1/L2 コード・L2 コード前方一致 ("...*")・
+# "class:番号"・カンマ区切りも受け付ける (node_index.NodeIndex.resolve)。goal が複数ノードなら
+# 終点集合として始点毎に 1 回の探索で解き (batch_query.solve_goal_set)、start が複数ノードなら
+# 始点毎の結果 (MAX_STARTS まで) を results で返す。
+# --catalog DIR では DIR 内の全プレフィックス (graph_catalog) を扱い、prefix= で問い合わせ先の
+# グラフを選ぶ (既定は --prefix)。未読込のグラフはそのリクエストで読み込み、--memory-budget を
+# 超えた分は使われていない順に手放す。GET /health は常駐グラフと読込/追い出し回数を返す。
+# 探索結果はグラフ毎の結果キャッシュ (result_cache) で再利用し、その hit/miss も /health に出す。
+
+MAX_STARTS = 64
+
+
+class QueryService:
+    """グラフカタログと探索用スレッドプール"""
+
+    def __init__(self, catalog: GraphCatalog, default_prefix: str, *, workers: int = 4, timeout: float = 10.0,
+                 quiet: bool = False):
+        self.catalog = catalog
+        self.default_prefix = default_prefix
+        self.quiet = quiet
+        self.timeout = timeout
+        self.pool = ThreadPoolExecutor(max_workers=workers)
+
+    def health(self) -> dict:
+        return {"status": "ok", "default_prefix": self.default_prefix, **self.catalog.status()}
+
+    def query(self, params: dict[str, str]) -> tuple[int, dict]:
+        try:
+            start, goal = params["start"], params["goal"]
+            k = int(params.get("k", 10))
+            corridor = float(params["corridor"]) if "corridor" in params else None
+            max_exp = int(params["max_expansions"]) if "max_expansions" in params else None
+            weights = parse_weights(params.get("weights"))
+            backend = get_backend(params.get("backend")).name
+            goal_mode = params.get("goal_mode", "nearest")
+            if goal_mode not in GOAL_MODES:
+                raise ValueError(f"unknown goal_mode {goal_mode!r}")
+        except (KeyError, ValueError) as exc:
+            return 400, {"error": f"bad query: {exc}"}
+        k = k if k > 0 else None
+        try:
+            graph = self.catalog.get(params.get("prefix") or self.default_prefix)
+        except ValueError as exc:
+            return 404, {"error": str(exc)}
+        G = graph.G
+        use_hier = params.get("hier", "0") not in ("0", "") or corridor is not None
+        plan = params.get("plan", "0") not in ("0", "")
+        try:
+            starts, goals = graph.resolve(start), graph.resolve(goal)
+        except ValueError as exc:
+            return 404, {"error": str(exc)}
+        for v in itertools.chain(starts, goals):
+            if not 0 <= v < G.vcount():
+                return 404, {"error": f"unknown node id: {v}"}
+        if len(starts) > MAX_STARTS:
+            return 400, {"error": f"start expands to {len(starts)} nodes (limit {MAX_STARTS})"}
+
+        t0 = time.perf_counter()
+        # 列挙自体も timeout で打ち切らせ、504 後にスレッドが走り続けないようにする
+        opts = dict(weights=weights, time_limit=self.timeout, max_expansions=max_exp, plan=plan, backend=backend,
+                    cache=graph.results())
+        if len(goals) == 1:
+            futs = [self.pool.submit(solve, G, s, goals[0], k, hier=graph.hier if use_hier else None,
+                                     corridor=corridor, **opts) for s in starts]
+        else:
+            futs = [self.pool.submit(solve_goal_set, G, s, goals, k, mode=goal_mode, **opts) for s in starts]
+        _, pending = wait(futs, timeout=self.timeout)
+        if pending:
+            for fut in pending:
+                fut.cancel()
+            return 504, {"error": f"query timed out after {self.timeout:g}s"}
+        results = [fut.result() for fut in futs]
+        if len(starts) == 1:
+            res = results[0]
+        else:
+            res = {"start": start, "goal": goal, "start_nodes": starts, "goal_count": len(goals), "results": results}
+        res["prefix"] = graph.prefix
+        res["elapsed_ms"] = round((time.perf_counter() - t0) * 1e3, 3)
+        return 200, res
+
+
+def make_handler(service: QueryService) -> type[BaseHTTPRequestHandler]:
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            if url.path == "/health":
+                status, body = 200, service.health()
+            elif url.path == "/paths":
+                params = {key: vals[-1] for key, vals in parse_qs(url.query).items()}
+                status, body = service.query(params)
+            else:
+                status, body = 404, {"error": f"unknown endpoint {url.path}"}
+            data = json.dumps(body).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def address_string(self) -> str:
+            return self.client_address[0] if isinstance(self.client_address, tuple) else "unix"
+
+        def log_message(self, fmt, *args):
+            if not service.quiet:
+                super().log_message(fmt, *args)
+
+    return Handler
+
+
+class ThreadingUnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def get_request(self):
+        conn, _ = super().get_request()
+        return conn, ("unix", 0)
+
+
+def make_server(service: QueryService, *, host: str = "127.0.0.1", port: int = 8765,
+                unix_socket: str | None = None) -> socketserver.BaseServer:
+    handler = make_handler(service)
+    if unix_socket:
+        if os.path.exists(unix_socket):
+            os.unlink(unix_socket)
+        return ThreadingUnixHTTPServer(unix_socket, handler)
+    return ThreadingHTTPServer((host, port), handler)
+
+
+# ---------- CLI -------------------------------------------------------
+def cli() -> argparse.Namespace:
+    p = argparse.ArgumentParser(description="Resident shortest-path query server.")
+    p.add_argument("--l1l2", default="1020000_L1-L2_DB.txt", help="L1-L2 DB file path")
+    p.add_argument("--l2",   default="1020000_L2_DB.txt",    help="L2 DB file path")
+    p.add_argument("-c", "--cache", default=None, help="Cache file (default: auto, <prefix>_graph.csr; *.pkl = legacy Pickle)")
+    p.add_argument("--implicit-l2", action="store_true", help="Build cache with implicit red/blue L2 edges")
+    p.add_argument("--l1-db", default=None, metavar="FILE", help="L1 DB with state hashes for the node index (default: <prefix>_L1_DB.txt or ROBOT_DB_L1.txt beside --l1l2)")
+    p.add_argument("--catalog", default=None, metavar="DIR", help="Serve every <prefix>_L1-L2_DB.txt / <prefix>_L2_DB.txt pair in DIR (select with prefix=)")
+    p.add_argument("--prefix", default=None, help="Default graph prefix with --catalog (default: the first found)")
+    p.add_argument("--memory-budget", type=float, default=None, metavar="MB", help="Evict least recently used graphs beyond this estimated size")
+    p.add_argument("--no-result-cache", action="store_true", help="Do not reuse path results (<stem>_<suffix>_results.sqlite beside each graph cache)")
+    p.add_argument("--host", default="127.0.0.1")
+    p.add_argument("--port", type=int, default=8765)
+    p.add_argument("--socket", default=None, help="Serve on this Unix-domain socket instead of TCP")
+    p.add_argument("--workers", type=int, default=4, help="Concurrent search threads")
+    p.add_argument("--timeout", type=float, default=10.0, help="Per-request timeout in seconds")
+    p.add_argument("-q", "--quiet", action="store_true", help="Do not log each request")
+    return p.parse_args()
+
+
+def main():
+    args = cli()
+    budget = budget_bytes(args.memory_budget)
+    if args.catalog:
+        catalog = GraphCatalog.scan(Path(args.catalog).expanduser().resolve(), memory_budget=budget,
+                                    implicit_l2=args.implicit_l2 or None, result_cache=not args.no_result_cache)
+        if not catalog.prefixes():
+            sys.exit(f"[!] no L1-L2 / L2 DB pairs in {args.catalog}")
+        prefix = args.prefix or catalog.prefixes()[0]
+        try:
+            graph = catalog.get(prefix)
+        except ValueError as exc:
+            sys.exit(f"[!] {exc}")
+        name = f"{len(catalog.prefixes())} graphs from {args.catalog}"
+    else:
+        l1l2_path, l2_path, cache_path = resolve_paths(args)
+        G, node_labels, L1num_to_L2code = load_graph(l1l2_path, l2_path, cache_path, implicit_l2=args.implicit_l2)
+        l1_db = Path(args.l1_db).expanduser().resolve() if args.l1_db else default_l1_db(l1l2_path)
+        graph = ResidentGraph(CatalogEntry(args.prefix or cache_path.stem.removesuffix("_graph"), l1l2_path, l2_path,
+                                           cache_path, l1_db), G, node_labels, L1num_to_L2code,
+                              result_cache=not args.no_result_cache)
+        catalog = GraphCatalog({}, memory_budget=budget)
+        catalog.put(graph)
+        prefix, name = graph.prefix, cache_path.name
+    graph.index()   # 索引の構築/検証と結果キャッシュの整理は起動時に済ませる
+    graph.results()
+
+    service = QueryService(catalog, prefix, workers=args.workers, timeout=args.timeout, quiet=args.quiet)
+    server = make_server(service, host=args.host, port=args.port, unix_socket=args.socket)
+    where = args.socket or f"http://{args.host}:{args.port}"
+    print(f"[✓] Serving {name} on {where}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if args.socket and os.path.exists(args.socket):
+            os.unlink(args.socket)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,202 @@
+from __future__ import annotations
+import hashlib, itertools, os, threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+import igraph as ig
+from Common_Utility import PEN_L1, PEN_L2, Weights, colored_adjacency, is_implicit, l1l2_paths, l2_edges_among, path_str
+from instrument import count, phase
+
+# ---------- 描画パイプライン ------------------------------------------
+#
+# 1) 経路ノードの誘導部分グラフを隣接インデックスから取り出して DOT を組み立てる
+# 2) DOT ソースの SHA-1 をキーに描画キャッシュを引き、無ければ dot で描画する
+# 3) 描画は RenderQueue のスレッドプールで行い、問い合わせ側は待たない
+# 経路ノードが collapse_over を超える場合は L2 クラス毎のノードに畳んで描く。
+
+COLLAPSE_OVER = 200
+
+
+def induced_edges(G: ig.Graph, nodes: set[int]) -> list[tuple[int, int, str]]:
+    """nodes 内に両端を持つエッジ (u < v, color)。暗黙 L2 層も展開する"""
+    adj = colored_adjacency(G)
+    out = [(u, v, col) for u in sorted(nodes) if 0 <= u < len(adj)
+           for v, _, col in adj[u] if u < v and v in nodes]
+    if is_implicit(G):
+        out += [(min(u, v), max(u, v), col) for u, v, col in l2_edges_among(G, nodes)]
+    return sorted(out)
+
+
+def _edge_attrs(col: str, width: str) -> dict[str, str]:
+    attrs = {"color": col, "penwidth": width}
+    if col == "blue":
+        attrs["style"] = "dotted"
+    return attrs
+
+
+def build_dot(G: ig.Graph, labels, s: int, t: int, l1_paths: list[list[int]], l1l2: list[list[int]], *,
+              L1num_to_L2code: dict[int, str] | None = None, collapse_over: int | None = COLLAPSE_OVER) -> str:
+    """描画用 DOT ソース。ノード・エッジは番号順に並べ、同じ入力なら同じバイト列になる"""
+    with phase("render.dot_source", start=s, goal=t):
+        return _build_dot(G, labels, s, t, l1_paths, l1l2, L1num_to_L2code, collapse_over)
+
+
+def _build_dot(G: ig.Graph, labels, s: int, t: int, l1_paths: list[list[int]], l1l2: list[list[int]],
+               L1num_to_L2code: dict[int, str] | None, collapse_over: int | None) -> str:
+    import graphviz   # 描画時のみ読み込む
+
+    l1_nodes = set(itertools.chain.from_iterable(l1_paths))
+    l1e = {(min(u, v), max(u, v)) for p in l1_paths for u, v in zip(p, p[1:])}
+    l2e = [(u, v, col) for u, v, col in induced_edges(G, l1_nodes) if col != "black"]
+
+    gv = graphviz.Graph("L1_vs_L2", engine="dot")
+    if L1num_to_L2code is not None and collapse_over is not None and len(l1_nodes) > collapse_over:
+        _collapsed(gv, labels, l1_nodes, l1e, l2e, s, t, L1num_to_L2code)
+    else:
+        for n in sorted(l1_nodes):
+            fill = "green" if n == s else "red" if n == t else "white"
+            gv.node(str(n), label=labels.get(n, str(n)), style="filled", fillcolor=fill)
+        for u, v in sorted(l1e):
+            gv.edge(str(u), str(v), **_edge_attrs("black", PEN_L1))
+        for u, v, col in l2e:
+            gv.edge(str(u), str(v), **_edge_attrs(col, PEN_L2))
+
+    info = [f"L1       {i}: {path_str(G, p)}" for i, p in enumerate(l1_paths, 1)]
+    info += [f"L1+L2    {i}: {path_str(G, p)}" for i, p in enumerate(l1l2, 1)]
+    gv.node("info", label="\n".join(info), shape="plaintext", fontname="Courier")
+    gv.edge(str(s), "info", style="invis")
+    gv.attr(dpi="300", rankdir="TB", margin="0.3", nodesep="0.3", ranksep="0.3")
+    return gv.source
+
+
+def _collapsed(gv, labels, l1_nodes: set[int], l1e, l2e, s: int, t: int, L1num_to_L2code: dict[int, str]) -> None:
+    """始点・終点以外を L2 クラス毎の 1 ノードに畳み、クラス間エッジを本数付きで描く"""
+    codes = sorted({L1num_to_L2code.get(n, "?") for n in l1_nodes - {s, t}})
+    cid = {c: f"L2_{i}" for i, c in enumerate(codes)}
+
+    def key(n: int) -> str:
+        return str(n) if n in (s, t) else cid[L1num_to_L2code.get(n, "?")]
+
+    for n, fill in ((s, "green"), (t, "red")):
+        gv.node(str(n), label=labels.get(n, str(n)), style="filled", fillcolor=fill)
+    members: dict[str, int] = {}
+    for n in l1_nodes - {s, t}:
+        members[key(n)] = members.get(key(n), 0) + 1
+    for c in codes:
+        gv.node(cid[c], label=f"{c}\n({members[cid[c]]} nodes)", shape="box", style="filled", fillcolor="white")
+
+    counts: dict[tuple[str, str, str, str], int] = {}
+    for (u, v), col, width in itertools.chain(((e, "black", PEN_L1) for e in l1e),
+                                              (((u, v), col, PEN_L2) for u, v, col in l2e)):
+        a, b = sorted((key(u), key(v)))
+        if a != b:
+            counts[(a, b, col, width)] = counts.get((a, b, col, width), 0) + 1
+    for (a, b, col, width), c in sorted(counts.items()):
+        gv.edge(a, b, label=str(c) if c > 1 else None, **_edge_attrs(col, width))
+
+
+# ---------- 描画キャッシュ / キュー -----------------------------------
+
+class RenderCache:
+    """DOT ソースのハッシュ → 描画結果ファイル"""
+
+    def __init__(self, root: Path):
+        self.root = root
+
+    def path_for(self, source: str, fmt: str) -> Path:
+        digest = hashlib.sha1(f"{fmt}\0{source}".encode("utf-8")).hexdigest()
+        return self.root / f"{digest}.{fmt}"
+
+    def render(self, source: str, fmt: str = "pdf") -> tuple[Path, bool]:
+        """(キャッシュ上の描画結果, キャッシュに既にあったか)"""
+        import graphviz
+
+        path = self.path_for(source, fmt)
+        if path.exists():
+            count("render.cache_hits")
+            return path, True
+        self.root.mkdir(parents=True, exist_ok=True)
+        with phase("render.graphviz", format=fmt):
+            data = graphviz.Source(source, engine="dot").pipe(format=fmt, quiet=True)
+        count("render.rendered")
+        tmp = path.with_name(f"{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        tmp.write_bytes(data)
+        os.replace(tmp, path)
+        return path, False
+
+
+def _view(path: Path) -> None:
+    import graphviz
+    try:
+        graphviz.view(str(path))
+    except (OSError, RuntimeError):
+        pass
+
+
+class RenderQueue:
+    """描画ジョブを workers 本のスレッドで処理する。同じソースの同時描画は 1 回にまとめる"""
+
+    def __init__(self, cache_dir: Path, *, workers: int = 1, log=None):
+        self.cache = RenderCache(cache_dir)
+        self.pool = ThreadPoolExecutor(max_workers=max(workers, 1), thread_name_prefix="render")
+        self.log = log
+        self._lock = threading.Lock()
+        self._key_locks: dict[Path, list] = {}   # 描画先 → [Lock, 待ち数]。最後の利用者が外す
+        self.stats = {"rendered": 0, "cached": 0, "failed": 0}
+
+    def _render_once(self, source: str, fmt: str) -> tuple[Path, bool]:
+        """同じ描画先への描画を直列化する (ロックは使用中の描画先の分だけ持つ)"""
+        key = self.cache.path_for(source, fmt)
+        with self._lock:
+            entry = self._key_locks.setdefault(key, [threading.Lock(), 0])
+            entry[1] += 1
+        try:
+            with entry[0]:
+                return self.cache.render(source, fmt)
+        finally:
+            with self._lock:
+                entry[1] -= 1
+                if not entry[1]:
+                    del self._key_locks[key]
+
+    def _run(self, source: str, out: Path, fmt: str, view: bool) -> Path:
+        try:
+            cached, hit = self._render_once(source, fmt)
+            out.parent.mkdir(parents=True, exist_ok=True)
+            out.write_bytes(cached.read_bytes())
+        except Exception as exc:  # 1 件の描画失敗でキュー全体を止めない
+            with self._lock:
+                self.stats["failed"] += 1
+            print(f"[i] Render failed for {out.name}: {type(exc).__name__}: {exc}", file=self.log)
+            raise
+        with self._lock:
+            self.stats["cached" if hit else "rendered"] += 1
+        print(f"[+] rendered → {out}" + (" (cached)" if hit else ""), file=self.log)
+        if view:
+            _view(out)
+        return out
+
+    def submit(self, source: str, out: Path, *, fmt: str = "pdf", view: bool = False) -> Future:
+        return self.pool.submit(self._run, source, out, fmt, view)
+
+    def close(self) -> None:
+        self.pool.shutdown(wait=True)
+
+    def __enter__(self) -> RenderQueue:
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+def render_graph(queue: RenderQueue, G: ig.Graph, labels, s: int, t: int, l1_paths: list[list[int]],
+                 out_prefix: str, *, k: int | None = 10, l1l2: list[list[int]] | None = None,
+                 L1num_to_L2code: dict[int, str] | None = None, collapse_over: int | None = COLLAPSE_OVER,
+                 weights: Weights | None = None, view: bool = False, backend: str | None = None) -> Future:
+    """経路図の描画ジョブを queue に積む (l1l2 未指定なら L1 ノード上で weights により求める)"""
+    if l1l2 is None:
+        l1l2 = l1l2_paths(G, set(itertools.chain.from_iterable(l1_paths)), s, t, k or 5, weights=weights,
+                          backend=backend)
+    source = build_dot(G, labels, s, t, l1_paths, l1l2, L1num_to_L2code=L1num_to_L2code,
+                       collapse_over=collapse_over)
+    out = Path(out_prefix) / f"s{s}_g{t}_k{len(l1_paths)}.pdf"
+    return queue.submit(source, out, view=view)
@@ -0,0 +1,252 @@
+from __future__ import annotations
+import argparse, hashlib, json, sqlite3, sys, threading, time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Callable
+import numpy as np
+from Common_Utility import DEFAULT_WEIGHTS, Budget, Weights, l1_shortest_paths, l1l2_paths
+from graph_cache import file_digest, read_header
+
+# ---------- 経路探索結果のキャッシュ ------------------------------------
+#
+# L1 経路・L1+L2 経路の列挙結果 (と終点集合問い合わせの結果) を
+# (グラフ内容ハッシュ, 種別, start, goal, k, 重み, 探索オプション) をキーに再利用する。
+# メモリ上の LRU (JSON 文字列で持ち、取り出す度に新しいオブジェクトにする) と、
+# グラフキャッシュ隣の <stem>_<形式>_results.sqlite の 2 段。SQLite 側は合計サイズが max_bytes を
+# 超えたら最終使用時刻の古い順に消す。グラフキャッシュの内容が変わればキーが変わり、
+# 開いた時点で別のグラフ向けの行は捨てる。時間予算で打ち切られた結果は再現性が無いので保存しない。
+
+MEMORY_ITEMS = 4096
+MAX_BYTES = 256 << 20
+_EVICT_EVERY = 64   # 何件保存する毎にディスク側のサイズを確かめるか
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, graph TEXT NOT NULL, kind TEXT NOT NULL,
+                                    value TEXT NOT NULL, size INTEGER NOT NULL, used REAL NOT NULL);
+CREATE INDEX IF NOT EXISTS results_used ON results (used);
+"""
+
+
+def results_path(cache_path: Path) -> Path:
+    """<stem>_<形式>_results.sqlite (同じ DB の *.csr と *.pkl で結果を消し合わない)"""
+    stem = cache_path.with_suffix("")
+    return stem.with_name(f"{stem.name}_{cache_path.suffix.lstrip('.') or 'cache'}_results.sqlite")
+
+
+def graph_digest(cache_path: Path) -> str:
+    """グラフキャッシュの内容ハッシュ (入力 DB・レイヤ毎のエッジ内容・L2 モード。*.pkl はファイル自体)"""
+    head = read_header(cache_path) if cache_path.suffix != ".pkl" else None
+    if head is None:
+        return file_digest(cache_path)
+    fp = head[0]["fingerprint"]
+    key = {"l1l2": fp["l1l2"]["sha1"], "l2": fp["l2"]["sha1"], "implicit_l2": fp["implicit_l2"],
+           "weights": fp["weights"], "layers": head[0]["layer_hash"]}
+    return hashlib.sha1(json.dumps(key, sort_keys=True).encode()).hexdigest()
+
+
+def node_set_digest(nodes) -> str:
+    """ノード集合 (許可ノード・終点集合) のキー用ハッシュ"""
+    a = np.unique(np.fromiter(nodes, dtype=np.int64))
+    return hashlib.sha1(a.tobytes()).hexdigest()
+
+
+class ResultCache:
+    """メモリ LRU + SQLite の 2 段キャッシュ。path=None ならメモリのみ。スレッド間で共有してよい"""
+
+    def __init__(self, path: Path | None, graph: str, memory_items: int = MEMORY_ITEMS,
+                 max_bytes: int = MAX_BYTES):
+        self.path = path
+        self.graph = graph
+        self.memory_items = memory_items
+        self.max_bytes = max_bytes
+        self.stats = {"hits": 0, "disk_hits": 0, "misses": 0, "stores": 0, "evictions": 0}
+        self._memory: OrderedDict[str, str] = OrderedDict()
+        self._lock = threading.Lock()
+        self._puts = 0
+        self._db = None
+        if path is not None:
+            self._db = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            self._db.executescript(_SCHEMA)
+            # グラフキャッシュが作り直された後の古い結果はここで捨てる
+            self._db.execute("DELETE FROM results WHERE graph != ?", (graph,))
+            self._evict()
+
+    @classmethod
+    def for_graph(cls, cache_path: Path, **kw) -> ResultCache:
+        """グラフキャッシュ隣の <stem>_<形式>_results.sqlite を開く"""
+        return cls(results_path(cache_path), graph_digest(cache_path), **kw)
+
+    @property
+    def spec(self) -> tuple:
+        """別プロセスで同じキャッシュを開くための引数 (ResultCache(*spec))"""
+        return self.path, self.graph, self.memory_items, self.max_bytes
+
+    def key(self, kind: str, **params) -> str:
+        blob = json.dumps([self.graph, kind, params], sort_keys=True, separators=(",", ":"))
+        return hashlib.sha1(blob.encode()).hexdigest()
+
+    def get(self, key: str) -> Any | None:
+        with self._lock:
+            text = self._memory.get(key)
+            if text is not None:
+                self._memory.move_to_end(key)
+                self.stats["hits"] += 1
+                return json.loads(text)
+            row = None
+            if self._db is not None:
+                row = self._db.execute("SELECT value FROM results WHERE key = ? AND graph = ?",
+                                       (key, self.graph)).fetchone()
+            if row is None:
+                self.stats["misses"] += 1
+                return None
+            self._db.execute("UPDATE results SET used = ? WHERE key = ?", (time.time(), key))
+            self.stats["disk_hits"] += 1
+            self._remember(key, row[0])
+            return json.loads(row[0])
+
+    def put(self, key: str, kind: str, value: Any) -> None:
+        text = json.dumps(value, separators=(",", ":"))
+        with self._lock:
+            self._remember(key, text)
+            self.stats["stores"] += 1
+            if self._db is None:
+                return
+            self._db.execute("INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?, ?)",
+                             (key, self.graph, kind, text, len(text), time.time()))
+            self._puts += 1
+            if self._puts % _EVICT_EVERY == 0:
+                self._evict()
+
+    def _remember(self, key: str, text: str) -> None:
+        self._memory[key] = text
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_items:
+            self._memory.popitem(last=False)
+
+    def _evict(self) -> None:
+        """ディスク側を max_bytes の 9 割まで、最終使用の古い順に削る"""
+        total = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM results").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        excess, n = total - self.max_bytes * 9 // 10, 0
+        for (size,) in self._db.execute("SELECT size FROM results ORDER BY used"):
+            if excess <= 0:
+                break
+            excess -= size
+            n += 1
+        self._db.execute("DELETE FROM results WHERE key IN (SELECT key FROM results ORDER BY used LIMIT ?)", (n,))
+        self.stats["evictions"] += n
+
+    def status(self) -> dict:
+        with self._lock:
+            out = {**self.stats, "memory_entries": len(self._memory), "path": str(self.path) if self.path else None}
+            if self._db is not None:
+                out["disk_entries"], out["disk_bytes"] = self._db.execute(
+                    "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM results").fetchone()
+            return out
+
+    def clear(self) -> None:
+        with self._lock:
+            self._memory.clear()
+            if self._db is not None:
+                self._db.execute("DELETE FROM results")
+
+    def close(self) -> None:
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+
+def _cut_by_time(value: Any) -> bool:
+    if isinstance(value, dict):
+        return any((key == "stopped" or key.endswith("_stopped")) and v == "time" or _cut_by_time(v)
+                   for key, v in value.items())
+    if isinstance(value, list):
+        return any(isinstance(v, dict) and _cut_by_time(v) for v in value)
+    return False
+
+
+def cached(cache: ResultCache | None, kind: str, compute: Callable[[], Any], **params) -> Any:
+    """compute() の結果を cache 経由で返す (cache=None なら毎回計算)。時間切れの結果は保存しない"""
+    if cache is None:
+        return compute()
+    key = cache.key(kind, **params)
+    value = cache.get(key)
+    if value is None:
+        value = compute()
+        if not _cut_by_time(value):
+            cache.put(key, kind, value)
+    return value
+
+
+def cached_paths(cache: ResultCache | None, kind: str, compute: Callable[[dict], list[list[int]]],
+                 stats: dict | None = None, **params) -> list[list[int]]:
+    """compute(stats) が返す経路列を cache 経由で返す。ヒット時も保存しておいた stats を書き戻す"""
+    def run() -> dict:
+        st = {}
+        return {"paths": compute(st), "stats": st}
+
+    res = cached(cache, kind, run, **params)
+    if stats is not None:
+        stats.update(res["stats"])
+    return res["paths"]
+
+
+# ---------- 探索関数のキャッシュ付き版 ----------------------------------
+# キーは種別毎に共通なので、CLI・サーバ・バッチのどこで求めた結果も互いに使える。
+
+def cached_l1_paths(cache: ResultCache | None, G, s: int, t: int, k: int | None, *, hier=None,
+                    corridor: float | None = None, weights: Weights | None = None, budget: Budget | None = None,
+                    stats: dict | None = None, backend: str | None = None) -> list[list[int]]:
+    """L1 経路 (hier を渡せば階層探索)。l1_shortest_paths / L2Hierarchy.shortest_paths と同じ結果"""
+    def compute(st: dict) -> list[list[int]]:
+        if hier is not None:
+            return hier.shortest_paths(s, t, k, corridor=corridor, weights=weights, budget=budget, stats=st)
+        return l1_shortest_paths(G, s, t, k, weights=weights, budget=budget, stats=st, backend=backend)
+
+    return cached_paths(cache, "l1", compute, stats, s=s, t=t, k=k, hier=hier is not None, corridor=corridor,
+                        weights=weights or DEFAULT_WEIGHTS, max_expansions=budget.max_expansions if budget else None,
+                        backend=None if hier is not None else backend)
+
+
+def cached_l1l2_paths(cache: ResultCache | None, G, allowed: set[int], s: int, t: int, k: int | None = 5, *,
+                      weights: Weights | None = None, sub=None, budget: Budget | None = None,
+                      stats: dict | None = None, backend: str | None = None) -> list[list[int]]:
+    """l1l2_paths と同じ結果。sub は部分グラフ隣接か、それを返す関数 (ミスした時だけ呼ぶ)"""
+    def compute(st: dict) -> list[list[int]]:
+        return l1l2_paths(G, allowed, s, t, k, weights=weights, sub=sub() if callable(sub) else sub,
+                          budget=budget, stats=st, backend=backend)
+
+    return cached_paths(cache, "l1l2", compute, stats, s=s, t=t, k=k, allowed=node_set_digest(allowed),
+                        weights=weights or DEFAULT_WEIGHTS, max_expansions=budget.max_expansions if budget else None,
+                        backend=backend)
+
+
+# ---------- CLI (状況表示・消去) ----------------------------------------
+def cli() -> argparse.Namespace:
+    p = argparse.ArgumentParser(description="Show or clear the persistent path result cache of a graph cache.")
+    p.add_argument("cache", help="Graph cache file (<prefix>_graph.csr or *.pkl)")
+    p.add_argument("--clear", action="store_true", help="Delete every stored result")
+    return p.parse_args()
+
+
+def main():
+    args = cli()
+    cache_path = Path(args.cache).expanduser().resolve()
+    if not cache_path.exists():
+        sys.exit(f"[!] no graph cache {cache_path}")
+    rc = ResultCache.for_graph(cache_path)
+    if args.clear:
+        rc.clear()
+        print(f"[✓] Cleared {rc.path.name}")
+    st = rc.status()
+    print(f"[i] {rc.path.name}: {st['disk_entries']} results, {st['disk_bytes'] / 2**20:.1f} MB "
+          f"(limit {rc.max_bytes / 2**20:.0f} MB)")
+    rc.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,257 @@
+from __future__ import annotations
+import abc
+from typing import Iterator
+import numpy as np
+import igraph as ig
+import Common_Utility as CU
+from Common_Utility import DEFAULT_WEIGHTS, Budget, Weights, iter_dag_paths
+from instrument import count
+
+# ---------- 探索バックエンド ------------------------------------------
+#
+# L1 / L1+L2 経路探索の実装を名前で差し替える。どれも Common_Utility の
+# iter_l1_paths / iter_l1l2_paths と同じ引数を取り、同じ stats
+# (exhaustive / stopped / paths / cost / expanded) を書き込む。
+#
+#   native   : Common_Utility の Python 実装 (隣接リスト + heapq)。既定
+#   igraph   : 距離計算を igraph (C) で行い、最短経路 DAG / 下界付き最良優先で列挙
+#   scipy    : 同じ方式で距離計算を scipy.sparse.csgraph で行う
+#   networkx : all_shortest_paths / shortest_simple_paths + 赤/青フィルタ (旧 shortest_path.py 方式)
+#
+# 黒の重みは全エッジ共通なので、L1 の距離はホップ数で求めて黒の重みを掛ける。
+# igraph / scipy では距離計算中は予算を消費せず、列挙 1 ステップを展開 1 回と数える。
+
+DEFAULT_BACKEND = "native"
+
+
+class SearchBackend:
+    """Common_Utility の実装をそのまま使うバックエンド"""
+
+    name = "native"
+
+    def iter_l1_paths(self, G: ig.Graph, s: int, t: int, k: int | None = None, *, weights: Weights | None = None,
+                      budget: Budget | None = None, stats: dict | None = None) -> Iterator[list[int]]:
+        return CU.iter_l1_paths(G, s, t, k, weights=weights, budget=budget, stats=stats)
+
+    def iter_l1l2_paths(self, G: ig.Graph, allowed: set[int], s: int, t: int, k: int | None = 5, *,
+                        weights: Weights | None = None, sub: dict[int, list[tuple[int, str]]] | None = None,
+                        budget: Budget | None = None, stats: dict | None = None) -> Iterator[list[int]]:
+        return CU.iter_l1l2_paths(G, allowed, s, t, k, weights=weights, sub=sub, budget=budget, stats=stats)
+
+
+def _check_ids(G: ig.Graph, s: int, t: int) -> None:
+    for v in (s, t):
+        if not 0 <= v < G.vcount():
+            raise ValueError(f"unknown node id: {v}")
+
+
+def _black_edges(G: ig.Graph) -> tuple[np.ndarray, np.ndarray]:
+    return CU._cached_adjacency(G, "black_edges", lambda G: CU.edge_arrays(G, "black")[:2])
+
+
+def _state_edges(adj: dict[int, list[tuple[int, float, bool]]]) -> tuple[dict[int, int], np.ndarray, np.ndarray,
+                                                                         np.ndarray]:
+    """L1+L2 探索の状態グラフ ((ノード, L2 使用済みか) → 番号 2i + f) の有向エッジ (src, dst, w)"""
+    index = {v: i for i, v in enumerate(adj)}
+    src, dst, w = [], [], []
+    for u, nbrs in adj.items():
+        i = index[u]
+        for v, x, l2 in nbrs:
+            j = index.get(v)
+            if j is None:
+                continue
+            for f in (0, 1):
+                src.append(2 * i + f)
+                dst.append(2 * j + (f | l2))
+                w.append(x)
+    return index, np.asarray(src, dtype=np.int64), np.asarray(dst, dtype=np.int64), np.asarray(w, dtype=np.float64)
+
+
+def _bounds_from(index: dict[int, int], d: np.ndarray) -> tuple[dict[int, float], dict[int, float]]:
+    """状態毎の t までの距離配列 d を _l2_lower_bounds と同じ (h0, h1) 形式にする"""
+    h = ({}, {})
+    for v, i in index.items():
+        for f in (0, 1):
+            x = float(d[2 * i + f])
+            if x != float("inf"):
+                h[f][v] = x
+    return h
+
+
+class _DistanceBackend(SearchBackend, abc.ABC):
+    """距離計算をライブラリに任せ、列挙は Common_Utility と同じ手順で行うバックエンドの共通部
+
+    L1: s / t 両側のホップ数から最短経路 DAG (d_s[u] + 1 + d_t[v] == d_s[t] の辺 u→v) を作り
+    iter_dag_paths で列挙する。L1+L2: 状態グラフ上の t までの距離を下界に iter_l1l2_paths を使う。
+    """
+
+    @abc.abstractmethod
+    def hops(self, G: ig.Graph, s: int, t: int) -> tuple[np.ndarray, np.ndarray]:
+        """黒エッジ上の s / t からのホップ数 (到達不能は inf)"""
+
+    @abc.abstractmethod
+    def state_distances(self, n: int, src: np.ndarray, dst: np.ndarray, w: np.ndarray, target: int) -> np.ndarray:
+        """状態グラフ (n 状態) の各状態から target までの距離"""
+
+    def iter_l1_paths(self, G, s, t, k=None, *, weights=None, budget=None, stats=None):
+        _check_ids(G, s, t)
+        budget = budget.start() if budget is not None else None
+        ds, dt = self.hops(G, s, t)
+        best = ds[t]
+        if best == float("inf"):
+            if stats is not None:
+                stats.update(exhaustive=True, stopped=None, paths=0, cost=None, expanded=0)
+            return
+        u, v = _black_edges(G)
+        a, b = np.concatenate((u, v)), np.concatenate((v, u))
+        tight = ds[a] + 1 + dt[b] == best
+        a, b = a[tight], b[tight]
+        order = np.lexsort((a, b))
+        on_dag = np.flatnonzero(ds + dt == best)
+        preds: dict[int, list[int]] = {x: [] for x in on_dag.tolist()}
+        for x, y in zip(a[order].tolist(), b[order].tolist()):
+            preds[y].append(x)
+        count("l1.settled", len(preds))
+        yield from iter_dag_paths(preds, s, t, k, budget=budget, stats=stats)
+        if stats is not None:
+            stats.update(cost=float(best) * (weights or DEFAULT_WEIGHTS).black,
+                         expanded=budget.expanded if budget else len(preds))
+
+    def _l2_bounds(self, adj: dict[int, list[tuple[int, float, bool]]], t: int):
+        index, src, dst, w = _state_edges(adj)
+        # 逆向きに辿れば target (t, 1) からの 1 回の単一始点探索で済む
+        d = self.state_distances(2 * len(index), dst, src, w, 2 * index[t] + 1)
+        return _bounds_from(index, d)
+
+    def iter_l1l2_paths(self, G, allowed, s, t, k=5, *, weights=None, sub=None, budget=None, stats=None):
+        return CU.iter_l1l2_paths(G, allowed, s, t, k, weights=weights, sub=sub, budget=budget, stats=stats,
+                                  bounds=self._l2_bounds)
+
+
+class IGraphBackend(_DistanceBackend):
+    name = "igraph"
+
+    @staticmethod
+    def _black_graph(G: ig.Graph) -> ig.Graph:
+        u, v = _black_edges(G)
+        return ig.Graph(n=G.vcount(), edges=np.column_stack((u, v)).tolist())
+
+    def hops(self, G, s, t):
+        H = CU._cached_adjacency(G, "igraph_black", self._black_graph)
+        d = np.asarray(H.distances(source=[s, t]), dtype=np.float64)
+        return d[0], d[1]
+
+    def state_distances(self, n, src, dst, w, target):
+        S = ig.Graph(n=n, edges=np.column_stack((src, dst)).tolist(), directed=True)
+        return np.asarray(S.distances(source=[target], weights=w.tolist(), mode="out")[0], dtype=np.float64)
+
+
+class ScipyBackend(_DistanceBackend):
+    name = "scipy"
+
+    @staticmethod
+    def _black_matrix(G: ig.Graph):
+        from scipy.sparse import csr_matrix
+
+        u, v = _black_edges(G)
+        n = G.vcount()
+        return csr_matrix((np.ones(len(u), dtype=np.float64), (u, v)), shape=(n, n))
+
+    def hops(self, G, s, t):
+        from scipy.sparse.csgraph import shortest_path
+
+        A = CU._cached_adjacency(G, "scipy_black", self._black_matrix)
+        d = shortest_path(A, method="D", directed=False, unweighted=True, indices=[s, t])
+        return d[0], d[1]
+
+    def state_distances(self, n, src, dst, w, target):
+        from scipy.sparse import csr_matrix
+        from scipy.sparse.csgraph import dijkstra
+
+        # 状態グラフの辺は (状態, 状態) 毎に 1 本なので csr_matrix の重複加算は起きない。0 重みも辺として残る
+        A = csr_matrix((w, (src, dst)), shape=(n, n))
+        return dijkstra(A, directed=True, indices=target)
+
+
+class NetworkXBackend(SearchBackend):
+    name = "networkx"
+
+    @staticmethod
+    def _black_graph(G: ig.Graph):
+        import networkx as nx
+
+        H = nx.Graph()
+        H.add_nodes_from(range(G.vcount()))
+        H.add_edges_from(zip(*(x.tolist() for x in _black_edges(G))))
+        return H
+
+    def iter_l1_paths(self, G, s, t, k=None, *, weights=None, budget=None, stats=None):
+        import networkx as nx
+
+        _check_ids(G, s, t)
+        budget = budget.start() if budget is not None else None
+        H = CU._cached_adjacency(G, "networkx_black", self._black_graph)
+        n_hops = None
+        for p in _enumerate(nx.all_shortest_paths(H, s, t), k, budget, stats):
+            n_hops = len(p) - 1
+            yield p
+        if stats is not None:
+            stats.update(cost=None if n_hops is None else n_hops * (weights or DEFAULT_WEIGHTS).black,
+                         expanded=budget.expanded if budget else stats["paths"])
+
+    def iter_l1l2_paths(self, G, allowed, s, t, k=5, *, weights=None, sub=None, budget=None, stats=None):
+        import networkx as nx
+
+        budget = budget.start() if budget is not None else None
+        if sub is None:
+            sub = CU.subgraph_adjacency(G, allowed)
+        if s not in sub or t not in sub or s == t:
+            yield from _enumerate(iter(()), k, budget, stats)
+            return
+        SG = nx.Graph()
+        SG.add_nodes_from(sub)
+        SG.add_edges_from((u, v, {"color": col}) for u, nbrs in sub.items() for v, col in nbrs)
+        wt = {c: (weights or DEFAULT_WEIGHTS).of(c) for c in Weights._fields}
+        cands = nx.shortest_simple_paths(SG, s, t, weight=lambda a, b, d: wt[d["color"]])
+        yield from _enumerate(cands, k, budget, stats,
+                              accept=lambda p: any(SG[a][b]["color"] != "black" for a, b in zip(p, p[1:])))
+
+
+def _enumerate(cands: Iterator[list[int]], k: int | None, budget: Budget | None, stats: dict | None,
+               accept=None) -> Iterator[list[int]]:
+    """networkx の経路生成器から accept を満たす経路を k 本 / 予算まで取り出し stats を記録する
+
+    候補 1 本の生成を展開 1 回と数える (accept で捨てた候補も含む)。k 本で止めた場合は
+    残りの有無を確かめないので exhaustive=False とする。
+    """
+    import networkx as nx
+
+    n_paths, stopped = 0, None
+    try:
+        while not (k and n_paths >= k):
+            if budget is not None and (stopped := budget.charge()):
+                break
+            p = next(cands, None)
+            if p is None:
+                break
+            if accept is None or accept(p):
+                n_paths += 1
+                yield p
+        else:
+            stopped = "k"
+    except nx.NetworkXNoPath:
+        pass
+    if stats is not None:
+        stats.update(exhaustive=stopped is None, stopped=stopped, paths=n_paths)
+
+
+BACKENDS: dict[str, SearchBackend] = {b.name: b for b in (SearchBackend(), IGraphBackend(), ScipyBackend(),
+                                                          NetworkXBackend())}
+
+
+def get_backend(name: str | None = None) -> SearchBackend:
+    """名前からバックエンドを返す (None = DEFAULT_BACKEND)"""
+    try:
+        return BACKENDS[name or DEFAULT_BACKEND]
+    except KeyError:
+        raise ValueError(f"unknown search backend {name!r} (choose from {', '.join(BACKENDS)})") from None
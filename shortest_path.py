@@ -5,13 +5,15 @@ shortest_path.py   –  L1 最短経路 ⇒ L2 エッジ追加 (比較用プロ
 
 * build_graph() は、質問者さんが提示した Python スニペットと
   **同じロジック** でエッジを生成します。
-* 青＝weight 0, dotted  ；赤＝weight 1 ；黒＝weight 1
+* 青＝weight 0.5, dotted  ；赤＝weight 1 ；黒＝weight 1 (W_BLUE / W_RED / W_BLACK)
 """
 
 from __future__ import annotations
 import argparse, itertools, sys
 from pathlib import Path
 import graphviz, networkx as nx
+from db_parser import parse_dbs
+from instrument import count
 
 # ---------- 重み & 描画パラメータ -------------------------------
 W_BLACK = 1.0        # L1
@@ -39,75 +41,29 @@ def build_graph() -> tuple[nx.Graph, dict[int, str], dict[int, str]]:
     l1_path = root / "1050400_L1-L2_DB.txt"
     l2_path = root / "1050400_L2_DB.txt"
 
-    # ===== L1‑L2 ファイル ======================================
-    lines = l1_path.read_text(encoding="utf-8").splitlines()
-    n_nodes = int(lines[0].split()[0])
-
-    node_labels: dict[int, str] = {}
-    L2code_to_L1num: dict[str, list[int]] = {}
-    L1num_to_L2code: dict[int, str] = {}
+    # ===== DB 解析 (ストリーミング, db_parser) =================
+    db = parse_dbs(l1_path, l2_path)
+    node_labels = db.node_labels
+    L2code_to_L1num = db.L2code_to_L1num
+    L1num_to_L2code = db.L1num_to_L2code
 
     # --- ノード -------------------------------------------------
-    for ln in lines[1 : 1 + n_nodes]:
-        nid = int(ln.split()[0])
-
-        L1s = ln.find("L1  |") + len("L1  |")
-        L1e = ln.find("L2")
-        l1_label = ln[L1s:L1e].strip().replace("|", "\n")
-
-        L2s = ln.find("L2  |") + len("L2  |")
-        L2e = ln.find("#", L2s)
-        l2_label = ln[L2s:L2e].strip()
-
-        label = f"# {nid}\n{l1_label}\n{l2_label}"
+    for nid, label in node_labels.items():
         G.add_node(nid, label=label)
-        node_labels[nid] = label
-
-        L2code_to_L1num.setdefault(l2_label, []).append(nid)
-        L1num_to_L2code[nid] = l2_label
-
-    print("1")
 
     # --- 黒エッジ (L1) -----------------------------------------
-    idx_edges = next(i + 1 for i, ln in enumerate(lines)
-                     if "# number of l1 edges" in ln.lower())
-    for ln in lines[idx_edges:]:
-        sp = ln.split()
-        if len(sp) < 2 or not sp[0].isdigit():
-            continue
-        u, v = map(int, sp[:2])
+    for u, v in db.l1_edges.tolist():
         G.add_edge(u, v, color="black", weight=W_BLACK)
-    print("B")
-
-    # ===== L2 ファイル =========================================
-    lines = l2_path.read_text(encoding="utf-8").splitlines()
-    n_l2_nodes = int(lines[0].split()[0])
-
-    # L2 番号 ↔︎ ラベル
-    L2num_to_code: dict[int, str] = {}
-    for ln in lines[1 : 1 + n_l2_nodes]:
-        idx = ln.find("encode_level: 2 |") + len("encode_level: 2 |")
-        label = ln[idx : ln.find("Connected", idx)].strip()
-        L2num_to_code[int(ln.split()[0])] = label
-
-    idx_edges = next(i + 1 for i, ln in enumerate(lines)
-                     if "# number of l2 edges" in ln.lower())
-    for ln in lines[idx_edges:]:
-        sp = ln.split()
-        if len(sp) < 2 or not sp[0].isdigit():
-            continue
-        a, b = map(int, sp[:2])
-        lab_a = L2num_to_code.get(a)
-        lab_b = L2num_to_code.get(b)
-        if lab_a is None or lab_b is None:
-            continue
+    count("edges.black", G.number_of_edges())
 
+    # ===== 赤エッジ (L2 エッジ → L1 直積) =======================
+    for lab_a, lab_b in db.l2_pairs:
         for u in L2code_to_L1num.get(lab_a, []):
             for v in L2code_to_L1num.get(lab_b, []):
                 if u == v or G.has_edge(u, v):
                     continue
                 G.add_edge(u, v, color="red", weight=W_RED)   # 赤エッジ
-    print("R")
+    count("edges.red", sum(1 for *_, c in G.edges(data="color") if c == "red"))
 
     # ===== 青点線 (同一 L2 ラベル) =============================
     for u in G.nodes():
@@ -116,46 +72,15 @@ def build_graph() -> tuple[nx.Graph, dict[int, str], dict[int, str]]:
                 continue
             if L1num_to_L2code[u] == L1num_to_L2code[v] and not G.has_edge(u, v):
                 G.add_edge(u, v, color="blue", weight=W_BLUE, style="dotted")
-
-    print("B")
+    count("edges.blue", sum(1 for *_, c in G.edges(data="color") if c == "blue"))
 
     return G, node_labels, L1num_to_L2code
 
 def write_edge_lists(G: nx.Graph, out_path: str = "all_edges.txt") -> None:
-    """グラフ G から色別エッジ一覧を out_path に保存"""
-
-    black_edges, red_edges, blue_edges = [], [], []
-    for u, v, data in G.edges(data=True):
-        col = data.get("color", "")
-        if col == "black":
-            black_edges.append((u, v))
-        elif col == "red":
-            red_edges.append((u, v))
-        elif col == "blue":
-            blue_edges.append((u, v))
-
-    def format_edges(edge_list: list[tuple[int, int]]) -> str:
-        """20 組ごとに改行し ‘|’ 区切りで整形"""
-        lines, buf = [], []
-        for i, (u, v) in enumerate(edge_list, 1):
-            buf.append(f"{u}-{v}")
-            if i % 20 == 0:
-                lines.append(" | ".join(buf))
-                buf = []
-        if buf:
-            lines.append(" | ".join(buf))
-        return "\n".join(lines)
-
-    with open(out_path, "w", encoding="utf-8") as f:
-        f.write(f"### Black Edges (L1 edges) - {len(black_edges)} edges\n")
-        f.write(format_edges(black_edges) + "\n\n\n")
-
-        f.write(f"### Red Edges (L2 relationship edges) - {len(red_edges)} edges\n")
-        f.write(format_edges(red_edges) + "\n\n\n")
-
-        f.write(f"### Blue Edges (Same L2 code, dotted) - {len(blue_edges)} edges\n")
-        f.write(format_edges(blue_edges) + "\n\n\n")
+    """グラフ G から色別エッジ一覧を out_path に保存 (edge_export の text 形式)"""
+    from edge_export import columns_from_edges, write_text
 
+    write_text(Path(out_path), columns_from_edges((u, v, d.get("color", "")) for u, v, d in G.edges(data=True)))
     print(f"[+] edge list written → {out_path}")
 
 # ---------- 経路探索 -------------------------------------------
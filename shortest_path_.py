@@ -1,50 +1,393 @@
 from __future__ import annotations
-import argparse, pickle, subprocess, sys
+import argparse, itertools, json, sys
 from pathlib import Path
-from shortest_path_base import l1_shortest_paths, render_graph, auto_prefix
+from typing import Callable
+from Common_Utility import (DEFAULT_WEIGHTS, GOAL_MODES, WEIGHT_PROFILES, Budget, Weights, load_weight_profiles,
+                            parse_weights, path_plan, path_record, path_str, plan_str, auto_prefix)
+from hier_search import L2Hierarchy
+from path_oracle import LAYERS, PathOracle
+from query_args import add_query_args
+from graph_cache import load_or_build, load_or_build_pickle, read_header
+from graph_catalog import GraphCatalog, budget_bytes
+from node_index import default_l1_db, open_index, resolve_plain
+from render_pipeline import COLLAPSE_OVER, RenderQueue, render_graph
+from result_cache import ResultCache, cached_l1_paths, cached_l1l2_paths
+from search_backends import BACKENDS, DEFAULT_BACKEND
+import instrument
 
 # ---------- CLI -------------------------------------------------------
 def cli() -> argparse.Namespace:
     p = argparse.ArgumentParser(description="Shortest‑path solver using cached graph.")
     p.add_argument("--l1l2", default="1020000_L1-L2_DB.txt", help="L1-L2 DB file path")
     p.add_argument("--l2",   default="1020000_L2_DB.txt",    help="L2 DB file path")
-    p.add_argument("-c", "--cache", default=None, help="Pickle cache file (default: auto)")
-    p.add_argument("-s", "--start", type=int, default=0)
-    p.add_argument("-g", "--goal",  type=int, default=25)
-    p.add_argument("-k", "--k_paths", type=int, default=10)
+    p.add_argument("-c", "--cache", default=None, help="Cache file (default: auto, <prefix>_graph.csr; *.pkl = legacy Pickle)")
+    p.add_argument("--catalog", default=".", metavar="DIR", help="Directory scanned for <prefix>_L1-L2_DB.txt / <prefix>_L2_DB.txt pairs (used with --prefix)")
+    p.add_argument("--prefix", default=None, metavar="P[,P2]", help="Query the graph(s) of these catalog prefixes instead of --l1l2/--l2; several prefixes compare the same query across graphs (headless)")
+    p.add_argument("--memory-budget", type=float, default=None, metavar="MB", help="With several --prefix graphs, keep at most this estimated size resident (least recently used are unloaded)")
+    add_query_args(p, goal_modes=GOAL_MODES, backends=tuple(BACKENDS), default_backend=DEFAULT_BACKEND)
+    p.add_argument("--l1-db", default=None, metavar="FILE", help="L1 DB with state hashes for the node index (default: <prefix>_L1_DB.txt or ROBOT_DB_L1.txt beside --l1l2)")
     p.add_argument("--no-view", action="store_true", help="Do not open PDF viewer")
+    p.add_argument("--format", choices=("json", "text"), default=None, help="Headless: print paths to stdout instead of rendering a PDF")
+    p.add_argument("--time-limit", type=float, default=None, help="Stop L1 path enumeration after this many seconds")
+    p.add_argument("--weights-file", default=None, metavar="FILE", help='JSON file of named weight profiles usable in --weights: {"cellA": {"black": 1, "red": 2, "blue": 0.5}, ...}')
+    p.add_argument("--sweep", default=None, metavar="SPECS", help="Run the query once per weight spec (';'-separated, or 'all' profiles) and print costs per profile")
+    p.add_argument("--oracle", action="store_true", help="Also answer from precomputed APSP matrices (build_graph_.py --apsp)")
+    p.add_argument("--batch", default=None, metavar="FILE", help="Batch mode: read 'start goal [k]' rows from FILE ('-' = stdin), write JSON Lines; start/goal take the single-node forms of --start (quote codes containing spaces)")
+    p.add_argument("--workers", type=int, default=None, help="Batch worker processes (default: CPU count)")
+    p.add_argument("--batch-order", choices=("input", "completion"), default="input", help="Order of batch output")
+    p.add_argument("--implicit-l2", action="store_true", help="Build cache with implicit red/blue L2 edges")
+    p.add_argument("--no-result-cache", action="store_true", help="Do not reuse or store path results (<stem>_<suffix>_results.sqlite beside the graph cache)")
+    p.add_argument("--render", action="store_true", help="Batch mode: also render a PDF for every answered row")
+    p.add_argument("--render-workers", type=int, default=2, help="Concurrent Graphviz render jobs")
+    p.add_argument("--render-cache", default=None, help="Content-addressed render cache dir (default: <prefix>/.render_cache)")
+    p.add_argument("--profile", default=None, metavar="FILE", help="Write per-phase timings and counters as JSON (or set SP_PROFILE)")
+    p.add_argument("--trace", default=None, metavar="FILE", help="Write a Chrome trace-event file (or set SP_TRACE)")
+    p.add_argument("--collapse-over", type=int, default=COLLAPSE_OVER, help="Collapse drawings with more L1 nodes than this into L2 classes (0 = never)")
     return p.parse_args()
 
-# ---------- main ------------------------------------------------------
+# ---------- キャッシュ読込 --------------------------------------------
 
-def main():
-    args = cli()
+def resolve_paths(args: argparse.Namespace) -> tuple[Path, Path, Path]:
+    """CLI 引数から (L1-L2 DB, L2 DB, キャッシュ) の絶対パスを決める"""
     l1l2_path = Path(args.l1l2).expanduser().resolve()
     l2_path   = Path(args.l2).expanduser().resolve()
 
     if args.cache is None:
-        args.cache = f"{auto_prefix(l1l2_path)}_graph.pkl"
+        args.cache = f"{auto_prefix(l1l2_path)}_graph.csr"
     cache_path = Path(args.cache).expanduser().resolve()
+    return l1l2_path, l2_path, cache_path
 
-    # --- キャッシュが無ければ自動生成 ------------------------------
-    if not cache_path.exists():
-        print(f"[i] Cache {cache_path.name} not found. Building…")
-        subprocess.run([sys.executable, "build_graph_.py", "--l1l2", str(l1l2_path), "--l2", str(l2_path), "--cache", str(cache_path)], check=True)
 
-    # --- 読込 --------------------------------------------------------
-    with cache_path.open("rb") as f:
-        G, node_labels, L1num_to_L2code = pickle.load(f)
-    print(f"[✓] Cache loaded (|V|={G.number_of_nodes()}, |E|={G.number_of_edges()})")
+def load_graph(l1l2_path: Path, l2_path: Path, cache_path: Path, *, implicit_l2: bool = False, log=sys.stdout):
+    """キャッシュを読み込む (無い/古い場合は生成)。*.pkl は旧 Pickle 形式
 
-    # --- 経路探索 ----------------------------------------------------
+    *.csr は mmap した CSRGraph をそのまま返し (探索・描画とも igraph へ変換しない)、*.pkl は igraph。
+    """
+    if cache_path.suffix != ".pkl":
+        cache = load_or_build(l1l2_path, l2_path, cache_path, implicit_l2=implicit_l2 or None, log=log)
+        G = cache.csr
+        print(f"[✓] Cache loaded (|V|={G.vcount()}, |E|={G.ecount()})", file=log)
+        return G, cache.labels, cache.L1num_to_L2code
+
+    try:
+        (G, node_labels, L1num_to_L2code), _ = load_or_build_pickle(l1l2_path, l2_path, cache_path,
+                                                                    implicit_l2=implicit_l2, log=log)
+    except ValueError as exc:
+        sys.exit(f"[!] {exc}")
+    print(f"[✓] Cache loaded (|V|={G.vcount()}, |E|={G.ecount()})", file=log)
+    return G, node_labels, L1num_to_L2code
+
+def node_resolver(args: argparse.Namespace, node_labels, L1num_to_L2code: dict[int, str], l1l2_path: Path,
+                  l2_path: Path, cache_path: Path, log=sys.stdout) -> Callable[[str], list[int]]:
+    """ノード指定 → 番号列の関数 (番号以外の指定が来たときに初めてノード索引を開く)"""
+    index = None
+
+    def resolve(ident: str) -> list[int]:
+        nonlocal index
+        plain = resolve_plain(ident)
+        if plain is not None:
+            return plain
+        if index is None:
+            l1_db = Path(args.l1_db).expanduser().resolve() if args.l1_db else default_l1_db(l1l2_path)
+            index = open_index(cache_path, node_labels, L1num_to_L2code, l2_path, l1_db, log=log)
+        return index.resolve(ident)
+
+    return resolve
+
+
+def resolve_endpoints(args: argparse.Namespace, G, node_labels, L1num_to_L2code: dict[int, str], l1l2_path: Path,
+                      l2_path: Path, cache_path: Path, log=sys.stdout) -> tuple[list[int], list[int]]:
+    """--start / --goal をノード番号列に解決する (番号以外の指定はノード索引で引く)"""
+    resolve = node_resolver(args, node_labels, L1num_to_L2code, l1l2_path, l2_path, cache_path, log)
+    try:
+        ends = [resolve(x) for x in (args.start, args.goal)]
+    except (OSError, ValueError) as exc:
+        sys.exit(f"[!] {exc}")
+    for nodes in ends:
+        bad = [v for v in nodes if not 0 <= v < G.vcount()]
+        if bad:
+            sys.exit(f"[!] unknown node id: {bad[0]}")
+    return ends[0], ends[1]
+
+
+def find_paths(G, H, s: int, t: int, k: int | None, args: argparse.Namespace, weights: Weights,
+               log=sys.stdout, cache: ResultCache | None = None) -> list[list[int]]:
+    """s→t の L1 経路 (--hier / --corridor 指定時は階層探索)"""
+    stats = {}
+    try:
+        paths = cached_l1_paths(cache, G, s, t, k, hier=H, corridor=args.corridor, weights=weights, stats=stats,
+                                backend=args.backend, budget=Budget(args.time_limit, args.max_expansions))
+    except ValueError as exc:
+        sys.exit(f"[!] {exc}")
+    if H is not None:
+        print(f"[i] hierarchical search expanded {stats['expanded']} L1 nodes", file=log)
+    if stats.get("stopped") in ("time", "expansions"):
+        print(f"[i] Enumeration cut off by {stats['stopped']} budget after {stats['paths']} paths "
+              f"({stats['expanded']} expansions)", file=log)
+    return paths
+
+# ---------- main ------------------------------------------------------
+
+def emit(G, s: int, t: int, k: int | None, l1_paths: list[list[int]], fmt: str, out=sys.stdout, *,
+         weights: Weights | None = None, plan: bool = False, backend: str | None = None, tag: dict | None = None,
+         cache: ResultCache | None = None) -> None:
+    """ヘッドレス出力: L1 / L1+L2 経路のノード列・コスト・エッジ色 (plan=True で操作プランも)
+
+    tag は JSON 出力の先頭に加えるキー (グラフ比較時の prefix など)。
+    """
+    allowed = set(itertools.chain.from_iterable(l1_paths))
+    l1l2 = cached_l1l2_paths(cache, G, allowed, s, t, k or 5, weights=weights, backend=backend) if l1_paths else []
+    if fmt == "json":
+        out.write(json.dumps({**(tag or {}), "start": s, "goal": t, "k": k,
+                              "l1_paths": [path_record(G, p, weights, plan=plan) for p in l1_paths],
+                              "l1l2_paths": [path_record(G, p, weights, plan=plan) for p in l1l2]}) + "\n")
+        return
+    for name, paths in (("L1", l1_paths), ("L1+L2", l1l2)):
+        for i, p in enumerate(paths, 1):
+            rec = path_record(G, p, weights)
+            out.write(f"{name:<8} {i}: cost={rec['cost']:g}  {path_str(G, p)}\n")
+            if plan:
+                out.write(plan_str(path_plan(G, p)) + "\n")
+
+
+def emit_goal_set(G, res: dict, fmt: str, out=sys.stdout, *, weights: Weights | None = None,
+                  plan: bool = False, tag: dict | None = None) -> None:
+    """batch_query.solve_goal_set の結果を emit と同じ形式で出力"""
+    if res["mode"] == "all":
+        if fmt == "json":
+            out.write(json.dumps({**(tag or {}), **res}) + "\n")
+            return
+        for row in res["distances"]:
+            if row["path"] is None:
+                out.write(f"goal {row['goal']}: unreachable\n")
+                continue
+            out.write(f"goal {row['goal']}: cost={row['cost']:g}  {path_str(G, row['path'])}\n")
+            if plan:
+                out.write(plan_str(row["plan"]) + "\n")
+        return
+    if fmt == "json":
+        rec = {**(tag or {}), **{key: val for key, val in res.items() if not key.endswith("_plans")}}
+        for key in ("l1_paths", "l1l2_paths"):
+            rec[key] = [path_record(G, p, weights, plan=plan) for p in res[key]]
+        out.write(json.dumps(rec) + "\n")
+        return
+    out.write(f"nearest  {', '.join(map(str, res['nearest'])) or '-'} of {res['goal_count']} goals\n")
+    for name, key in (("L1", "l1_paths"), ("L1+L2", "l1l2_paths")):
+        for i, p in enumerate(res[key], 1):
+            rec = path_record(G, p, weights)
+            out.write(f"{name:<8} {i}: cost={rec['cost']:g}  {path_str(G, p)}\n")
+            if plan:
+                out.write(plan_str(path_plan(G, p)) + "\n")
+
+
+def answer(G, H, starts: list[int], goals: list[int], k: int | None, args: argparse.Namespace, weights: Weights,
+           log=sys.stdout, tag: dict | None = None, cache: ResultCache | None = None) -> None:
+    """始点毎にヘッドレス出力する。終点が複数なら終点集合への 1 回の探索で答える"""
+    from batch_query import solve_goal_set
+    for s in starts:
+        if len(goals) == 1:
+            emit(G, s, goals[0], k, find_paths(G, H, s, goals[0], k, args, weights, log, cache), args.format,
+                 weights=weights, plan=args.plan, backend=args.backend, tag=tag, cache=cache)
+            continue
+        try:
+            res = solve_goal_set(G, s, goals, k, mode=args.goal_mode, weights=weights, time_limit=args.time_limit,
+                                 max_expansions=args.max_expansions, plan=args.plan, backend=args.backend,
+                                 cache=cache)
+        except ValueError as exc:
+            sys.exit(f"[!] {exc}")
+        emit_goal_set(G, res, args.format, weights=weights, plan=args.plan, tag=tag)
+
+
+def compare_graphs(catalog: GraphCatalog, prefixes: list[str], args: argparse.Namespace, weights: Weights,
+                   log=sys.stdout) -> None:
+    """同じ --start / --goal を各プレフィックスのグラフで解いて並べる (指定はグラフ毎に解決)"""
     k = args.k_paths if args.k_paths > 0 else None
-    paths = l1_shortest_paths(G, args.start, args.goal, k)
+    for prefix in prefixes:
+        g = catalog.get(prefix)
+        try:
+            starts, goals = g.resolve(args.start, log), g.resolve(args.goal, log)
+            bad = [v for v in itertools.chain(starts, goals) if not 0 <= v < g.G.vcount()]
+            if bad:
+                raise ValueError(f"unknown node id: {bad[0]}")
+        except (OSError, ValueError) as exc:
+            # あるグラフに無いノードでも他のグラフの比較は続ける
+            if args.format == "json":
+                sys.stdout.write(json.dumps({"prefix": prefix, "start": args.start, "goal": args.goal,
+                                             "error": str(exc)}) + "\n")
+            else:
+                sys.stdout.write(f"[{prefix}] error: {exc}\n")
+            continue
+        if args.format == "text":
+            sys.stdout.write(f"[{prefix}] |V|={g.G.vcount()} |E|={g.G.ecount()}  {len(starts)} start x "
+                             f"{len(goals)} goal nodes\n")
+        H = g.hier if args.hier or args.corridor is not None else None
+        answer(g.G, H, starts, goals, k, args, weights, log, tag={"prefix": prefix}, cache=g.results())
+        report_cache(g.results(), log, prefix)
+    st = catalog.stats
+    print(f"[✓] compared {len(prefixes)} graphs ({st['loads']} loads, {st['evictions']} evictions)", file=log)
+
+
+def report_cache(stats: dict | ResultCache | None, log=sys.stdout, label: str = "") -> None:
+    """結果キャッシュの hit / miss を 1 行で表示"""
+    if isinstance(stats, ResultCache):
+        stats = stats.stats
+    if stats and any(stats.values()):
+        print(f"[i] result cache{f' ({label})' if label else ''}: {stats.get('hits', 0) + stats.get('disk_hits', 0)} hits "
+              f"({stats.get('disk_hits', 0)} from disk), {stats.get('misses', 0)} misses", file=log)
+
+
+def sweep_profiles(spec: str, profiles: dict[str, Weights]) -> dict[str, Weights]:
+    """--sweep 指定 ("all" または ';' 区切りの重み指定) → {表示名: Weights}"""
+    if spec.strip() == "all":
+        return dict(profiles)
+    return {part.strip(): parse_weights(part, profiles) for part in spec.split(";") if part.strip()}
+
+
+def emit_sweep(G, results, fmt: str, out=sys.stdout) -> None:
+    """batch_query.sweep の結果をプロファイル毎に出力"""
+    for res in results:
+        if fmt == "json":
+            out.write(json.dumps(res) + "\n")
+            continue
+        w = res["weights"]
+        out.write(f"[{res['profile']}] black={w['black']:g} red={w['red']:g} blue={w['blue']:g}\n")
+        for name, key in (("L1", "l1_paths"), ("L1+L2", "l1l2_paths")):
+            for i, rec in enumerate(res[key], 1):
+                out.write(f"{name:<8} {i}: cost={rec['cost']:g}  {path_str(G, rec['nodes'])}\n")
+
+
+def main():
+    args = cli()
+    instrument.setup(args.profile, args.trace)
+    prefixes = [x.strip() for x in args.prefix.split(",") if x.strip()] if args.prefix else []
+    if prefixes:
+        catalog = GraphCatalog.scan(Path(args.catalog).expanduser().resolve(),
+                                    memory_budget=budget_bytes(args.memory_budget), implicit_l2=args.implicit_l2 or None,
+                                    result_cache=not args.no_result_cache, log=sys.stderr if args.format else sys.stdout)
+        try:
+            entries = [catalog.entry(x) for x in prefixes]
+        except ValueError as exc:
+            sys.exit(f"[!] {exc}")
+        if len(entries) == 1:
+            e = entries[0]
+            args.l1l2, args.l2 = str(e.l1l2), str(e.l2)
+            args.cache = args.cache or str(e.cache)
+            args.l1_db = args.l1_db or (str(e.l1_db) if e.l1_db else None)
+        elif not args.format or args.sweep or args.batch or args.oracle or args.cache:
+            sys.exit("[!] several --prefix graphs are compared headless only: use --format json|text "
+                     "(without --sweep, --batch, --oracle or --cache)")
+    l1l2_path, l2_path, cache_path = resolve_paths(args)
+    try:
+        profiles = load_weight_profiles(Path(args.weights_file)) if args.weights_file else WEIGHT_PROFILES
+        weights = parse_weights(args.weights, profiles)
+        sweep = sweep_profiles(args.sweep, profiles) if args.sweep else None
+    except (OSError, ValueError) as exc:
+        sys.exit(f"[!] {exc}")
+    if sweep is not None and args.batch:
+        sys.exit("[!] --sweep answers one --start/--goal query; it cannot be combined with --batch")
+    log = sys.stderr if args.batch or args.format or sweep else sys.stdout
+
+    # --- 複数グラフの比較 --------------------------------------------
+    if len(prefixes) > 1:
+        compare_graphs(catalog, prefixes, args, weights, log)
+        return
+
+    G, node_labels, L1num_to_L2code = load_graph(l1l2_path, l2_path, cache_path, implicit_l2=args.implicit_l2, log=log)
+
+    cache = None if args.no_result_cache else ResultCache.for_graph(cache_path)
+    out_prefix = prefixes[0] if prefixes else auto_prefix(l1l2_path)
+    cache_dir = Path(args.render_cache) if args.render_cache else Path(out_prefix) / ".render_cache"
+    draw = dict(L1num_to_L2code=L1num_to_L2code, collapse_over=args.collapse_over or None)
+
+    # --- バッチモード ------------------------------------------------
+    if args.batch:
+        from batch_query import read_rows, run_batch
+        from graph_csr import CSRGraph
+        default_k = args.k_paths if args.k_paths > 0 else None
+        src = sys.stdin if args.batch == "-" else open(args.batch, encoding="utf-8")
+        with src, RenderQueue(cache_dir, workers=args.render_workers, log=sys.stderr) as queue:
+            def on_result(res: dict) -> None:
+                if args.render and res.get("l1_paths"):
+                    render_graph(queue, G, node_labels, res["start"], res["goal"], res["l1_paths"], out_prefix,
+                                 l1l2=res["l1l2_paths"], **draw)
+
+            cache_stats = {}
+            csr = G if isinstance(G, CSRGraph) else CSRGraph.from_igraph(G, L1num_to_L2code)
+            resolve = node_resolver(args, node_labels, L1num_to_L2code, l1l2_path, l2_path, cache_path, sys.stderr)
+            n = run_batch(csr, read_rows(src, default_k, resolve, csr.n),
+                          workers=args.workers, ordered=args.batch_order == "input", weights=weights,
+                          plan=args.plan, backend=args.backend, time_limit=args.time_limit,
+                          max_expansions=args.max_expansions, hier=args.hier, corridor=args.corridor,
+                          cache=cache, cache_stats=cache_stats,
+                          on_result=on_result)
+        print(f"[✓] {n} batch queries answered", file=sys.stderr)
+        report_cache(cache_stats, sys.stderr)
+        if args.render:
+            print(f"[✓] renders: {queue.stats}", file=sys.stderr)
+        return
+
+    # --- 始点・終点の解決 --------------------------------------------
+    starts, goals = resolve_endpoints(args, G, node_labels, L1num_to_L2code, l1l2_path, l2_path, cache_path, log)
+    k = args.k_paths if args.k_paths > 0 else None
+    H = L2Hierarchy(G, L1num_to_L2code) if args.hier or args.corridor is not None else None
+    if len(starts) * len(goals) > 1:
+        # 複数ノードに展開された指定: 始点毎に、終点が複数なら終点集合への 1 回の探索で答える
+        if not args.format or sweep is not None:
+            sys.exit(f"[!] --start/--goal resolve to {len(starts)} x {len(goals)} nodes; "
+                     "multi-node queries need --format json|text (and no --sweep)")
+        print(f"[i] {len(starts)} start x {len(goals)} goal nodes", file=log)
+        if len(goals) > 1 and H is not None:
+            print("[i] --hier/--corridor apply to single goals; goal sets use one Dijkstra per start", file=log)
+        answer(G, H, starts, goals, k, args, weights, log, cache=cache)
+        report_cache(cache, log)
+        return
+    args.start, args.goal = starts[0], goals[0]
+
+    # --- 重みスイープ ------------------------------------------------
+    if sweep is not None:
+        from batch_query import sweep as run_sweep
+        emit_sweep(G, run_sweep(G, args.start, args.goal, k, sweep, hier=H, corridor=args.corridor,
+                                time_limit=args.time_limit, max_expansions=args.max_expansions, backend=args.backend,
+                                cache=cache),
+                   args.format or "text")
+        print(f"[✓] swept {len(sweep)} weight profiles", file=log)
+        report_cache(cache, log)
+        return
+
+    # --- 経路探索 ----------------------------------------------------
+    paths = find_paths(G, H, args.start, args.goal, k, args, weights, log, cache)
 
+    # --- Graphviz 描画 (バックグラウンド) ---------------------------
+    queue = None if args.format else RenderQueue(cache_dir, workers=args.render_workers)
+    try:
+        if queue is not None:
+            l1l2 = cached_l1l2_paths(cache, G, set(itertools.chain.from_iterable(paths)), args.start, args.goal,
+                                     k or 5, weights=weights, backend=args.backend) if paths else []
+            job = render_graph(queue, G, node_labels, args.start, args.goal, paths, out_prefix, k=k, l1l2=l1l2,
+                               view=not args.no_view, **draw)
 
+        if args.oracle and weights != DEFAULT_WEIGHTS:
+            print("[i] APSP oracle holds default-weight distances; skipped for custom --weights", file=log)
+        elif args.oracle:
+            head = read_header(cache_path) if cache_path.suffix != ".pkl" else None
+            for layer in LAYERS:
+                if not PathOracle.exists(cache_path, layer, head[0]["layer_hash"][layer] if head else None):
+                    print(f"[i] No up-to-date APSP oracle for {layer} layer (run build_graph_.py --apsp)", file=log)
+                    continue
+                oracle = PathOracle.load(cache_path, layer)
+                d = oracle.distance(args.start, args.goal)
+                print(f"[i] oracle {layer:<5}: dist={d:g} path={oracle.path(args.start, args.goal)}", file=log)
 
-    # --- Graphviz 描画 ---------------------------------------------
-    out_prefix = auto_prefix(l1l2_path)
-    render_graph(G, node_labels, args.start, args.goal, paths, out_prefix, k=k)
+        # --- ヘッドレス出力 ------------------------------------------
+        if args.format:
+            emit(G, args.start, args.goal, k, paths, args.format, weights=weights, plan=args.plan, backend=args.backend,
+                 cache=cache)
+            report_cache(cache, log)
+            return
+        job.result()
+    finally:
+        if queue is not None:
+            queue.close()
     if args.no_view:
         print("[i] PDF rendered (viewer suppressed by --no-view)")
 
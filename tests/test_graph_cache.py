@@ -0,0 +1,59 @@
+import pickle
+import shutil
+from pathlib import Path
+
+import igraph as ig
+import networkx as nx
+import pytest
+
+from graph_cache import _load_pickle, load_or_build_pickle
+
+REPO = Path(__file__).resolve().parent.parent
+
+
+def _db(tmp_path: Path) -> tuple[Path, Path]:
+    l1l2, l2 = tmp_path / "1020000_L1-L2_DB.txt", tmp_path / "1020000_L2_DB.txt"
+    shutil.copy(REPO / l1l2.name, l1l2)
+    shutil.copy(REPO / l2.name, l2)
+    return l1l2, l2
+
+
+def _dump(path: Path, data) -> Path:
+    with path.open("wb") as f:
+        pickle.dump(data, f)
+    return path
+
+
+@pytest.mark.parametrize("data", [
+    (nx.Graph([(0, 1)]), {0: "a", 1: "b"}, {}),   # networkx 時代のキャッシュ
+    {"graph": None},
+    (ig.Graph(2), {}),
+])
+def test_non_igraph_pickle_is_rejected(tmp_path, data):
+    path = _dump(tmp_path / "old_graph.pkl", data)
+    with pytest.raises(ValueError, match="legacy cache format"):
+        _load_pickle(path)
+
+
+def test_truncated_pickle_is_unreadable(tmp_path):
+    path = tmp_path / "old_graph.pkl"
+    path.write_bytes(pickle.dumps((ig.Graph(2), {}, {}))[:10])
+    assert _load_pickle(path) is None
+
+
+def test_legacy_pickle_is_not_overwritten(tmp_path):
+    l1l2, l2 = _db(tmp_path)
+    path = _dump(tmp_path / "1020000_graph.pkl", (nx.Graph([(0, 1)]), {}, {}))
+    before = path.read_bytes()
+    with pytest.raises(ValueError):
+        load_or_build_pickle(l1l2, l2, path)
+    assert path.read_bytes() == before
+
+
+def test_force_rebuilds_legacy_pickle(tmp_path):
+    l1l2, l2 = _db(tmp_path)
+    path = _dump(tmp_path / "1020000_graph.pkl", (nx.Graph([(0, 1)]), {}, {}))
+    (G, _, _), rebuilt = load_or_build_pickle(l1l2, l2, path, force=True)
+    assert rebuilt and isinstance(G, ig.Graph) and G.vcount() > 0
+    (G2, _, _), rebuilt = load_or_build_pickle(l1l2, l2, path)
+    assert not rebuilt and G2.ecount() == G.ecount()